@@ -40,3 +40,5 @@ except Exception as exc:
 API_URL_ROOT = os.environ.get("API_URL_ROOT", "https://api.iri.nersc.gov")
 API_PREFIX = os.environ.get("API_PREFIX", "/")
 API_URL = os.environ.get("API_URL", "api/v1")
+# the prefix of every link returned by the api
+API_BASE_URL = f"{API_URL_ROOT}{API_PREFIX}{API_URL}"
@@ -1,3 +1,4 @@
+import asyncio
 import datetime
 import random
 import uuid
@@ -10,16 +11,29 @@ import glob
 import subprocess
 import pathlib
 import base64
+import collections
 from pydantic import BaseModel
-from typing import Any, Tuple
+from typing import Any, AsyncIterator, Tuple
 from fastapi import HTTPException
-from .routers.status import models as status_models, facility_adapter as status_adapter
+from .routers.status import models as status_models, facility_adapter as status_adapter, store as status_store, columns as status_columns, partitions as status_partitions
 from .routers.account import models as account_models, facility_adapter as account_adapter
 from .routers.compute import models as compute_models, facility_adapter as compute_adapter
 from .routers.filesystem import models as filesystem_models, facility_adapter as filesystem_adapter
 from .routers.task import models as task_models, facility_adapter as task_adapter
+from . import status_generator
 
 DEMO_QUEUE_UPDATE_SECS = 5
+DEMO_STATUS_UPDATE_SECS = 5
+# keep the events in compact columns rather than as models
+DEMO_COLUMNAR_EVENTS = os.environ.get("DEMO_COLUMNAR_EVENTS") in ["true", "1", "on", "yes"]
+# keep the status events in monthly partitions, dropping the months that ended more than this many days ago
+DEMO_EVENT_RETENTION_DAYS = os.environ.get("DEMO_EVENT_RETENTION_DAYS")
+# keep the compacted months of the partitions in memory-mapped files in this directory, shared by the workers
+DEMO_EVENT_SEGMENTS_DIR = os.environ.get("DEMO_EVENT_SEGMENTS_DIR")
+# generate the status data with the synthetic data generator (sized by the IRI_STATUS_GEN_* variables)
+DEMO_STATUS_GENERATOR = "IRI_STATUS_GEN_EVENTS" in os.environ
+# the number of events of a batch added at a time, between which other requests are served
+DEMO_INGEST_CHUNK = 1000
 
 class PathSandbox:
     _base_temp_dir = None
@@ -44,14 +58,28 @@ class DemoAdapter(status_adapter.FacilityAdapter, account_adapter.FacilityAdapte
                   compute_adapter.FacilityAdapter, filesystem_adapter.FacilityAdapter,
                   task_adapter.FacilityAdapter):
     def __init__(self):
-        self.resources = []
-        self.incidents = []
-        self.events = []
+        events = None
+        if DEMO_EVENT_RETENTION_DAYS or DEMO_EVENT_SEGMENTS_DIR:
+            events = status_partitions.PartitionedEvents(
+                retention=datetime.timedelta(days=float(DEMO_EVENT_RETENTION_DAYS)) if DEMO_EVENT_RETENTION_DAYS else None,
+                directory=DEMO_EVENT_SEGMENTS_DIR,
+                mapped=DEMO_EVENT_SEGMENTS_DIR is not None,
+            )
+        elif DEMO_COLUMNAR_EVENTS:
+            events = status_columns.EventColumns()
+        self.status_store = status_store.StatusStore(events)
         self.capabilities = {}
         self.user = account_models.User(id="gtorok", name="Gabor Torok", api_key="12345", client_ip="1.2.3.4")
         self.projects = []
         self.project_allocations = []
         self.user_allocations = []
+        # the account entities by id, and the allocations by their parent's id
+        self.capabilities_by_id = {}
+        self.projects_by_id = {}
+        self.project_allocations_by_id = {}
+        self.user_allocations_by_id = {}
+        self.project_allocations_by_project = collections.defaultdict(list)
+        self.user_allocations_by_project_allocation = collections.defaultdict(list)
 
         self._init_state()
 
@@ -72,7 +100,7 @@ class DemoAdapter(status_adapter.FacilityAdapter, account_adapter.FacilityAdapte
         hpss = status_models.Resource(id=str(uuid.uuid4()), group="hpss", name="hpss", description="hpss tape storage", capability_ids=[self.capabilities["hpss"].id], current_status=status_models.Status.up, last_modified=day_ago, resource_type=status_models.ResourceType.storage)
         cfs = status_models.Resource(id=str(uuid.uuid4()), group="cfs", name="cfs", description="cfs storage", capability_ids=[self.capabilities["gpfs"].id], current_status=status_models.Status.up, last_modified=day_ago, resource_type=status_models.ResourceType.storage)
 
-        self.resources = [
+        resources = [
             pm,
             hpss,
             cfs,
@@ -129,7 +157,15 @@ class DemoAdapter(status_adapter.FacilityAdapter, account_adapter.FacilityAdapte
                     )
                 )
 
-        statuses = { r.name: status_models.Status.up for r in self.resources }
+        self._index_accounts()
+
+        if DEMO_STATUS_GENERATOR:
+            status_generator.StatusGenerator(capability_ids=[c.id for c in self.capabilities.values()]).generate(self.status_store)
+            return
+
+        incidents = []
+        events = []
+        statuses = { r.name: status_models.Status.up for r in resources }
         last_incidents = {}
         d = datetime.datetime(2025, 3, 1, 10, 0, 0, tzinfo=datetime.timezone.utc)
 
@@ -137,7 +173,7 @@ class DemoAdapter(status_adapter.FacilityAdapter, account_adapter.FacilityAdapte
         # here every incident only has events from a single resource,
         # but in reality it is possible for an incident to have events from multiple resources
         for _i in range(0, 1000):
-            r = random.choice(self.resources)
+            r = random.choice(resources)
             status = statuses[r.name]
             event = status_models.Event(
                 id=str(uuid.uuid4()),
@@ -148,7 +184,7 @@ class DemoAdapter(status_adapter.FacilityAdapter, account_adapter.FacilityAdapte
                 resource_id=r.id,
                 last_modified=day_ago,
             )
-            self.events.append(event)
+            events.append(event)
             if r.name in last_incidents:
                 inc = last_incidents[r.name]
                 event.incident_id = inc.id
@@ -169,19 +205,24 @@ class DemoAdapter(status_adapter.FacilityAdapter, account_adapter.FacilityAdapte
                         description=f"{r.name} incident at {dstr}",
                         status=status_models.Status.down,
                         event_ids=[],
-                        resource_ids=random.choices([r.id for r in self.resources], k=3),
+                        resource_ids=random.choices([r.id for r in resources], k=3),
                         start=d,
                         end=d,
                         type=random.choice(list(status_models.IncidentType)),
                         resolution=random.choice(list(status_models.Resolution)),
                         last_modified=d
                     )
-                    self.incidents.append(incident)
+                    incidents.append(incident)
                     last_incidents[r.name] = incident
 
 
             d += datetime.timedelta(minutes=int(random.random() * 15 + 1))
 
+        # the generated objects are still modified while generating (eg. incident end, event incident_id),
+        # so index them once they are final
+        self.status_store.add_resources(resources)
+        self.status_store.add_incidents(incidents)
+        self.status_store.add_events(events)
 
     async def get_resources(
         self : "DemoAdapter",
@@ -192,15 +233,18 @@ class DemoAdapter(status_adapter.FacilityAdapter, account_adapter.FacilityAdapte
         group : str | None = None,
         modified_since : datetime.datetime | None = None,
         resource_type : status_models.ResourceType | None = None,
+        after : tuple | None = None,
+        q : str | None = None,
+        as_of : datetime.datetime | None = None,
         ) -> list[status_models.Resource]:
-        return status_models.Resource.find(self.resources, name, description, group, modified_since, resource_type)[offset:offset + limit]
+        return self.status_store.find_resources(offset, limit, name, description, group, modified_since, resource_type, after, q, as_of)
 
 
     async def get_resource(
         self : "DemoAdapter",
         id : str
         ) -> status_models.Resource:
-        return status_models.Resource.find_by_id(self.resources, id)
+        return self.status_store.get_resource(id)
 
 
     async def get_events(
@@ -216,8 +260,10 @@ class DemoAdapter(status_adapter.FacilityAdapter, account_adapter.FacilityAdapte
         to : datetime.datetime | None = None,
         time_ : datetime.datetime | None = None,
         modified_since : datetime.datetime | None = None,
+        after : tuple | None = None,
+        q : str | None = None,
         ) -> list[status_models.Event]:
-        return status_models.Event.find([e for e in self.events if e.incident_id == incident_id], resource_id, name, description, status, from_, to, time_, modified_since)[offset:offset + limit]
+        return self.status_store.find_events(offset, limit, incident_id, resource_id, name, description, status, from_, to, time_, modified_since, after, q)
 
 
     async def get_event(
@@ -225,7 +271,7 @@ class DemoAdapter(status_adapter.FacilityAdapter, account_adapter.FacilityAdapte
         incident_id : str,
         id : str
         ) -> status_models.Event:
-        return status_models.Event.find_by_id(self.events, id)
+        return self.status_store.get_event(id, incident_id)
 
 
     async def get_incidents(
@@ -241,15 +287,163 @@ class DemoAdapter(status_adapter.FacilityAdapter, account_adapter.FacilityAdapte
         time_ : datetime.datetime | None = None,
         modified_since : datetime.datetime | None = None,
         resource_id : str | None = None,
+        after : tuple | None = None,
+        q : str | None = None,
         ) -> list[status_models.Incident]:
-        return status_models.Incident.find(self.incidents, name, description, status, type, from_, to, time_, modified_since, resource_id)[offset:offset + limit]
+        return self.status_store.find_incidents(offset, limit, name, description, status, type, from_, to, time_, modified_since, resource_id, after, q)
 
 
     async def get_incident(
         self : "DemoAdapter",
         id : str
         ) -> status_models.Incident:
-        return status_models.Incident.find_by_id(self.incidents, id)
+        return self.status_store.get_incident(id)
+
+
+    async def get_resources_by_ids(
+        self : "DemoAdapter",
+        ids : list[str],
+        ) -> list[status_models.Resource]:
+        return self.status_store.get_many("resources", ids)
+
+
+    async def get_incidents_by_ids(
+        self : "DemoAdapter",
+        ids : list[str],
+        ) -> list[status_models.Incident]:
+        return self.status_store.get_many("incidents", ids)
+
+
+    async def get_events_by_ids(
+        self : "DemoAdapter",
+        incident_id : str,
+        ids : list[str],
+        ) -> list[status_models.Event]:
+        return [e for e in self.status_store.get_many("events", ids) if e.incident_id == incident_id]
+
+
+    async def get_incidents_events(
+        self : "DemoAdapter",
+        incident_ids : list[str],
+        limit : int,
+        ) -> dict[str, list[status_models.Event]]:
+        return self.status_store.incidents_events(incident_ids, limit)
+
+
+    async def get_version(
+        self : "DemoAdapter",
+        collection : str,
+        ) -> tuple[str, datetime.datetime | None]:
+        return self.status_store.get_version(collection)
+
+
+    async def get_changes(
+        self : "DemoAdapter",
+        since : str | None,
+        limit : int,
+        ) -> status_models.StatusChanges:
+        return self.status_store.get_changes(since, limit)
+
+
+    async def ingest_events(
+        self : "DemoAdapter",
+        events : list[status_models.Event],
+        ) -> status_models.EventBatchResult:
+        # in chunks in key order: the resources' statuses and the incidents' events end up as if the batch was added at once
+        events = sorted(events, key=status_store.cursor_key)
+        resources, incidents = set(), set()
+        for i in range(0, len(events), DEMO_INGEST_CHUNK):
+            updated = self.status_store.ingest_events(events[i:i + DEMO_INGEST_CHUNK])
+            resources.update(r.id for r in updated[0])
+            incidents.update(incident.id for incident in updated[1])
+            await asyncio.sleep(0)
+        return status_models.EventBatchResult(events=len(events), resources=len(resources), incidents=len(incidents))
+
+
+    async def get_availability(
+        self : "DemoAdapter",
+        resource_id : str,
+        boundaries : list[datetime.datetime],
+        ) -> list[status_models.AvailabilityBucket]:
+        durations = self.status_store.resource_durations(resource_id, boundaries)
+        return [
+            status_models.AvailabilityBucket(start=start, end=end, **{s.value: d[s] for s in d})
+            for start, end, d in zip(boundaries, boundaries[1:], durations)
+        ]
+
+
+    async def watch(
+        self : "DemoAdapter",
+        ) -> AsyncIterator[status_models.StatusChange]:
+        while True:
+            await asyncio.sleep(DEMO_STATUS_UPDATE_SECS)
+            for change in self._simulate_status_change():
+                yield change
+
+
+    def _simulate_status_change(self) -> list[status_models.StatusChange]:
+        # flip the status of a random resource, recording an event and opening or closing its incident
+        now = datetime.datetime.now(datetime.timezone.utc)
+        r = random.choice(self.status_store.resources.all)
+        status = random.choice([s for s in status_models.Status if s not in [r.current_status, status_models.Status.unknown]])
+        # objects are replaced rather than modified, since they may be in the middle of being serialized
+        r = r.model_copy(update={"current_status": status, "last_modified": now})
+        event = status_models.Event(
+            id=str(uuid.uuid4()),
+            name=f"{r.name} is {status.value}",
+            description=f"{r.name} is {status.value}",
+            occurred_at=now,
+            status=status,
+            resource_id=r.id,
+            last_modified=now,
+        )
+        incident = next(iter(self.status_store.find_incidents(0, 1, resource_id=r.id, time_=now)), None)
+        if incident:
+            update = {"event_ids": incident.event_ids + [event.id], "status": status, "last_modified": now}
+            if status == status_models.Status.up:
+                update.update(end=now, resolution=status_models.Resolution.completed)
+            incident = incident.model_copy(update=update)
+        elif status != status_models.Status.up:
+            dstr = now.strftime("%Y-%m-%d %H:%M:%S.%f%z")
+            incident = status_models.Incident(
+                id=str(uuid.uuid4()),
+                name=f"{r.name} incident at {dstr}",
+                description=f"{r.name} incident at {dstr}",
+                status=status,
+                event_ids=[event.id],
+                resource_ids=[r.id],
+                start=now,
+                end=None,
+                type=status_models.IncidentType.unplanned,
+                resolution=status_models.Resolution.unresolved,
+                last_modified=now
+            )
+        if incident:
+            event.incident_id = incident.id
+            self.status_store.add_incidents([incident])
+        self.status_store.add_resources([r])
+        self.status_store.add_events([event])
+
+        changes = [
+            status_models.StatusChange(type=status_models.ChangeType.resource, resource=r),
+            status_models.StatusChange(type=status_models.ChangeType.event, event=event),
+        ]
+        if incident:
+            changes.append(status_models.StatusChange(type=status_models.ChangeType.incident, incident=incident))
+        return changes
+
+
+    def _index_accounts(self : "DemoAdapter") -> None:
+        self.capabilities_by_id = {c.id: c for c in self.capabilities.values()}
+        self.projects_by_id = {p.id: p for p in self.projects}
+        self.project_allocations_by_id = {pa.id: pa for pa in self.project_allocations}
+        self.user_allocations_by_id = {ua.id: ua for ua in self.user_allocations}
+        self.project_allocations_by_project = collections.defaultdict(list)
+        for pa in self.project_allocations:
+            self.project_allocations_by_project[pa.project_id].append(pa)
+        self.user_allocations_by_project_allocation = collections.defaultdict(list)
+        for ua in self.user_allocations:
+            self.user_allocations_by_project_allocation[ua.project_allocation_id].append(ua)
 
 
     async def get_capabilities(
@@ -295,7 +489,7 @@ class DemoAdapter(status_adapter.FacilityAdapter, account_adapter.FacilityAdapte
         project: account_models.Project,
         user: account_models.User
         ) -> list[account_models.ProjectAllocation]:
-        return [pa for pa in self.project_allocations if pa.project_id == project.id]
+        return self.project_allocations_by_project.get(project.id, [])
 
 
     async def get_user_allocations(
@@ -303,7 +497,55 @@ class DemoAdapter(status_adapter.FacilityAdapter, account_adapter.FacilityAdapte
         user: account_models.User,
         project_allocation: account_models.ProjectAllocation,
         ) -> list[account_models.UserAllocation]:
-        return [ua for ua in self.user_allocations if ua.project_allocation_id == project_allocation.id]
+        return self.user_allocations_by_project_allocation.get(project_allocation.id, [])
+
+
+    async def get_capability(
+        self : "DemoAdapter",
+        capability_id: str,
+        ) -> account_models.Capability | None:
+        return self.capabilities_by_id.get(capability_id)
+
+
+    async def get_project(
+        self : "DemoAdapter",
+        user: account_models.User,
+        project_id: str,
+        ) -> account_models.Project | None:
+        return self.projects_by_id.get(project_id)
+
+
+    async def get_project_allocation(
+        self : "DemoAdapter",
+        project: account_models.Project,
+        user: account_models.User,
+        project_allocation_id: str,
+        ) -> account_models.ProjectAllocation | None:
+        pa = self.project_allocations_by_id.get(project_allocation_id)
+        return pa if pa is not None and pa.project_id == project.id else None
+
+
+    async def get_user_allocation(
+        self : "DemoAdapter",
+        user: account_models.User,
+        project_allocation: account_models.ProjectAllocation,
+        user_allocation_id: str,
+        ) -> account_models.UserAllocation | None:
+        ua = self.user_allocations_by_id.get(user_allocation_id)
+        return ua if ua is not None and ua.project_allocation_id == project_allocation.id else None
+
+
+    async def get_overview(
+        self : "DemoAdapter",
+        user: account_models.User,
+        ) -> list[account_models.ProjectOverview]:
+        return [
+            account_models.ProjectOverview(**dict(p), project_allocations=[
+                account_models.ProjectAllocationOverview(**dict(pa), user_allocations=self.user_allocations_by_project_allocation.get(pa.id, []))
+                for pa in self.project_allocations_by_project.get(p.id, [])
+            ])
+            for p in self.projects
+        ]
 
 
     async def submit_job(
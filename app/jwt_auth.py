@@ -0,0 +1,356 @@
+import asyncio
+import base64
+import collections
+import concurrent.futures
+import hashlib
+import json
+import logging
+import os
+import time
+import urllib.request
+import weakref
+from typing import Any
+from fastapi import HTTPException
+from .routers.iri_router import AuthenticatedAdapter
+
+# cryptography is only needed by the JWT verifier
+try:
+    from cryptography.exceptions import InvalidSignature
+    from cryptography.hazmat.primitives import hashes
+    from cryptography.hazmat.primitives.asymmetric import ec, ed25519, padding, rsa
+    from cryptography.hazmat.primitives.asymmetric.utils import encode_dss_signature
+except ImportError:
+    InvalidSignature = None
+
+JWT_JWKS = os.environ.get("IRI_JWT_JWKS")
+JWT_ISSUER = os.environ.get("IRI_JWT_ISSUER")
+JWT_AUDIENCE = os.environ.get("IRI_JWT_AUDIENCE")
+JWT_USER_CLAIM = os.environ.get("IRI_JWT_USER_CLAIM", "sub")
+JWT_JWKS_REFRESH = float(os.environ.get("IRI_JWT_JWKS_REFRESH", "3600"))
+JWT_LEEWAY = float(os.environ.get("IRI_JWT_LEEWAY", "60"))
+JWT_THREADS = int(os.environ.get("IRI_JWT_THREADS", "2"))
+JWT_CACHE_SIZE = int(os.environ.get("IRI_JWT_CACHE_SIZE", "10000"))
+
+# asymmetric algorithms only: a shared secret can't be published in a JWKS
+ALGORITHMS = ("RS256", "RS384", "RS512", "PS256", "PS384", "PS512", "ES256", "ES384", "ES512", "EdDSA")
+
+# the curve of each ECDSA algorithm
+EC_CURVES = {"ES256": "secp256r1", "ES384": "secp384r1", "ES512": "secp521r1"}
+
+
+def _b64decode(s : str) -> bytes:
+    return base64.urlsafe_b64decode(s + "=" * (-len(s) % 4))
+
+
+def _int(s : str) -> int:
+    return int.from_bytes(_b64decode(s), "big")
+
+
+def public_key(jwk : dict) -> Any:
+    """The public key of a JWK (RSA, EC or Ed25519); raise ValueError for other keys"""
+    kty = jwk.get("kty")
+    if kty == "RSA":
+        return rsa.RSAPublicNumbers(_int(jwk["e"]), _int(jwk["n"])).public_key()
+    if kty == "EC":
+        curves = {"P-256": ec.SECP256R1, "P-384": ec.SECP384R1, "P-521": ec.SECP521R1}
+        if jwk.get("crv") not in curves:
+            raise ValueError(f"Unsupported curve {jwk.get('crv')}")
+        return ec.EllipticCurvePublicNumbers(_int(jwk["x"]), _int(jwk["y"]), curves[jwk["crv"]]()).public_key()
+    if kty == "OKP" and jwk.get("crv") == "Ed25519":
+        return ed25519.Ed25519PublicKey.from_public_bytes(_b64decode(jwk["x"]))
+    raise ValueError(f"Unsupported key type {kty}")
+
+
+def verify_signature(key : Any, alg : str, data : bytes, signature : bytes) -> bool:
+    """Whether `signature` is the JWS signature of `data` with `key` and `alg` (also False if the key doesn't fit the algorithm)"""
+    try:
+        if alg == "EdDSA":
+            if not isinstance(key, ed25519.Ed25519PublicKey):
+                return False
+            key.verify(signature, data)
+            return True
+        hash = {"256": hashes.SHA256, "384": hashes.SHA384, "512": hashes.SHA512}[alg[2:]]()
+        if alg.startswith("RS") or alg.startswith("PS"):
+            if not isinstance(key, rsa.RSAPublicKey):
+                return False
+            pad = padding.PKCS1v15() if alg.startswith("RS") else padding.PSS(padding.MGF1(hash), hash.digest_size)
+            key.verify(signature, data, pad, hash)
+            return True
+        if not isinstance(key, ec.EllipticCurvePublicKey) or key.curve.name != EC_CURVES[alg]:
+            return False
+        # JWS signatures are r and s side by side, cryptography wants them DER encoded
+        n = (key.curve.key_size + 7) // 8
+        if len(signature) != 2 * n:
+            return False
+        r, s = int.from_bytes(signature[:n], "big"), int.from_bytes(signature[n:], "big")
+        key.verify(encode_dss_signature(r, s), data, ec.ECDSA(hash))
+        return True
+    except InvalidSignature:
+        return False
+
+
+class JwksCache:
+    """
+        The signing keys of a JWKS document, by key id.
+
+        The document is read from `source`: an http(s) url, a file, or the document itself (a dict, eg. in tests).
+        It is read again every `refresh` seconds in the background (see `start`),
+        and when a token names a key that isn't known (the issuer rotated its keys), at most every `min_refetch` seconds.
+        Reading fails keep the current keys.
+    """
+
+    def __init__(
+        self : "JwksCache",
+        source : str | dict,
+        refresh : float = JWT_JWKS_REFRESH,
+        min_refetch : float = 60,
+        ):
+        self.source = source
+        self.refresh = refresh
+        self.min_refetch = min_refetch
+        # key id (None for a key without one) -> public key
+        self.keys = {}
+        self.fetched_at = None
+        self._fetching = None
+        self._refresh_task = None
+
+
+    def _read(self : "JwksCache") -> dict:
+        if isinstance(self.source, dict):
+            return self.source
+        if self.source.startswith("http://") or self.source.startswith("https://"):
+            with urllib.request.urlopen(self.source, timeout=10) as response:
+                return json.load(response)
+        with open(self.source) as f:
+            return json.load(f)
+
+
+    async def fetch(self : "JwksCache") -> None:
+        """Read the document again (concurrent calls share a single read)"""
+        if self._fetching is None:
+            self._fetching = asyncio.ensure_future(self._fetch())
+        fetching = self._fetching
+        try:
+            await asyncio.shield(fetching)
+        finally:
+            if self._fetching is fetching and fetching.done():
+                self._fetching = None
+
+
+    async def _fetch(self : "JwksCache") -> None:
+        try:
+            document = await asyncio.to_thread(self._read)
+        finally:
+            self.fetched_at = time.monotonic()
+        keys = {}
+        for jwk in document.get("keys", []):
+            if jwk.get("use", "sig") != "sig":
+                continue
+            try:
+                keys[jwk.get("kid")] = (public_key(jwk), jwk.get("alg"))
+            except (KeyError, ValueError) as exc:
+                logging.getLogger().warning(f"Skipping JWK {jwk.get('kid')}: {exc}")
+        self.keys = keys
+
+
+    async def get(self : "JwksCache", kid : str | None, alg : str) -> Any:
+        """The key for a token's `kid` and `alg`, or None"""
+        if kid not in self.keys and (self.fetched_at is None or time.monotonic() - self.fetched_at >= self.min_refetch):
+            await self.fetch()
+        if kid is None and None not in self.keys and len(self.keys) == 1:
+            # tokens without a key id are fine when there's a single key
+            kid = next(iter(self.keys))
+        key, key_alg = self.keys.get(kid, (None, None))
+        return key if key_alg in (None, alg) else None
+
+
+    def start(self : "JwksCache") -> None:
+        """Refresh the keys in the background"""
+        if self._refresh_task is None and not isinstance(self.source, dict):
+            self._refresh_task = asyncio.create_task(self._refresh())
+
+
+    async def _refresh(self : "JwksCache") -> None:
+        while True:
+            await asyncio.sleep(self.refresh)
+            try:
+                await self.fetch()
+            except Exception as exc:
+                logging.getLogger().error(f"Error refreshing the JWKS {self.source}: {exc}")
+
+
+    async def stop(self : "JwksCache") -> None:
+        if self._refresh_task is not None:
+            self._refresh_task.cancel()
+            self._refresh_task = None
+
+
+class JwtVerifier:
+    """
+        Verifies JWT bearer tokens locally: their signature against the keys of a `JwksCache`,
+        their expiry (`exp`, required, and `nbf`, with `leeway` seconds of clock skew), issuer and audience (if given).
+
+        Signatures are checked in a pool of `threads` threads, so RSA and ECDSA don't hold the event loop,
+        and the claims of verified tokens are kept (by a hash of the token) until they expire,
+        in an LRU of at most `cache_size` tokens, as long as the key that signed them is still in the key set.
+        Invalid tokens raise an `HTTPException` (401).
+    """
+
+    def __init__(
+        self : "JwtVerifier",
+        jwks : JwksCache,
+        issuer : str | None = None,
+        audience : str | None = None,
+        algorithms : tuple[str, ...] = ALGORITHMS,
+        leeway : float = JWT_LEEWAY,
+        threads : int = JWT_THREADS,
+        cache_size : int = JWT_CACHE_SIZE,
+        ):
+        if InvalidSignature is None:
+            raise RuntimeError("JWT verification needs the cryptography package: pip install cryptography")
+        unsupported = set(algorithms) - set(ALGORITHMS)
+        if unsupported:
+            raise ValueError(f"Unsupported algorithms: {', '.join(sorted(unsupported))}")
+        self.jwks = jwks
+        self.issuer = issuer
+        self.audience = audience
+        self.algorithms = algorithms
+        self.leeway = leeway
+        self.threads = threads
+        self.cache_size = cache_size
+        # token hash -> (expiry, key id, claims), least recently used first
+        self._verified = collections.OrderedDict()
+        self._start_pool()
+        # the pool's threads don't survive a fork (eg. with gunicorn's preload_app);
+        # the hook holds the verifier weakly, so it doesn't outlive its users
+        start_pool = weakref.WeakMethod(self._start_pool)
+        os.register_at_fork(after_in_child=lambda: start_pool() and start_pool()())
+
+
+    @classmethod
+    def from_env(cls : type) -> "JwtVerifier":
+        """A verifier configured by the `IRI_JWT_*` environment variables"""
+        if not JWT_JWKS:
+            raise ValueError("IRI_JWT_JWKS is not set")
+        return cls(JwksCache(JWT_JWKS), JWT_ISSUER, JWT_AUDIENCE)
+
+
+    def _start_pool(self : "JwtVerifier") -> None:
+        self._executor = concurrent.futures.ThreadPoolExecutor(self.threads, thread_name_prefix="iri-jwt")
+
+
+    def _invalid(self : "JwtVerifier", detail : str) -> HTTPException:
+        return HTTPException(status_code=401, detail=detail)
+
+
+    async def verify(self : "JwtVerifier", token : str) -> dict:
+        """Return the claims of a valid token"""
+        token = token.removeprefix("Bearer ").strip()
+        digest = hashlib.sha256(token.encode()).digest()
+        now = time.time()
+        verified = self._verified.get(digest)
+        if verified is not None and verified[0] > now - self.leeway and verified[1] in self.jwks.keys:
+            self._verified.move_to_end(digest)
+            return verified[2]
+
+        try:
+            header_b64, claims_b64, signature_b64 = token.split(".")
+            header = json.loads(_b64decode(header_b64))
+            claims = json.loads(_b64decode(claims_b64))
+            signature = _b64decode(signature_b64)
+        except ValueError as exc:
+            raise self._invalid("Malformed token") from exc
+        if not isinstance(header, dict) or not isinstance(claims, dict):
+            raise self._invalid("Malformed token")
+        alg = header.get("alg")
+        if alg not in self.algorithms:
+            raise self._invalid("Unsupported token algorithm")
+        kid = header.get("kid")
+        key = await self.jwks.get(kid, alg)
+        if key is None:
+            raise self._invalid("Unknown token signing key")
+        data = f"{header_b64}.{claims_b64}".encode()
+        loop = asyncio.get_running_loop()
+        if not await loop.run_in_executor(self._executor, verify_signature, key, alg, data, signature):
+            raise self._invalid("Invalid token signature")
+        self._check_claims(claims, now)
+
+        if kid is None and len(self.jwks.keys) == 1:
+            kid = next(iter(self.jwks.keys))
+        self._verified[digest] = (float(claims["exp"]), kid, claims)
+        while len(self._verified) > self.cache_size:
+            self._verified.popitem(last=False)
+        return claims
+
+
+    def _check_claims(self : "JwtVerifier", claims : dict, now : float) -> None:
+        exp = claims.get("exp")
+        if not isinstance(exp, (int, float)):
+            raise self._invalid("Token has no expiry")
+        if exp <= now - self.leeway:
+            raise self._invalid("Token expired")
+        nbf = claims.get("nbf")
+        if isinstance(nbf, (int, float)) and nbf > now + self.leeway:
+            raise self._invalid("Token not yet valid")
+        if self.issuer is not None and claims.get("iss") != self.issuer:
+            raise self._invalid("Unexpected token issuer")
+        if self.audience is not None:
+            aud = claims.get("aud")
+            if self.audience not in (aud if isinstance(aud, list) else [aud]):
+                raise self._invalid("Unexpected token audience")
+
+
+    async def shutdown(self : "JwtVerifier") -> None:
+        await self.jwks.stop()
+        await asyncio.to_thread(self._executor.shutdown)
+
+
+class JwtAuthenticatedAdapter(AuthenticatedAdapter):
+    """
+        Implements `get_current_user` with JWT bearer tokens verified locally, instead of an introspection call per request:
+        the user's id is the `IRI_JWT_USER_CLAIM` claim (defaults to `sub`) of the token.
+        Put it first in the bases of an adapter, eg. `class MyAccountAdapter(JwtAuthenticatedAdapter, account_adapter.FacilityAdapter)`;
+        `get_user` is still up to the facility.
+
+        The verifier is `JwtVerifier.from_env()` (see the `IRI_JWT_*` environment variables),
+        unless the adapter sets its own `jwt_verifier`, eg. with a local key set in tests.
+        The keys are read when the app starts, then refreshed in the background.
+    """
+
+    jwt_verifier : JwtVerifier | None = None
+
+
+    def _jwt_verifier(self : "JwtAuthenticatedAdapter") -> JwtVerifier:
+        if self.jwt_verifier is None:
+            self.jwt_verifier = JwtVerifier.from_env()
+        return self.jwt_verifier
+
+
+    async def get_current_user(
+        self : "JwtAuthenticatedAdapter",
+        api_key: str,
+        client_ip: str|None,
+        ) -> str:
+        claims = await self._jwt_verifier().verify(api_key)
+        return claims.get(JWT_USER_CLAIM)
+
+
+    async def startup(self : "JwtAuthenticatedAdapter") -> None:
+        verifier = self._jwt_verifier()
+        try:
+            await verifier.jwks.fetch()
+        except Exception as exc:
+            # the first token will try again
+            logging.getLogger().error(f"Error reading the JWKS {verifier.jwks.source}: {exc}")
+        verifier.jwks.start()
+        startup = getattr(super(), "startup", None)
+        if startup is not None:
+            await startup()
+
+
+    async def shutdown(self : "JwtAuthenticatedAdapter") -> None:
+        if self.jwt_verifier is not None:
+            await self.jwt_verifier.shutdown()
+        shutdown = getattr(super(), "shutdown", None)
+        if shutdown is not None:
+            await shutdown()
@@ -1,5 +1,6 @@
 #!/usr/bin/env python3
 """Main API application"""
+import contextlib
 import logging
 from fastapi import FastAPI
 
@@ -9,11 +10,20 @@ from app.routers.account import account
 from app.routers.compute import compute
 from app.routers.filesystem import filesystem
 from app.routers.task import task
+from app.routers.iri_router import adapter_registry
 
 from . import config
 
 
-APP = FastAPI(**config.API_CONFIG)
+@contextlib.asynccontextmanager
+async def lifespan(app : FastAPI):
+    # the adapters were created when the routers were imported
+    await adapter_registry.startup()
+    yield
+    await adapter_registry.shutdown()
+
+
+APP = FastAPI(**config.API_CONFIG, lifespan=lifespan)
 
 install_error_handlers(APP)
 
@@ -1,5 +1,5 @@
 from fastapi import HTTPException, Request, Depends
-from . import models, facility_adapter
+from . import models, facility_adapter, cache as account_cache
 from .. import iri_router
 from ..error_handlers import DEFAULT_RESPONSES
 
@@ -10,6 +10,89 @@ router = iri_router.IriRouter(
     tags=["account"],
 )
 
+# the adapter's lookups, shared by the requests of every user (see AccountCache)
+cache = account_cache.AccountCache()
+
+
+def _overrides(name : str) -> bool:
+    # whether the adapter looks entities up directly, rather than with the default scan of their list
+    return getattr(type(router.adapter), name) is not getattr(facility_adapter.FacilityAdapter, name)
+
+
+async def _user(request : Request) -> models.User:
+    user_id, api_key = request.state.current_user_id, request.state.api_key
+    user = await cache.get(
+        request, ("user", user_id, api_key),
+        lambda: router.adapter.get_user(user_id, api_key, iri_router.get_client_ip(request)),
+    )
+    if not user:
+        raise HTTPException(status_code=404, detail="User not found")
+    return user
+
+
+# the list lookups return the list, or an id -> entity index of it with `index`
+
+async def _capabilities(request : Request, index : bool = False) -> list[models.Capability] | dict[str, models.Capability]:
+    get = cache.get_index if index else cache.get
+    return await get(request, ("capabilities",), router.adapter.get_capabilities)
+
+
+async def _projects(request : Request, user : models.User, index : bool = False) -> list[models.Project] | dict[str, models.Project]:
+    get = cache.get_index if index else cache.get
+    return await get(request, ("projects", user.id, request.state.api_key), lambda: router.adapter.get_projects(user))
+
+
+async def _project(request : Request, user : models.User, project_id : str) -> models.Project:
+    key = (user.id, request.state.api_key)
+    if _overrides("get_project"):
+        project = await cache.get(request, ("project", *key, project_id), lambda: router.adapter.get_project(user, project_id))
+    else:
+        project = (await _projects(request, user, index=True)).get(project_id)
+    if not project:
+        raise HTTPException(status_code=404, detail="Project not found")
+    return project
+
+
+async def _project_allocations(
+    request : Request,
+    user : models.User,
+    project : models.Project,
+    index : bool = False,
+    ) -> list[models.ProjectAllocation] | dict[str, models.ProjectAllocation]:
+    get = cache.get_index if index else cache.get
+    return await get(
+        request, ("project_allocations", user.id, request.state.api_key, project.id),
+        lambda: router.adapter.get_project_allocations(project, user),
+    )
+
+
+async def _project_allocation(request : Request, user : models.User, project_id : str, project_allocation_id : str) -> models.ProjectAllocation:
+    project = await _project(request, user, project_id)
+    key = (user.id, request.state.api_key, project.id)
+    if _overrides("get_project_allocation"):
+        pa = await cache.get(
+            request, ("project_allocation", *key, project_allocation_id),
+            lambda: router.adapter.get_project_allocation(project, user, project_allocation_id),
+        )
+    else:
+        pa = (await _project_allocations(request, user, project, index=True)).get(project_allocation_id)
+    if not pa:
+        raise HTTPException(status_code=404, detail="Project allocation not found")
+    return pa
+
+
+async def _user_allocations(
+    request : Request,
+    user : models.User,
+    pa : models.ProjectAllocation,
+    index : bool = False,
+    ) -> list[models.UserAllocation] | dict[str, models.UserAllocation]:
+    get = cache.get_index if index else cache.get
+    return await get(
+        request, ("user_allocations", user.id, request.state.api_key, pa.id),
+        lambda: router.adapter.get_user_allocations(user, pa),
+    )
+
 
 @router.get(
     "/capabilities",
@@ -21,7 +104,7 @@ router = iri_router.IriRouter(
 async def get_capabilities(
     request : Request,
     ) -> list[models.Capability]:
-    return await router.adapter.get_capabilities()
+    return await _capabilities(request)
 
 
 @router.get(
@@ -34,8 +117,10 @@ async def get_capability(
     capability_id : str,
     request : Request,
     ) -> models.Capability:
-    caps = await router.adapter.get_capabilities()
-    cc = next((c for c in caps if c.id == capability_id), None)
+    if _overrides("get_capability"):
+        cc = await cache.get(request, ("capability", capability_id), lambda: router.adapter.get_capability(capability_id))
+    else:
+        cc = (await _capabilities(request, index=True)).get(capability_id)
     if not cc:
         raise HTTPException(status_code=404, detail="Capability not found")
     return cc
@@ -51,10 +136,21 @@ async def get_capability(
 async def get_projects(
     request : Request,
     ) -> list[models.Project]:
-    user = await router.adapter.get_user(request.state.current_user_id, request.state.api_key, iri_router.get_client_ip(request))
-    if not user:
-        raise HTTPException(status_code=404, detail="User not found")
-    return await router.adapter.get_projects(user)
+    return await _projects(request, await _user(request))
+
+
+@router.get(
+    "/overview",
+    dependencies=[Depends(router.current_user)],
+    summary="Get the current user's projects and allocations",
+    description="Get the projects of the currently authenticated user at this facility, with their allocations and the user's allocations in them, in a single call.",
+    responses=DEFAULT_RESPONSES
+)
+async def get_overview(
+    request : Request,
+    ) -> list[models.ProjectOverview]:
+    user = await _user(request)
+    return await cache.get(request, ("overview", user.id, request.state.api_key), lambda: router.adapter.get_overview(user))
 
 
 @router.get(
@@ -68,14 +164,7 @@ async def get_project(
     project_id : str,
     request : Request,
     ) -> models.Project:
-    user = await router.adapter.get_user(request.state.current_user_id, request.state.api_key, iri_router.get_client_ip(request))
-    if not user:
-        raise HTTPException(status_code=404, detail="User not found")
-    projects = await router.adapter.get_projects(user)
-    pp = next((p for p in projects if p.id == project_id), None)
-    if not pp:
-        raise HTTPException(status_code=404, detail="Project not found")
-    return pp
+    return await _project(request, await _user(request), project_id)
 
 
 @router.get(
@@ -89,14 +178,8 @@ async def get_project_allocations(
     project_id: str,
     request : Request,
     ) -> list[models.ProjectAllocation]:
-    user = await router.adapter.get_user(request.state.current_user_id, request.state.api_key, iri_router.get_client_ip(request))
-    if not user:
-        raise HTTPException(status_code=404, detail="User not found")
-    projects = await router.adapter.get_projects(user)
-    project = next((p for p in projects if p.id == project_id), None)
-    if not project:
-        raise HTTPException(status_code=404, detail="Project not found")
-    return await router.adapter.get_project_allocations(project, user)
+    user = await _user(request)
+    return await _project_allocations(request, user, await _project(request, user, project_id))
 
 
 @router.get(
@@ -111,16 +194,7 @@ async def get_project_allocation(
     project_allocation_id : str,
     request : Request,
     ) -> models.ProjectAllocation:
-    user = await router.adapter.get_user(request.state.current_user_id, request.state.api_key, iri_router.get_client_ip(request))
-    if not user:
-        raise HTTPException(status_code=404, detail="User not found")
-    projects = await router.adapter.get_projects(user)
-    project = next((p for p in projects if p.id == project_id), None)
-    pas = await router.adapter.get_project_allocations(project, user)
-    pa = next((pa for pa in pas if pa.id == project_allocation_id), None)
-    if not pa:
-        raise HTTPException(status_code=404, detail="Project allocation not found")
-    return pa
+    return await _project_allocation(request, await _user(request), project_id, project_allocation_id)
 
 
 @router.get(
@@ -135,18 +209,8 @@ async def get_user_allocations(
     project_allocation_id : str,
     request : Request,
     ) -> list[models.UserAllocation]:
-    user = await router.adapter.get_user(request.state.current_user_id, request.state.api_key, iri_router.get_client_ip(request))
-    if not user:
-        raise HTTPException(status_code=404, detail="User not found")
-    projects = await router.adapter.get_projects(user)
-    project = next((p for p in projects if p.id == project_id), None)
-    if not project:
-        raise HTTPException(status_code=404, detail="Project not found")
-    pas = await router.adapter.get_project_allocations(project, user)
-    pa = next((pa for pa in pas if pa.id == project_allocation_id), None)
-    if not pa:
-        raise HTTPException(status_code=404, detail="Project allocation not found")
-    return await router.adapter.get_user_allocations(user, pa)
+    user = await _user(request)
+    return await _user_allocations(request, user, await _project_allocation(request, user, project_id, project_allocation_id))
 
 
 @router.get(
@@ -162,19 +226,16 @@ async def get_user_allocation(
     user_allocation_id : str,
     request : Request,
     ) -> models.UserAllocation:
-    user = await router.adapter.get_user(request.state.current_user_id, request.state.api_key, iri_router.get_client_ip(request))
-    if not user:
-        raise HTTPException(status_code=404, detail="User not found")
-    projects = await router.adapter.get_projects(user)
-    project = next((p for p in projects if p.id == project_id), None)
-    if not project:
-        raise HTTPException(status_code=404, detail="Project not found")
-    pas = await router.adapter.get_project_allocations(project, user)
-    pa = next((pa for pa in pas if pa.id == project_allocation_id), None)
-    if not pa:
-        raise HTTPException(status_code=404, detail="Project allocation not found")
-    uas = await router.adapter.get_user_allocations(user, pa)
-    ua = next((ua for ua in uas if ua.id == user_allocation_id), None)
+    user = await _user(request)
+    pa = await _project_allocation(request, user, project_id, project_allocation_id)
+    key = (user.id, request.state.api_key, pa.id)
+    if _overrides("get_user_allocation"):
+        ua = await cache.get(
+            request, ("user_allocation", *key, user_allocation_id),
+            lambda: router.adapter.get_user_allocation(user, pa, user_allocation_id),
+        )
+    else:
+        ua = (await _user_allocations(request, user, pa, index=True)).get(user_allocation_id)
     if not ua:
         raise HTTPException(status_code=404, detail="User allocation not found")
     return ua
@@ -0,0 +1,95 @@
+import asyncio
+import os
+from typing import Any, Awaitable, Callable, Hashable
+from fastapi import Request
+from ..lru import AsyncLRU
+
+ACCOUNT_CACHE_TTL = float(os.environ.get("IRI_ACCOUNT_CACHE_TTL", "60"))
+ACCOUNT_CACHE_SIZE = int(os.environ.get("IRI_ACCOUNT_CACHE_SIZE", "10000"))
+
+
+class AccountCache:
+    """
+        Caches the results of the account adapter's lookups (users, projects and allocations),
+        so the chain of lookups behind each account endpoint doesn't hit the facility's backends every time.
+
+        Results are kept in an `AsyncLRU` of at most `max_size` entries for `ttl` seconds (a `ttl` of 0 disables it),
+        keyed by the lookup and the user's id and api key, so users never see each other's results.
+        Concurrent misses of a key share a single call to the adapter,
+        and each request remembers its own lookups, so it sees consistent results even if entries expire meanwhile.
+        Failed lookups, and lookups that found nothing (None), aren't cached.
+        Lists can also be looked up by id with `get_index`: the index is kept (and dropped) with the list.
+        Adapters that know an account changed can drop its entries with `invalidate` or `invalidate_user`.
+    """
+
+    # the lookups of a user, keyed by (lookup, user id, api key, ...)
+    USER_LOOKUPS = frozenset({
+        "user", "projects", "project", "project_allocations", "project_allocation", "user_allocations", "user_allocation", "overview",
+    })
+
+    def __init__(self : "AccountCache", ttl : float = ACCOUNT_CACHE_TTL, max_size : int = ACCOUNT_CACHE_SIZE):
+        self.ttl = ttl
+        # the `data` of a list's entry is its id index
+        self._lru = AsyncLRU(max_size)
+
+
+    def __len__(self : "AccountCache") -> int:
+        return len(self._lru)
+
+
+    async def get(
+        self : "AccountCache",
+        request : Request | None,
+        key : tuple[Hashable, ...],
+        load : Callable[[], Awaitable[Any]],
+        ) -> Any:
+        """Return the result of `load()` for `key`, from the request's lookups, the cache, or `load` itself"""
+        memo = None
+        if request is not None:
+            memo = getattr(request.state, "account_lookups", None)
+            if memo is None:
+                memo = request.state.account_lookups = {}
+            if key in memo:
+                return memo[key]
+
+        result = await self._lru.get(key, load, self._ttl) if self.ttl > 0 else await load()
+        if memo is not None:
+            memo[key] = result
+        return result
+
+
+    def _ttl(self : "AccountCache", future : asyncio.Future) -> float | None:
+        # failed lookups, and lookups that found nothing, aren't kept
+        return self.ttl if future.exception() is None and future.result() is not None else None
+
+
+    async def get_index(
+        self : "AccountCache",
+        request : Request | None,
+        key : tuple[Hashable, ...],
+        load : Callable[[], Awaitable[list]],
+        ) -> dict[str, Any]:
+        """Return an id -> object index of the list `get` returns for `key`, built once per cached list"""
+        items = await self.get(request, key, load)
+        entry = self._lru.entries.get(key)
+        future = entry.future if entry is not None else None
+        if future is None or not future.done() or future.cancelled() or future.exception() is not None or future.result() is not items:
+            # not cached (or replaced meanwhile)
+            return {o.id: o for o in items}
+        if entry.data is None:
+            entry.data = {o.id: o for o in items}
+        return entry.data
+
+
+    def invalidate(self : "AccountCache", key : tuple[Hashable, ...]) -> None:
+        self._lru.pop(key)
+
+
+    def invalidate_user(self : "AccountCache", user_id : str) -> None:
+        """Drop every entry of a user"""
+        for key in [k for k in self._lru.entries if k[0] in self.USER_LOOKUPS and len(k) > 1 and k[1] == user_id]:
+            self._lru.pop(key)
+
+
+    def clear(self : "AccountCache") -> None:
+        self._lru.clear()
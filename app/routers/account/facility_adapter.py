@@ -1,3 +1,4 @@
+import asyncio
 from abc import abstractmethod
 from . import models as account_models
 from ..iri_router import AuthenticatedAdapter
@@ -41,3 +42,72 @@ class FacilityAdapter(AuthenticatedAdapter):
         project_allocation: account_models.ProjectAllocation,
         ) -> list[account_models.UserAllocation]:
         pass
+
+
+    async def get_capability(
+        self : "FacilityAdapter",
+        capability_id: str,
+        ) -> account_models.Capability | None:
+        """
+            The capability with this id, or None.
+            The default scans `get_capabilities`; override it to look the capability up directly.
+        """
+        return next((c for c in await self.get_capabilities() if c.id == capability_id), None)
+
+
+    async def get_project(
+        self : "FacilityAdapter",
+        user: account_models.User,
+        project_id: str,
+        ) -> account_models.Project | None:
+        """
+            The user's project with this id, or None.
+            The default scans `get_projects`; override it to look the project up directly.
+        """
+        return next((p for p in await self.get_projects(user) if p.id == project_id), None)
+
+
+    async def get_project_allocation(
+        self : "FacilityAdapter",
+        project: account_models.Project,
+        user: account_models.User,
+        project_allocation_id: str,
+        ) -> account_models.ProjectAllocation | None:
+        """
+            The project's allocation with this id, or None (also if it's an allocation of another project).
+            The default scans `get_project_allocations`; override it to look the allocation up directly.
+        """
+        return next((pa for pa in await self.get_project_allocations(project, user) if pa.id == project_allocation_id), None)
+
+
+    async def get_user_allocation(
+        self : "FacilityAdapter",
+        user: account_models.User,
+        project_allocation: account_models.ProjectAllocation,
+        user_allocation_id: str,
+        ) -> account_models.UserAllocation | None:
+        """
+            The user allocation with this id in the project allocation, or None (also if it's in another project allocation).
+            The default scans `get_user_allocations`; override it to look the allocation up directly.
+        """
+        return next((ua for ua in await self.get_user_allocations(user, project_allocation) if ua.id == user_allocation_id), None)
+
+
+    async def get_overview(
+        self : "FacilityAdapter",
+        user: account_models.User,
+        ) -> list[account_models.ProjectOverview]:
+        """
+            The user's projects, with their allocations and the user's allocations in them (`/account/overview`).
+            By default, the allocations of every project, then the user allocations of every allocation, are fetched concurrently;
+            override it to answer with a single query.
+        """
+        async def project_overview(project):
+            pas = await self.get_project_allocations(project, user)
+            uas = await asyncio.gather(*[self.get_user_allocations(user, pa) for pa in pas])
+            return account_models.ProjectOverview(
+                **dict(project),
+                project_allocations=[account_models.ProjectAllocationOverview(**dict(pa), user_allocations=u) for pa, u in zip(pas, uas)],
+            )
+
+        return list(await asyncio.gather(*[project_overview(p) for p in await self.get_projects(user)]))
@@ -87,3 +87,13 @@ class UserAllocation(BaseModel):
     @property
     def project_allocation_uri(self) -> str:
         return f"{config.API_URL_ROOT}{config.API_PREFIX}{config.API_URL}/account/projects/{self.project_id}/project_allocations/{self.project_allocation_id}"
+
+
+class ProjectAllocationOverview(ProjectAllocation):
+    """A project allocation with the current user's allocations in it (`/account/overview`)"""
+    user_allocations: list[UserAllocation]
+
+
+class ProjectOverview(Project):
+    """A project with its allocations and the current user's allocations in them (`/account/overview`)"""
+    project_allocations: list[ProjectAllocationOverview]
@@ -149,7 +149,7 @@ async def get_job_statuses(
     resource_id : str,
     request : Request,
     offset : int = Query(default=0, ge=0),
-    limit : int = Query(default=100, le=10000),
+    limit : int = Query(default=100, ge=0, le=10000),
     filters : dict[str, object] | None = None,
     historical : bool = False,
     ):
@@ -3,13 +3,24 @@ import os
 import logging
 import importlib
 import datetime
-from fastapi import Request, Depends, HTTPException, APIRouter
+import json
+import base64
+import asyncio
+import hashlib
+import time
+from typing import Callable
+from fastapi import Request, Response, Depends, HTTPException, APIRouter
 from fastapi.security import APIKeyHeader
 from pydantic_core import core_schema
 from .account.models import User
+from .lru import AsyncLRU
 
 bearer_token = APIKeyHeader(name="Authorization")
 
+TOKEN_CACHE_TTL = float(os.environ.get("IRI_TOKEN_CACHE_TTL", "300"))
+TOKEN_CACHE_NEGATIVE_TTL = float(os.environ.get("IRI_TOKEN_CACHE_NEGATIVE_TTL", "5"))
+TOKEN_CACHE_SIZE = int(os.environ.get("IRI_TOKEN_CACHE_SIZE", "10000"))
+
 
 def get_client_ip(request : Request) -> str|None:
     # logging.debug("Request headers=%s" % request.headers)
@@ -27,6 +38,124 @@ def get_client_ip(request : Request) -> str|None:
         return ip_addr
 
 
+def token_expiry(api_key : str) -> float | None:
+    """The `exp` claim (POSIX time) of a JWT bearer token, unverified, or None if the token isn't a JWT or has no expiry"""
+    parts = api_key.removeprefix("Bearer ").split(".")
+    if len(parts) != 3:
+        return None
+    try:
+        claims = json.loads(base64.urlsafe_b64decode(parts[1] + "=" * (-len(parts[1]) % 4)))
+    except ValueError:
+        return None
+    exp = claims.get("exp") if isinstance(claims, dict) else None
+    return float(exp) if isinstance(exp, (int, float)) else None
+
+
+class TokenCache:
+    """
+        Caches the users of verified bearer tokens, so authenticated requests don't all wait on the identity provider.
+
+        Entries are keyed by the adapter, a SHA-256 hash of the token (tokens themselves are never kept) and the client ip.
+        Accepted tokens are cached for `ttl` seconds, but never past their expiry (the `exp` claim of JWTs);
+        rejected tokens (no user, or an `HTTPException` from the adapter) are cached for `negative_ttl` seconds,
+        and other errors (eg. the identity provider being down) aren't cached.
+        Concurrent requests with the same uncached token share a single verification.
+        The cache is an `AsyncLRU` of at most `max_size` entries.
+    """
+
+    def __init__(
+        self : "TokenCache",
+        ttl : float = TOKEN_CACHE_TTL,
+        negative_ttl : float = TOKEN_CACHE_NEGATIVE_TTL,
+        max_size : int = TOKEN_CACHE_SIZE,
+        ):
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        # entries of the user id of each token
+        self._lru = AsyncLRU(max_size)
+
+
+    def __len__(self : "TokenCache") -> int:
+        return len(self._lru)
+
+
+    async def get_current_user(self : "TokenCache", adapter : "AuthenticatedAdapter", api_key : str, client_ip : str | None) -> str | None:
+        """`adapter.get_current_user(api_key, client_ip)`, cached"""
+        key = (id(adapter), hashlib.sha256(api_key.encode()).hexdigest(), client_ip)
+
+        def ttl(future : asyncio.Future) -> float | None:
+            if future.exception() is not None and not isinstance(future.exception(), HTTPException):
+                return None
+            user_id = None if future.exception() is not None else future.result()
+            if not user_id:
+                return self.negative_ttl
+            expiry = token_expiry(api_key)
+            return min(self.ttl, expiry - time.time()) if expiry is not None else self.ttl
+
+        return await self._lru.get(key, lambda: adapter.get_current_user(api_key, client_ip), ttl)
+
+
+    def invalidate(self : "TokenCache", api_key : str) -> None:
+        """Forget a token (eg. once it's revoked)"""
+        digest = hashlib.sha256(api_key.encode()).hexdigest()
+        for key in [k for k in self._lru.entries if k[1] == digest]:
+            self._lru.pop(key)
+
+
+    def clear(self : "TokenCache") -> None:
+        self._lru.clear()
+
+
+token_cache = TokenCache()
+
+
+class AdapterRegistry:
+    """
+        The facility adapters of the process: each configured adapter class is instantiated once,
+        and the instance is shared by every router (and the task executor) configured with that class.
+        Adapters can define `async def startup(self)` and `async def shutdown(self)`;
+        they are awaited when the app starts and stops (see the lifespan in `app.main`).
+    """
+
+    def __init__(self : "AdapterRegistry"):
+        # adapter name (module.Class) -> instance, in construction order
+        self.instances = {}
+        # router name -> the instance of its configured adapter
+        self.routers = {}
+
+
+    def get(self : "AdapterRegistry", adapter_name : str, AdapterClass : type):
+        adapter = self.instances.get(adapter_name)
+        if adapter is None:
+            adapter = self.instances[adapter_name] = AdapterClass()
+            logging.getLogger().info(f"Created adapter {adapter_name}")
+        return adapter
+
+
+    def for_router(self : "AdapterRegistry", router_name : str):
+        """The adapter of a router (eg. "filesystem"), or None if the router has none"""
+        return self.routers.get(router_name)
+
+
+    async def startup(self : "AdapterRegistry") -> None:
+        for adapter in list(self.instances.values()):
+            if hasattr(adapter, "startup"):
+                await adapter.startup()
+
+
+    async def shutdown(self : "AdapterRegistry") -> None:
+        # in reverse construction order, and every adapter gets to shut down
+        for name, adapter in reversed(list(self.instances.items())):
+            if hasattr(adapter, "shutdown"):
+                try:
+                    await adapter.shutdown()
+                except Exception as exc:
+                    logging.getLogger().error(f"Error shutting down {name}: {exc}")
+
+
+adapter_registry = AdapterRegistry()
+
+
 class IriRouter(APIRouter):
     def __init__(self, router_adapter=None, task_router_adapter=None, **kwargs):
         super().__init__(**kwargs)
@@ -77,8 +206,9 @@ class IriRouter(APIRouter):
         if not issubclass(AdapterClass, router_adapter):
             raise Exception(f"{adapter_name} should implement FacilityAdapter")
 
-        # assign it
-        return AdapterClass()
+        # assign the process-wide instance
+        adapter = adapter_registry.routers[router_name] = adapter_registry.get(adapter_name, AdapterClass)
+        return adapter
 
 
     async def current_user(
@@ -88,7 +218,7 @@ class IriRouter(APIRouter):
     ):
         user_id = None
         try:
-            user_id = await self.adapter.get_current_user(api_key, get_client_ip(request))
+            user_id = await token_cache.get_current_user(self.adapter, api_key, get_client_ip(request))
         except Exception as exc:
             logging.getLogger().error(f"Error parsing IRI_API_PARAMS: {exc}")
             raise HTTPException(status_code=401, detail="Invalid or malformed Authorization parameters") from exc
@@ -141,6 +271,34 @@ def forbidExtraQueryParams(*allowedParams: str):
                                 detail=[{"type": "extra_forbidden", "loc": ["query", param], "msg": f"Unexpected query parameter: {param}"} for param in unknown])
     return checker
 
+def encode_cursor(key: tuple) -> str:
+    """Encode a keyset pagination key (eg. `Event.cursor_key()`) into an opaque cursor token."""
+    values = [k.isoformat() if isinstance(k, datetime.datetime) else k for k in key]
+    return base64.urlsafe_b64encode(json.dumps(values, separators=(",", ":")).encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str, *types: Callable) -> tuple:
+    """Decode a cursor token made by `encode_cursor`, converting each value of the key with the given types."""
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+        if not isinstance(values, list) or len(values) != len(types):
+            raise ValueError("Unexpected cursor length")
+        return tuple(t(v) for t, v in zip(types, values))
+    except Exception as exc:
+        raise HTTPException(status_code=400, detail="Invalid cursor") from exc
+
+
+def set_next_link(request: Request, response: Response, items: list, limit: int) -> None:
+    """
+        Add a `Link: <...>; rel="next"` header pointing to the page after `items`, if the page is full.
+        The next page is addressed by the cursor of the last item, so it replaces any `offset`.
+    """
+    if not items or len(items) < limit:
+        return
+    url = request.url.remove_query_params("offset").include_query_params(cursor=encode_cursor(items[-1].cursor_key()))
+    response.headers["Link"] = f'<{url}>; rel="next"'
+
+
 class StrictDateTime:
     """
     Strict ISO8601 datetime:
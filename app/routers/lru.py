@@ -0,0 +1,73 @@
+import asyncio
+import collections
+import math
+import time
+from typing import Any, Awaitable, Callable, Hashable
+
+
+class LRUEntry:
+    """An entry of an `AsyncLRU`: its expiry (monotonic time), the future of its result and any data kept with the result"""
+    __slots__ = ("expiry", "future", "data")
+
+    def __init__(self : "LRUEntry", expiry : float, future : asyncio.Future):
+        self.expiry = expiry
+        self.future = future
+        self.data = None
+
+
+class AsyncLRU:
+    """
+        An LRU of the results of coroutines (eg. the lookups of an adapter), of at most `max_size` entries.
+        Concurrent misses of a key share a single call, and a cancelled caller doesn't cancel it for the others.
+        Once the call is done, the `ttl` function given to `get` says how many seconds its result is kept,
+        or None to drop it (eg. after an error); cancelled calls are dropped.
+    """
+
+    def __init__(self : "AsyncLRU", max_size : int):
+        self.max_size = max_size
+        # key -> LRUEntry, least recently used first
+        self.entries = collections.OrderedDict()
+
+
+    def __len__(self : "AsyncLRU") -> int:
+        return len(self.entries)
+
+
+    async def get(
+        self : "AsyncLRU",
+        key : Hashable,
+        load : Callable[[], Awaitable[Any]],
+        ttl : Callable[[asyncio.Future], float | None],
+        ) -> Any:
+        """Return the result of `load()` for `key`, from the cache or from a new call (or the call in progress)"""
+        entry = self.entries.get(key)
+        if entry is not None and entry.expiry > time.monotonic():
+            self.entries.move_to_end(key)
+        else:
+            # kept while the call is in progress, so concurrent misses share it
+            entry = self.entries[key] = LRUEntry(math.inf, asyncio.ensure_future(load()))
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+            entry.future.add_done_callback(lambda future: self._settle(key, entry, ttl))
+        # shielded, so a cancelled caller doesn't cancel the call of the others waiting for it
+        return await asyncio.shield(entry.future)
+
+
+    def _settle(self : "AsyncLRU", key : Hashable, entry : LRUEntry, ttl : Callable[[asyncio.Future], float | None]) -> None:
+        # once the call is done, even if every caller waiting for it was cancelled
+        seconds = None if entry.future.cancelled() else ttl(entry.future)
+        if self.entries.get(key) is not entry:
+            return
+        if seconds is None:
+            del self.entries[key]
+        else:
+            entry.expiry = time.monotonic() + seconds
+
+
+    def pop(self : "AsyncLRU", key : Hashable) -> None:
+        self.entries.pop(key, None)
+
+
+    def clear(self : "AsyncLRU") -> None:
+        self.entries.clear()
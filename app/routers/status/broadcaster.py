@@ -0,0 +1,103 @@
+import asyncio
+import collections
+import logging
+from typing import AsyncIterator, Callable
+from . import models as status_models
+
+
+class StatusBroadcaster:
+    """
+        Fans out the changes of a single adapter `watch()` iterator to every `/status/stream` subscriber.
+        Changes are numbered in order and the latest ones are kept, so clients can resume from a `Last-Event-ID`.
+        The adapter is only watched while there are subscribers.
+    """
+
+    def __init__(
+        self : "StatusBroadcaster",
+        source : Callable[[], AsyncIterator[status_models.StatusChange]],
+        history : int = 1000,
+        queue_size : int = 1000,
+        ):
+        self.source = source
+        self.history = collections.deque(maxlen=history)
+        self.queue_size = queue_size
+        self.seq = 0
+        self.subscribers = set()
+        self._task = None
+
+
+    async def subscribe(
+        self : "StatusBroadcaster",
+        last_event_id : int | None = None,
+        keepalive : float | None = None,
+        ) -> AsyncIterator[tuple[int, status_models.StatusChange] | None]:
+        """
+            Yield the (id, change) pairs after `last_event_id`: first the missed ones still in the history, then the new ones.
+            If `keepalive` is set, None is yielded whenever no change arrived for that many seconds.
+            The iteration ends if the source ends or if the subscriber falls too far behind.
+        """
+        queue = asyncio.Queue(self.queue_size)
+        backlog = [item for item in self.history if last_event_id is not None and item[0] > last_event_id]
+        self.subscribers.add(queue)
+        self._start()
+        try:
+            for item in backlog:
+                yield item
+            while True:
+                try:
+                    item = await asyncio.wait_for(queue.get(), keepalive)
+                except TimeoutError:
+                    yield None
+                    continue
+                if item is None:
+                    return
+                yield item
+        finally:
+            self.subscribers.discard(queue)
+            if not self.subscribers:
+                self._stop()
+
+
+    def _start(self : "StatusBroadcaster") -> None:
+        if self._task is None:
+            self._task = asyncio.create_task(self._pump())
+
+
+    def _stop(self : "StatusBroadcaster") -> None:
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+
+    def _close(self : "StatusBroadcaster", queue : asyncio.Queue, drop : bool = False) -> None:
+        # end the subscriber's iteration after the changes it hasn't read yet, or drop them (`drop`, or no room for the end):
+        # the subscriber then resumes from the history with its Last-Event-ID
+        if drop or queue.full():
+            while not queue.empty():
+                queue.get_nowait()
+        queue.put_nowait(None)
+
+
+    async def _pump(self : "StatusBroadcaster") -> None:
+        try:
+            async for change in self.source():
+                self.seq += 1
+                item = (self.seq, change)
+                self.history.append(item)
+                for queue in list(self.subscribers):
+                    try:
+                        queue.put_nowait(item)
+                    except asyncio.QueueFull:
+                        # the client can't keep up: end its stream, it can resume with its Last-Event-ID
+                        logging.getLogger().warning("Closing a lagging status stream subscriber")
+                        self.subscribers.discard(queue)
+                        self._close(queue, drop=True)
+        except asyncio.CancelledError:
+            raise
+        except Exception as exc:
+            logging.getLogger().exception(exc)
+        # the source ended
+        self._task = None
+        for queue in list(self.subscribers):
+            self._close(queue)
+        self.subscribers.clear()
@@ -0,0 +1,632 @@
+import array
+import bisect
+import datetime
+import heapq
+import itertools
+import json
+import mmap
+import zlib
+from typing import Any, Callable, Hashable, Iterable
+from . import models as status_models
+from .store import TrigramIndex, _utc
+
+
+EPOCH = datetime.datetime(1970, 1, 1, tzinfo=datetime.timezone.utc)
+_MICROSECOND = datetime.timedelta(microseconds=1)
+
+
+def to_micros(dt : datetime.datetime) -> int:
+    # microseconds since the epoch: exact for datetimes, and cheap to store and compare
+    return (_utc(dt) - EPOCH) // _MICROSECOND
+
+
+def from_micros(micros : int) -> datetime.datetime:
+    return EPOCH + datetime.timedelta(microseconds=micros)
+
+
+class Interner:
+    """Small int codes for repeated values (eg. resource ids), so columns can hold the codes."""
+
+    def __init__(self : "Interner"):
+        self.values = []
+        self.codes = {}
+
+
+    def __len__(self : "Interner") -> int:
+        return len(self.values)
+
+
+    def code(self : "Interner", value : Hashable) -> int:
+        """The code of `value`, adding it if it's new"""
+        c = self.codes.get(value)
+        if c is None:
+            c = self.codes[value] = len(self.values)
+            self.values.append(value)
+        return c
+
+
+class MappedStrings:
+    """A read-only list of strings kept as one UTF-8 blob and offsets, eg. in a memory-mapped file"""
+
+    def __init__(self : "MappedStrings", blob : memoryview, offsets : memoryview):
+        self.blob = blob
+        self.offsets = offsets
+
+
+    def __len__(self : "MappedStrings") -> int:
+        return len(self.offsets) - 1
+
+
+    def __getitem__(self : "MappedStrings", i : int) -> str:
+        return bytes(self.blob[self.offsets[i]:self.offsets[i + 1]]).decode()
+
+
+class Strings(MappedStrings):
+    """A list of strings that only grows, in the layout of `MappedStrings`: one UTF-8 blob and the offsets of the strings"""
+
+    def __init__(self : "Strings", strings : Iterable[str] = ()):
+        super().__init__(bytearray(), array.array("q", [0]))
+        for s in strings:
+            self.append(s)
+
+
+    def __getitem__(self : "Strings", i : int) -> str:
+        return self.blob[self.offsets[i]:self.offsets[i + 1]].decode()
+
+
+    def append(self : "Strings", s : str) -> None:
+        self.blob += s.encode()
+        self.offsets.append(len(self.blob))
+
+
+class IdRows:
+    """
+        An id -> row mapping as an open-addressing hash table of rows in an int32 array:
+        the ids are only kept by the rows' `Strings`, and a slot's id is checked against them on lookup.
+        The table is at most half full, so it takes 8 to 16 bytes per id.
+    """
+
+    _EMPTY = -1
+    _REMOVED = -2
+
+    def __init__(self : "IdRows", ids : MappedStrings):
+        self.ids = ids
+        self.slots = array.array("i", [self._EMPTY]) * 8
+        # the live ids, and the slots taken by live and removed ids
+        self.size = 0
+        self.used = 0
+
+
+    def __len__(self : "IdRows") -> int:
+        return self.size
+
+
+    def __iter__(self : "IdRows"):
+        return (self.ids[row] for row in self.slots if row >= 0)
+
+
+    def _find(self : "IdRows", id : str) -> int:
+        # linear probing: the slot of id, or else the slot to put it in
+        mask = len(self.slots) - 1
+        i = hash(id) & mask
+        free = None
+        while True:
+            row = self.slots[i]
+            if row == self._EMPTY:
+                return i if free is None else free
+            if row == self._REMOVED:
+                if free is None:
+                    free = i
+            elif self.ids[row] == id:
+                return i
+            i = (i + 1) & mask
+
+
+    def get(self : "IdRows", id : str, default : int | None = None) -> int | None:
+        row = self.slots[self._find(id)]
+        return row if row >= 0 else default
+
+
+    def __contains__(self : "IdRows", id : str) -> bool:
+        return self.get(id) is not None
+
+
+    def __setitem__(self : "IdRows", id : str, row : int) -> None:
+        i = self._find(id)
+        if self.slots[i] < 0:
+            self.size += 1
+            if self.slots[i] == self._EMPTY:
+                self.used += 1
+        self.slots[i] = row
+        if 2 * self.used > len(self.slots):
+            self._resize()
+
+
+    def pop(self : "IdRows", id : str, default : int | None = None) -> int | None:
+        i = self._find(id)
+        row = self.slots[i]
+        if row < 0:
+            return default
+        self.slots[i] = self._REMOVED
+        self.size -= 1
+        return row
+
+
+    def _resize(self : "IdRows") -> None:
+        # rehash the live rows (dropping the removed ones) into a table at most a quarter full
+        rows = [row for row in self.slots if row >= 0]
+        size = 8
+        while size < 4 * len(rows):
+            size *= 2
+        self.slots = array.array("i", [self._EMPTY]) * size
+        self.size = self.used = 0
+        for row in rows:
+            self[self.ids[row]] = row
+
+
+class MappedRows:
+    """A read-only id -> row mapping, by binary search in the rows sorted by id"""
+
+    def __init__(self : "MappedRows", ids : MappedStrings, by_id : memoryview):
+        self.ids = ids
+        self.by_id = by_id
+
+
+    def __len__(self : "MappedRows") -> int:
+        return len(self.by_id)
+
+
+    def __iter__(self : "MappedRows"):
+        return (self.ids[row] for row in self.by_id)
+
+
+    def get(self : "MappedRows", id : str, default : int | None = None) -> int | None:
+        i = bisect.bisect_left(self.by_id, id, key=self.ids.__getitem__)
+        if i < len(self.by_id) and self.ids[self.by_id[i]] == id:
+            return self.by_id[i]
+        return default
+
+
+    def __contains__(self : "MappedRows", id : str) -> bool:
+        return self.get(id) is not None
+
+
+class EventColumns:
+    """
+        Compact storage for large event histories, a drop-in replacement for the events `Table` of a `StatusStore`.
+
+        Events are stored by row in typed arrays rather than as models:
+        timestamps are int64 microseconds, statuses are int8 codes,
+        and resource ids, incident ids, names and descriptions are int32 codes into tables of distinct values.
+        The hash indexes hold arrays of rows sorted by (occurred_at, id), like the posting lists of a `Table`,
+        and filters are checked row by row against the columns (without NumPy, the scans aren't vectorized),
+        so `Event` models are only built for the rows of the returned page.
+        Status texts repeat a lot, so the trigram index covers the distinct texts rather than the events.
+        The event ids are kept as one UTF-8 blob with an `IdRows` hash table of their rows.
+        The rows of removed events aren't reused.
+        With 100k events of the status generator, the columns take about 140 bytes per event against about 1.4 KB
+        for a `Table`; a whole `StatusStore` takes about 400 bytes per event against 2.5 KB,
+        as its timelines, change log and incidents keep each event's id and a few dozen bytes of their own.
+        `dump` and `load` keep the events as compressed bytes; `save` and `attach` keep them in a file mapped in memory,
+        read-only and shared by every process attaching it.
+    """
+
+    STATUSES = list(status_models.Status)
+
+    def __init__(self : "EventColumns"):
+        # row -> event id (kept once removed) and id -> row
+        self.ids = Strings()
+        self.rows = IdRows(self.ids)
+        self.occurred_at = array.array("q")
+        self.modified = array.array("q")
+        self.versions = array.array("q")
+        self.status = array.array("b")
+        self.resource = array.array("i")
+        self.incident = array.array("i")
+        self.name = array.array("i")
+        self.description = array.array("i")
+        self.resource_ids = Interner()
+        self.incident_ids = Interner()
+        self.texts = Interner()
+        self.text_index = TrigramIndex()
+        # every row, and the rows of each indexed code, sorted by (occurred_at, id)
+        self.order = array.array("i")
+        self.indexes = {"name": {}, "resource_id": {}, "incident_id": {}, "status": {}, "description": {}}
+        self._bind_columns()
+        # attached columns are read-only
+        self.read_only = False
+        self._key = lambda row: (self.occurred_at[row], self.ids[row])
+        self._time = lambda row: self.occurred_at[row]
+        # bumped on every change, for conditional requests
+        self.version = 0
+        self.last_modified = None
+
+
+    def _bind_columns(self : "EventColumns") -> None:
+        # the column of each index and the codes of its values
+        self._columns = {
+            "name": (self.name, self.texts.codes),
+            "resource_id": (self.resource, self.resource_ids.codes),
+            "incident_id": (self.incident, self.incident_ids.codes),
+            "status": (self.status, {s: i for i, s in enumerate(self.STATUSES)}),
+            "description": (self.description, self.texts.codes),
+        }
+
+
+    def __len__(self : "EventColumns") -> int:
+        return len(self.rows)
+
+
+    def add(self : "EventColumns", event : status_models.Event) -> None:
+        if self.read_only:
+            raise ValueError("These event columns are read-only")
+        if event.id in self.rows:
+            self.remove(event.id)
+        row = len(self.ids)
+        self.ids.append(event.id)
+        self.rows[event.id] = row
+        self.occurred_at.append(to_micros(event.occurred_at))
+        self.modified.append(to_micros(event.last_modified))
+        self.versions.append(event._version)
+        self.status.append(self.STATUSES.index(event.status))
+        self.resource.append(self.resource_ids.code(event.resource_id))
+        self.incident.append(self.incident_ids.code(event.incident_id))
+        self.name.append(self._text_code(event.name))
+        self.description.append(self._text_code(event.description))
+        self._touch(_utc(event.last_modified))
+
+        key = self._key(row)
+        self._insert(self.order, row, key)
+        for name, (column, _) in self._columns.items():
+            self._insert(self.indexes[name].setdefault(column[row], array.array("i")), row, key)
+
+
+    def remove(self : "EventColumns", id : str) -> None:
+        if self.read_only:
+            raise ValueError("These event columns are read-only")
+        row = self.rows.pop(id, None)
+        if row is None:
+            return
+        key = self._key(row)
+        self._delete(self.order, key)
+        for name, (column, _) in self._columns.items():
+            index = self.indexes[name]
+            postings = index[column[row]]
+            self._delete(postings, key)
+            if not postings:
+                del index[column[row]]
+        self._touch(datetime.datetime.now(datetime.timezone.utc))
+
+
+    def _text_code(self : "EventColumns", text : str) -> int:
+        n = len(self.texts)
+        code = self.texts.code(text)
+        if code == n:
+            self.text_index.add(code, text)
+        return code
+
+
+    def _touch(self : "EventColumns", modified : datetime.datetime | None) -> None:
+        self.version += 1
+        if modified is not None and (self.last_modified is None or modified > self.last_modified):
+            self.last_modified = modified
+
+
+    def get(self : "EventColumns", id : str) -> status_models.Event | None:
+        row = self.rows.get(id)
+        return self._event(row) if row is not None else None
+
+
+    def lookup(self : "EventColumns", index : str, value : Any, limit : int | None = None) -> list[status_models.Event]:
+        """Return the (first `limit`) events with the given indexed value, in (occurred_at, id) order."""
+        code = self._columns[index][1].get(value)
+        postings = self.indexes[index].get(code, ()) if code is not None else ()
+        return [self._event(row) for row in itertools.islice(postings, max(limit, 0) if limit is not None else None)]
+
+
+    def _event(self : "EventColumns", row : int) -> status_models.Event:
+        # the columns were validated when the event was added
+        event = status_models.Event.model_construct(
+            id=self.ids[row],
+            name=self.texts.values[self.name[row]],
+            description=self.texts.values[self.description[row]],
+            last_modified=from_micros(self.modified[row]),
+            occurred_at=from_micros(self.occurred_at[row]),
+            status=self.STATUSES[self.status[row]],
+            resource_id=self.resource_ids.values[self.resource[row]],
+            incident_id=self.incident_ids.values[self.incident[row]],
+        )
+        event._version = self.versions[row]
+        return event
+
+
+    def find(
+        self : "EventColumns",
+        offset : int = 0,
+        limit : int | None = None,
+        incident_id : str | None = None,
+        resource_id : str | None = None,
+        name : str | None = None,
+        description : str | None = None,
+        status : status_models.Status | None = None,
+        from_ : datetime.datetime | None = None,
+        to : datetime.datetime | None = None,
+        time_ : datetime.datetime | None = None,
+        modified_since : datetime.datetime | None = None,
+        after : tuple | None = None,
+        q : str | None = None,
+        ) -> list[status_models.Event]:
+        """The events matching the filters of `StatusStore.find_events`, in (occurred_at, id) order or best matches of `q` first."""
+        rows, scores = self.select(incident_id, resource_id, name, description, status, from_, to, time_, modified_since, after, q)
+        stop = offset + max(limit, 0) if limit is not None else None
+        if scores is None:
+            page = itertools.islice(rows, offset, stop)
+        else:
+            # a stable sort, so equally ranked events stay in key order
+            page = sorted(rows, key=lambda row: -scores(row))[offset:stop]
+        return [self._event(row) for row in page]
+
+
+    def select(
+        self : "EventColumns",
+        incident_id : str | None = None,
+        resource_id : str | None = None,
+        name : str | None = None,
+        description : str | None = None,
+        status : status_models.Status | None = None,
+        from_ : datetime.datetime | None = None,
+        to : datetime.datetime | None = None,
+        time_ : datetime.datetime | None = None,
+        modified_since : datetime.datetime | None = None,
+        after : tuple | None = None,
+        q : str | None = None,
+        ) -> tuple[Iterable[int], Callable[[int], float] | None]:
+        """
+            The rows matching the filters, lazily in (occurred_at, id) order,
+            and the `q` score of a row (None without `q`).
+        """
+        lo = to_micros(from_) if from_ else None
+        hi = to_micros(to) if to else None
+        if time_:
+            t = to_micros(time_)
+            lo = max(lo, t) if lo is not None else t
+            hi = min(hi, t + 1) if hi is not None else t + 1
+        after = (to_micros(after[0]), after[1]) if after is not None else None
+
+        # the smallest posting list drives the query, like in Table.select
+        filters = {"incident_id": incident_id, "resource_id": resource_id, "name": name, "status": status}
+        codes = {}
+        # (size, index name, iterator factory) of each candidate driver
+        sources = []
+        for index, value in filters.items():
+            if value is None:
+                continue
+            codes[index] = self._columns[index][1].get(value)
+            postings = self.indexes[index].get(codes[index])
+            if not postings:
+                return (), None
+            i, j = self._bounds(postings, lo, hi, after)
+            sources.append((j - i, index, lambda p=postings, i=i, j=j: itertools.islice(p, i, j)))
+        if description:
+            # the rows of every text containing the description, merged in key order
+            texts = self._matching_texts(description)
+            bounded = [(p, *self._bounds(p, lo, hi, after)) for p in map(self.indexes["description"].get, texts) if p]
+            sources.append((
+                sum(j - i for _, i, j in bounded),
+                "description",
+                lambda: heapq.merge(*(itertools.islice(p, i, j) for p, i, j in bounded), key=self._key),
+            ))
+        if not sources:
+            i, j = self._bounds(self.order, lo, hi, after)
+            sources.append((j - i, None, lambda: itertools.islice(self.order, i, j)))
+        size, driver_name, driver = min(sources, key=lambda s: s[0])
+        if size == 0:
+            return (), None
+
+        # the other filters are checked against the columns
+        checks = [(self._columns[index][0], code) for index, code in codes.items() if index != driver_name]
+        predicates = []
+        if description and driver_name != "description":
+            predicates.append(lambda row: self.description[row] in texts)
+        if modified_since:
+            since = to_micros(modified_since)
+            predicates.append(lambda row: self.modified[row] >= since)
+        scores = None
+        if q:
+            # the name weighs more than the description, like in Table.rank
+            text_scores = self.text_index.rank(q)
+            scores = lambda row: 2 * text_scores.get(self.name[row], 0) + text_scores.get(self.description[row], 0)
+            predicates.append(lambda row: scores(row) > 0)
+
+        rows = driver()
+        if checks or predicates:
+            rows = filter(self._all(checks, predicates), rows)
+        return rows, scores
+
+
+    @staticmethod
+    def _all(checks : list[tuple[array.array, int]], predicates : list[Callable[[int], bool]]) -> Callable[[int], bool]:
+        if len(checks) == 1 and not predicates:
+            column, code = checks[0]
+            return lambda row: column[row] == code
+        return lambda row: all(column[row] == code for column, code in checks) and all(p(row) for p in predicates)
+
+
+    def _matching_texts(self : "EventColumns", s : str) -> set[int]:
+        # the codes of the texts containing s
+        codes = self.text_index.contains(s)
+        if codes is None:
+            codes = {code for code, text in enumerate(self.texts.values) if s in text}
+        return codes
+
+
+    def _bounds(
+        self : "EventColumns",
+        postings : array.array,
+        lo : int | None,
+        hi : int | None,
+        after : tuple | None = None,
+        ) -> tuple[int, int]:
+        i = bisect.bisect_left(postings, lo, key=self._time) if lo is not None else 0
+        if after is not None:
+            i = max(i, bisect.bisect_right(postings, after, key=self._key))
+        j = bisect.bisect_left(postings, hi, lo=i, key=self._time) if hi is not None else len(postings)
+        return i, max(i, j)
+
+
+    def _insert(self : "EventColumns", postings : array.array, row : int, key : tuple) -> None:
+        # events mostly arrive in time order, so appending is the common case
+        if not postings or self._key(postings[-1]) <= key:
+            postings.append(row)
+        else:
+            postings.insert(bisect.bisect_right(postings, key, key=self._key), row)
+
+
+    def _delete(self : "EventColumns", postings : array.array, key : tuple) -> None:
+        i = bisect.bisect_left(postings, key, key=self._key)
+        if i < len(postings) and self._key(postings[i]) == key:
+            del postings[i]
+
+
+    # the columns of a dump, in order
+    _DUMPED = ("occurred_at", "modified", "versions", "status", "resource", "incident", "name", "description")
+
+    def _dumped(self : "EventColumns", c : str) -> array.array:
+        # a column of the live rows, in key order
+        column = getattr(self, c)
+        return array.array(getattr(column, "typecode", None) or column.format, map(column.__getitem__, self.order))
+
+
+    def dump(self : "EventColumns") -> bytes:
+        """The live events as compressed bytes (for this machine's byte order), see `load`"""
+        header = json.dumps({
+            "ids": [self.ids[row] for row in self.order],
+            "resource_ids": self.resource_ids.values,
+            "incident_ids": self.incident_ids.values,
+            "texts": self.texts.values,
+        }).encode()
+        columns = [self._dumped(c).tobytes() for c in self._DUMPED]
+        return zlib.compress(b"".join([len(header).to_bytes(8, "little"), header, *columns]))
+
+
+    @classmethod
+    def load(cls : type["EventColumns"], data : bytes) -> "EventColumns":
+        """Rebuild the columns and indexes of a `dump`, without building any `Event` model"""
+        data = zlib.decompress(data)
+        n = int.from_bytes(data[:8], "little")
+        header = json.loads(data[8:8 + n])
+        columns = cls()
+        columns.ids = Strings(header["ids"])
+        columns.rows = IdRows(columns.ids)
+        for row, id in enumerate(header["ids"]):
+            columns.rows[id] = row
+        for interner, values in ((columns.resource_ids, header["resource_ids"]), (columns.incident_ids, header["incident_ids"])):
+            # in place, as the columns keep the codes
+            interner.values.extend(values)
+            interner.codes.update((v, code) for code, v in enumerate(values))
+        for text in header["texts"]:
+            columns._text_code(text)
+        pos = 8 + n
+        for c in columns._DUMPED:
+            column = getattr(columns, c)
+            size = len(columns.ids) * column.itemsize
+            column.frombytes(data[pos:pos + size])
+            pos += size
+        # the rows were dumped in key order
+        columns.order = array.array("i", range(len(columns.ids)))
+        for name, (column, _) in columns._columns.items():
+            index = columns.indexes[name]
+            for row, code in enumerate(column):
+                index.setdefault(code, array.array("i")).append(row)
+        if columns.ids:
+            columns.last_modified = from_micros(max(columns.modified))
+        return columns
+
+
+    _MAGIC = b"IRIEVCOL"
+
+    def save(self : "EventColumns", path : str) -> None:
+        """
+            Write the live events to a file that `attach` maps without copying or decompressing it:
+            the columns, the posting lists and the ids are laid out as arrays (for this machine's byte order).
+        """
+        n = len(self.order)
+        ids = [self.ids[row].encode() for row in self.order]
+        offsets = array.array("q", itertools.accumulate(map(len, ids), initial=0))
+        sections = {c: self._dumped(c) for c in self._DUMPED}
+        sections["id_offsets"] = offsets
+        sections["ids"] = b"".join(ids)
+        sections["by_id"] = array.array("i", sorted(range(n), key=ids.__getitem__))
+        # the posting lists of each index, one after the other, with the [start, end) of each code
+        # (the rows are renumbered in key order, so the posting lists stay sorted)
+        new_row = {row: i for i, row in enumerate(self.order)}
+        postings = {}
+        for name, index in self.indexes.items():
+            rows, bounds = array.array("i"), []
+            for code, p in index.items():
+                bounds.append((code, len(rows), len(rows) + len(p)))
+                rows.extend(map(new_row.__getitem__, p))
+            sections[f"postings.{name}"] = rows
+            postings[name] = bounds
+
+        layout, pos, data = {}, 0, []
+        for name, section in sections.items():
+            raw = section.tobytes() if isinstance(section, array.array) else section
+            layout[name] = (pos, len(raw), section.typecode if isinstance(section, array.array) else "B")
+            # 8-byte aligned, so the sections can be cast to their type
+            data.append(raw + bytes(-len(raw) % 8))
+            pos += len(data[-1])
+        header = json.dumps({
+            "n": n,
+            "resource_ids": self.resource_ids.values,
+            "incident_ids": self.incident_ids.values,
+            "texts": self.texts.values,
+            "sections": layout,
+            "postings": postings,
+        }).encode()
+        header += b" " * (-len(header) % 8)
+        with open(path, "wb") as f:
+            f.write(self._MAGIC + len(header).to_bytes(8, "little") + header)
+            for d in data:
+                f.write(d)
+
+
+    @classmethod
+    def attach(cls : type["EventColumns"], path : str) -> "EventColumns":
+        """
+            Map the events of a `save`d file, read-only.
+            The columns, posting lists and ids stay in the mapping, so processes attaching the same file
+            (eg. gunicorn workers) share its memory; only the distinct texts and ids of resources and incidents are copied.
+        """
+        with open(path, "rb") as f:
+            mapping = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        buffer = memoryview(mapping)
+        if bytes(buffer[:8]) != cls._MAGIC:
+            raise ValueError(f"{path} is not a saved EventColumns file")
+        size = int.from_bytes(buffer[8:16], "little")
+        header = json.loads(bytes(buffer[16:16 + size]))
+        base = 16 + size
+
+        def section(name : str) -> memoryview:
+            offset, length, typecode = header["sections"][name]
+            return buffer[base + offset:base + offset + length].cast(typecode)
+
+        columns = cls()
+        columns.read_only = True
+        for c in cls._DUMPED:
+            setattr(columns, c, section(c))
+        columns.ids = MappedStrings(section("ids"), section("id_offsets"))
+        columns.rows = MappedRows(columns.ids, section("by_id"))
+        for interner, values in ((columns.resource_ids, header["resource_ids"]), (columns.incident_ids, header["incident_ids"])):
+            interner.values.extend(values)
+            interner.codes.update((v, code) for code, v in enumerate(values))
+        for text in header["texts"]:
+            columns._text_code(text)
+        columns.order = range(header["n"])
+        for name, bounds in header["postings"].items():
+            rows = section(f"postings.{name}")
+            columns.indexes[name] = {code: rows[start:end] for code, start, end in bounds}
+        columns._bind_columns()
+        if header["n"]:
+            columns.last_modified = from_micros(max(columns.modified))
+        return columns
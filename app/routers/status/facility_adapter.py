@@ -1,5 +1,6 @@
 from abc import ABC, abstractmethod
 import datetime
+from typing import AsyncIterator
 from fastapi import Query
 from . import models as status_models
 
@@ -9,6 +10,16 @@ class FacilityAdapter(ABC):
     Facility-specific code is handled by the implementation of this interface.
     Use the `IRI_API_ADAPTER` environment variable (defaults to `app.demo_adapter.FacilityAdapter`) 
     to install your facility adapter before the API starts.
+
+    The list methods receive an `after` keyset cursor when the client pages with a `cursor`:
+    return only the items whose `cursor_key()` is greater than `after`, sorted by `cursor_key()`.
+    The `offset` is then applied after the cursor.
+    They receive a `q` search string when the client searches by relevance:
+    return only the items whose name or description match it, best matches first.
+    `get_resources` receives an `as_of` time when the client asks for past statuses:
+    return the resources with the `current_status` they had at that time (the status of their last event at or before it).
+    Adapters can leave `after`, `q` and `as_of` out of their signatures:
+    requests using them are then rejected (400), and the pages don't link to a next page by cursor.
     """
 
 
@@ -21,7 +32,10 @@ class FacilityAdapter(ABC):
         description : str | None = None,
         group : str | None = None,
         modified_since : datetime.datetime | None = None,
-        resource_type: status_models.ResourceType = Query(default=None)
+        resource_type: status_models.ResourceType = Query(default=None),
+        after : tuple | None = None,
+        q : str | None = None,
+        as_of : datetime.datetime | None = None,
         ) -> list[status_models.Resource]:
         pass
 
@@ -48,6 +62,8 @@ class FacilityAdapter(ABC):
         to : datetime.datetime | None = None,
         time : datetime.datetime | None = None,
         modified_since : datetime.datetime | None = None,
+        after : tuple | None = None,
+        q : str | None = None,
         ) -> list[status_models.Event]:
         pass
 
@@ -75,6 +91,8 @@ class FacilityAdapter(ABC):
         time_ : datetime.datetime | None = None,
         modified_since : datetime.datetime | None = None,
         resource_id : str | None = None,
+        after : tuple | None = None,
+        q : str | None = None,
         ) -> list[status_models.Incident]:
         pass
 
@@ -85,3 +103,113 @@ class FacilityAdapter(ABC):
         id : str
         ) -> status_models.Incident:
         pass
+
+
+    async def get_resources_by_ids(
+        self : "FacilityAdapter",
+        ids : list[str],
+        ) -> list[status_models.Resource]:
+        """
+            Return the resources with these ids, in that order and skipping unknown ids, for `?ids=`.
+            The default calls `get_resource` once per id; override it to look them all up in one query.
+        """
+        return [r for r in [await self.get_resource(id) for id in ids] if r]
+
+
+    async def get_incidents_by_ids(
+        self : "FacilityAdapter",
+        ids : list[str],
+        ) -> list[status_models.Incident]:
+        """Like `get_resources_by_ids`, for incidents (the default calls `get_incident` once per id)"""
+        return [i for i in [await self.get_incident(id) for id in ids] if i]
+
+
+    async def get_events_by_ids(
+        self : "FacilityAdapter",
+        incident_id : str,
+        ids : list[str],
+        ) -> list[status_models.Event]:
+        """Like `get_resources_by_ids`, for the events of an incident (the default calls `get_event` once per id)"""
+        return [e for e in [await self.get_event(incident_id, id) for id in ids] if e]
+
+
+    async def get_incidents_events(
+        self : "FacilityAdapter",
+        incident_ids : list[str],
+        limit : int,
+        ) -> dict[str, list[status_models.Event]]:
+        """
+            Return the first `limit` events (by `occurred_at`) of each incident, for `?embed=events`.
+            The default calls `get_events` once per incident;
+            override it to fetch the events of a whole page of incidents in one query (eg. `StatusStore.incidents_events`).
+        """
+        return {id: await self.get_events(id, 0, limit) for id in incident_ids}
+
+
+    async def get_version(
+        self : "FacilityAdapter",
+        collection : str,
+        ) -> tuple[str, datetime.datetime | None] | None:
+        """
+            Optionally return a cheap version of a collection ("resources", "incidents" or "events"):
+            a tag that changes whenever any object of the collection changes, and its latest `last_modified`.
+            The status endpoints use it for their `ETag` and `Last-Modified` headers,
+            and answer `If-None-Match`/`If-Modified-Since` requests with a 304 before querying the adapter.
+            Returning None (the default) disables conditional requests.
+        """
+        return None
+
+
+    def watch(
+        self : "FacilityAdapter",
+        ) -> AsyncIterator[status_models.StatusChange] | None:
+        """
+            Optionally return an async iterator of status changes (eg. an async generator reading the facility's message bus),
+            yielding resource status transitions, new events and incident updates as they happen.
+            It is consumed once per process and fanned out to every `/status/stream` client.
+            Returning None (the default) disables `/status/stream`.
+        """
+        return None
+
+
+    async def get_changes(
+        self : "FacilityAdapter",
+        since : str | None,
+        limit : int,
+        ) -> status_models.StatusChanges | None:
+        """
+            Optionally return the objects created or modified after the `since` watermark (None means from the beginning),
+            covering at most `limit` changes, and a new watermark.
+            Watermarks are opaque to clients but must be monotonic, so the cost can stay proportional to the changes.
+            Returning None (the default) disables `/status/changes`.
+        """
+        return None
+
+
+    async def ingest_events(
+        self : "FacilityAdapter",
+        events : list[status_models.Event],
+        ) -> status_models.EventBatchResult | None:
+        """
+            Optionally add or replace a batch of events (`POST /status/events:batch`), as one transaction:
+            set each resource's `current_status` to the status of its latest event and add the events to their incidents.
+            The events' resources and incidents are known to exist.
+            The endpoint authenticates the caller with `get_current_user`, so the adapter must also be an `AuthenticatedAdapter`.
+            Returning None (the default) disables `POST /status/events:batch`.
+        """
+        return None
+
+
+    async def get_availability(
+        self : "FacilityAdapter",
+        resource_id : str,
+        boundaries : list[datetime.datetime],
+        ) -> list[status_models.AvailabilityBucket] | None:
+        """
+            Optionally return the time the resource spent in each status between consecutive `boundaries`
+            (so one bucket less than there are boundaries), from the statuses of its events.
+            Before its first event, a resource is in the `unknown` status.
+            This should be served from running totals rather than by replaying the events (see `StatusStore.resource_durations`).
+            Returning None (the default) disables `/status/resources/{id}/availability`.
+        """
+        return None
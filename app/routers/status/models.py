@@ -1,6 +1,6 @@
 import datetime
 import enum
-from pydantic import BaseModel, computed_field, Field
+from pydantic import BaseModel, computed_field, Field, PrivateAttr
 from ... import config
 
 class Link(BaseModel):
@@ -20,6 +20,9 @@ class NamedResource(BaseModel):
     name : str
     description : str
     last_modified : datetime.datetime
+    # bumped by the status store whenever the object is stored, to invalidate its cached serialization
+    # (0, for objects the adapter doesn't version, disables the cache)
+    _version : int = PrivateAttr(default=0)
 
 
     @staticmethod
@@ -29,6 +32,15 @@ class NamedResource(BaseModel):
         return next((r for r in a if r.id == id or (allow_name and r.name == id)), None)
 
 
+    @staticmethod
+    def index_by_id(a, allow_name: bool|None=False) -> dict:
+        # Build a dictionary for repeated find_by_id lookups: index_by_id(a).get(id)
+        # If allow_name is True, the resources can also be found by their name (ids take precedence).
+        index = {r.name: r for r in reversed(a)} if allow_name else {}
+        index.update((r.id, r) for r in a)
+        return index
+
+
     @staticmethod
     def find(a, name, description, modified_since):
         def normalize(dt: datetime) -> datetime:
@@ -67,13 +79,18 @@ class Resource(NamedResource):
     @computed_field(description="The url of this object")
     @property
     def self_uri(self) -> str:
-        return f"{config.API_URL_ROOT}{config.API_PREFIX}{config.API_URL}/status/resources/{self.id}"
+        return f"{config.API_BASE_URL}/status/resources/{self.id}"
 
 
     @computed_field(description="The list of past events in this incident")
     @property
     def capability_uris(self) -> list[str]:
-        return [f"{config.API_URL_ROOT}{config.API_PREFIX}{config.API_URL}/account/capabilities/{e}" for e in self.capability_ids]
+        return [f"{config.API_BASE_URL}/account/capabilities/{e}" for e in self.capability_ids]
+
+
+    def cursor_key(self) -> tuple:
+        # the key resources are paginated by (see get_resources's cursor)
+        return (self.id,)
 
 
     @staticmethod
@@ -96,19 +113,24 @@ class Event(NamedResource):
     @computed_field(description="The url of this object")
     @property
     def self_uri(self) -> str:
-        return f"{config.API_URL_ROOT}{config.API_PREFIX}{config.API_URL}/status/incidents/{self.incident_id}/events/{self.id}"
+        return f"{config.API_BASE_URL}/status/incidents/{self.incident_id}/events/{self.id}"
 
 
     @computed_field(description="The resource belonging to this event")
     @property
     def resource_uri(self) -> str:
-        return f"{config.API_URL_ROOT}{config.API_PREFIX}{config.API_URL}/status/resources/{self.resource_id}"
+        return f"{config.API_BASE_URL}/status/resources/{self.resource_id}"
 
 
     @computed_field(description="The event's incident")
     @property
     def incident_uri(self) -> str|None:
-        return f"{config.API_URL_ROOT}{config.API_PREFIX}{config.API_URL}/status/incidents/{self.incident_id}" if self.incident_id else None
+        return f"{config.API_BASE_URL}/status/incidents/{self.incident_id}" if self.incident_id else None
+
+
+    def cursor_key(self) -> tuple:
+        # the key events are paginated by (see get_events's cursor)
+        return (self.occurred_at, self.id)
 
 
     @staticmethod
@@ -163,19 +185,24 @@ class Incident(NamedResource):
     @computed_field(description="The url of this object")
     @property
     def self_uri(self) -> str:
-        return f"{config.API_URL_ROOT}{config.API_PREFIX}{config.API_URL}/status/incidents/{self.id}"
+        return f"{config.API_BASE_URL}/status/incidents/{self.id}"
 
 
     @computed_field(description="The list of past events in this incident")
     @property
     def event_uris(self) -> list[str]:
-        return [f"{config.API_URL_ROOT}{config.API_PREFIX}{config.API_URL}/status/incidents/{self.id}/events/{e}" for e in self.event_ids]
+        return [f"{config.API_BASE_URL}/status/incidents/{self.id}/events/{e}" for e in self.event_ids]
 
 
     @computed_field(description="The list of resources that may be impacted by this incident")
     @property
     def resource_uris(self) -> list[str]:
-        return [f"{config.API_URL_ROOT}{config.API_PREFIX}{config.API_URL}/status/resources/{r}" for r in self.resource_ids]
+        return [f"{config.API_BASE_URL}/status/resources/{r}" for r in self.resource_ids]
+
+    def cursor_key(self) -> tuple:
+        # the key incidents are paginated by (see get_incidents's cursor)
+        return (self.start, self.id)
+
 
     def find(
         incidents : list,
@@ -203,3 +230,71 @@ class Incident(NamedResource):
         if time_:
             incidents = [e for e in incidents if e.start <= time_ and e.end > time_]
         return incidents
+
+
+class IncidentEmbed(enum.Enum):
+    events = "events"
+
+
+class IncidentWithEvents(Incident):
+    """An incident with its events embedded (`?embed=events`)"""
+    events : list[Event] = Field(description="The incident's first events, by occurred_at")
+
+
+class ChangeType(enum.Enum):
+    resource = "resource"
+    incident = "incident"
+    event = "event"
+
+
+class StatusChange(BaseModel):
+    """A change pushed by `/status/stream`: a resource status transition, a new event or an incident update"""
+    type : ChangeType
+    resource : Resource | None = None
+    incident : Incident | None = None
+    event : Event | None = None
+
+
+    @property
+    def resource_ids(self) -> list[str]:
+        # the resources this change is about, for filtering streams
+        if self.resource:
+            return [self.resource.id]
+        if self.event:
+            return [self.event.resource_id]
+        if self.incident:
+            return self.incident.resource_ids
+        return []
+
+
+class StatusChanges(BaseModel):
+    """The resources, incidents and events created or modified after a watermark"""
+    watermark : str = Field(description="Pass this as `since` to get the next changes")
+    reset : bool = Field(description="True if the given watermark wasn't recognized or is from before expired events were dropped; the changes then start from the beginning, so drop what was synced before")
+    more : bool = Field(description="True if there are more changes after this watermark")
+    resources : list[Resource]
+    incidents : list[Incident]
+    events : list[Event]
+
+
+class AvailabilityBucket(BaseModel):
+    """The time a resource spent in each status during a time window, in seconds"""
+    start : datetime.datetime
+    end : datetime.datetime
+    up : float
+    down : float
+    degraded : float
+    unknown : float
+
+
+class Availability(BaseModel):
+    """The time-in-state statistics of a resource, computed from its events"""
+    resource_id : str
+    buckets : list[AvailabilityBucket]
+
+
+class EventBatchResult(BaseModel):
+    """The outcome of adding a batch of events"""
+    events : int = Field(description="The number of events added or replaced")
+    resources : int = Field(description="The number of resources whose current status was updated")
+    incidents : int = Field(description="The number of incidents whose events were updated")
@@ -0,0 +1,326 @@
+import bisect
+import collections
+import datetime
+import hashlib
+import itertools
+import os
+import uuid
+import weakref
+from typing import Any
+from . import models as status_models
+from .columns import EventColumns
+from .store import _utc
+
+
+def month_start(t : datetime.datetime) -> datetime.datetime:
+    t = _utc(t).astimezone(datetime.timezone.utc)
+    return datetime.datetime(t.year, t.month, 1, tzinfo=datetime.timezone.utc)
+
+
+def next_month(start : datetime.datetime) -> datetime.datetime:
+    return start.replace(year=start.year + 1, month=1) if start.month == 12 else start.replace(month=start.month + 1)
+
+
+class BloomFilter:
+    """Approximate id membership in 2 bytes per id: no false negatives, and about 0.05% false positives."""
+
+    BITS = 16
+    HASHES = 11
+
+    def __init__(self : "BloomFilter", ids : list[str]):
+        self.size = max(64, len(ids) * self.BITS)
+        self.bits = bytearray((self.size + 7) // 8)
+        for id in ids:
+            for i in self._positions(id):
+                self.bits[i >> 3] |= 1 << (i & 7)
+
+
+    def _positions(self : "BloomFilter", id : str):
+        # double hashing of a single digest
+        h = hashlib.blake2b(id.encode(), digest_size=16).digest()
+        a, b = int.from_bytes(h[:8], "little"), int.from_bytes(h[8:], "little") | 1
+        return ((a + k * b) % self.size for k in range(self.HASHES))
+
+
+    def __contains__(self : "BloomFilter", id : str) -> bool:
+        return all(self.bits[i >> 3] & (1 << (i & 7)) for i in self._positions(id))
+
+
+# the segments of this process, disowned when it forks
+_segments = weakref.WeakSet()
+
+
+def _disown_segments() -> None:
+    for segment in list(_segments):
+        segment.owned = False
+
+
+# forked processes (eg. gunicorn workers with preload_app) share the files of the segments made before the fork
+os.register_at_fork(before=_disown_segments)
+
+
+class Segment:
+    """
+        A compacted, read-only partition: the compressed dump of its columns, in memory or in a file,
+        or its columns saved in a file that is mapped in memory (`mapped`),
+        and what's needed to skip it without loading it (its time range, resources, incidents and a Bloom filter of its ids).
+        Only the process that made a segment, and only until it forks, deletes its file:
+        after a fork the parent and the children may all still read it.
+    """
+
+    def __init__(
+        self : "Segment",
+        start : datetime.datetime,
+        columns : EventColumns,
+        directory : str | None = None,
+        mapped : bool = False,
+        ):
+        self.start = start
+        self.end = next_month(start)
+        self.count = len(columns)
+        self.resource_ids = {columns.resource_ids.values[code] for code in columns.indexes["resource_id"]}
+        self.incident_ids = {columns.incident_ids.values[code] for code in columns.indexes["incident_id"]}
+        self.ids = BloomFilter(list(columns.rows))
+        self.mapped = mapped
+        self.path = None
+        self.data = None
+        self.owned = True
+        _segments.add(self)
+        if directory is not None:
+            self.path = os.path.join(directory, f"events-{start:%Y-%m}-{uuid.uuid4().hex[:12]}.bin")
+        if mapped:
+            columns.save(self.path)
+        elif self.path is not None:
+            with open(self.path, "wb") as f:
+                f.write(columns.dump())
+        else:
+            self.data = columns.dump()
+
+
+    def __len__(self : "Segment") -> int:
+        return self.count
+
+
+    def load(self : "Segment") -> EventColumns:
+        if self.mapped:
+            return EventColumns.attach(self.path)
+        if self.path is None:
+            return EventColumns.load(self.data)
+        with open(self.path, "rb") as f:
+            return EventColumns.load(f.read())
+
+
+    def discard(self : "Segment") -> None:
+        if self.owned and self.path is not None and os.path.exists(self.path):
+            os.remove(self.path)
+
+
+    def may_match(self : "Segment", resource_id : str | None, incident_id : str | None) -> bool:
+        return (resource_id is None or resource_id in self.resource_ids) and (incident_id is None or incident_id in self.incident_ids)
+
+
+class PartitionedEvents:
+    """
+        Event storage partitioned by month, a drop-in replacement for the events `Table` of a `StatusStore`.
+
+        Each month of events is kept in its own `EventColumns`, so the `from`, `to` and `time` filters skip whole months,
+        and pages are read from the oldest matching month on, so a page only touches the months it needs.
+        All but the `hot` latest months are compacted into read-only `Segment`s (compressed dumps, kept in files under `directory`
+        if given, in memory otherwise), which are loaded on demand and kept in an LRU cache of `cached` months.
+        With `mapped`, the segments are rather saved uncompressed in `directory` and mapped in memory when loaded:
+        nothing is decompressed, and processes sharing the directory (eg. gunicorn workers) share the memory of the segments.
+        Changing an event of a compacted month loads it back as a regular partition until the next compaction.
+        Months that ended more than `retention` ago are dropped, and events of dropped months are ignored.
+        `compact` applies all this; `compaction_due` is set when a new month starts (the `StatusStore` then compacts).
+    """
+
+    def __init__(
+        self : "PartitionedEvents",
+        retention : datetime.timedelta | None = None,
+        hot : int = 2,
+        cached : int = 2,
+        directory : str | None = None,
+        mapped : bool = False,
+        ):
+        if mapped and directory is None:
+            raise ValueError("Mapped segments need a directory")
+        self.retention = retention
+        self.hot = hot
+        self.cached = cached
+        self.directory = directory
+        self.mapped = mapped
+        if directory is not None:
+            os.makedirs(directory, exist_ok=True)
+        # month start -> EventColumns, or Segment once compacted
+        self.partitions = {}
+        self.starts = []
+        # month start -> the loaded columns of a segment, least recently used first
+        self.cache = collections.OrderedDict()
+        self.expired_before = None
+        self.compaction_due = False
+        # bumped on every change, for conditional requests
+        self.version = 0
+        self.last_modified = None
+
+
+    def __len__(self : "PartitionedEvents") -> int:
+        return sum(len(p) for p in self.partitions.values())
+
+
+    def _touch(self : "PartitionedEvents", modified : datetime.datetime | None) -> None:
+        self.version += 1
+        if modified is not None and (self.last_modified is None or modified > self.last_modified):
+            self.last_modified = modified
+
+
+    def _read(self : "PartitionedEvents", start : datetime.datetime) -> EventColumns:
+        # the columns of a partition, loading a segment if needed
+        p = self.partitions[start]
+        if isinstance(p, EventColumns):
+            return p
+        columns = self.cache.get(start)
+        if columns is None:
+            columns = self.cache[start] = p.load()
+            while len(self.cache) > self.cached:
+                self.cache.popitem(last=False)
+        self.cache.move_to_end(start)
+        return columns
+
+
+    def _writable(self : "PartitionedEvents", start : datetime.datetime) -> EventColumns:
+        # the columns of a partition, turning a segment back into a regular partition
+        p = self.partitions.get(start)
+        if p is None:
+            p = self.partitions[start] = EventColumns()
+            if not self.starts or start > self.starts[-1]:
+                self.compaction_due = True
+            bisect.insort(self.starts, start)
+        elif isinstance(p, Segment):
+            columns = self._read(start)
+            del self.cache[start]
+            if columns.read_only:
+                columns = EventColumns.load(columns.dump())
+            p.discard()
+            p = self.partitions[start] = columns
+        return p
+
+
+    def _locate(self : "PartitionedEvents", id : str) -> tuple[datetime.datetime, EventColumns] | None:
+        # the partition of an event, latest months first
+        for start in reversed(self.starts):
+            p = self.partitions[start]
+            if isinstance(p, EventColumns) or id in p.ids:
+                columns = self._read(start)
+                if id in columns.rows:
+                    return start, columns
+        return None
+
+
+    def add(self : "PartitionedEvents", event : status_models.Event) -> None:
+        start = month_start(event.occurred_at)
+        if self.expired_before is not None and start < self.expired_before:
+            return
+        location = self._locate(event.id)
+        if location is not None:
+            self._writable(location[0]).remove(event.id)
+        self._writable(start).add(event)
+        self._touch(_utc(event.last_modified))
+
+
+    def remove(self : "PartitionedEvents", id : str) -> None:
+        location = self._locate(id)
+        if location is None:
+            return
+        self._writable(location[0]).remove(id)
+        self._touch(datetime.datetime.now(datetime.timezone.utc))
+
+
+    def get(self : "PartitionedEvents", id : str) -> status_models.Event | None:
+        location = self._locate(id)
+        return location[1].get(id) if location is not None else None
+
+
+    def lookup(self : "PartitionedEvents", index : str, value : Any, limit : int | None = None) -> list[status_models.Event]:
+        """Return the (first `limit`) events with the given indexed value, in (occurred_at, id) order."""
+        events = []
+        for start in self.starts:
+            if limit is not None and len(events) >= limit:
+                break
+            p = self.partitions[start]
+            if isinstance(p, Segment) and not p.may_match(value if index == "resource_id" else None, value if index == "incident_id" else None):
+                continue
+            events += self._read(start).lookup(index, value, limit - len(events) if limit is not None else None)
+        return events
+
+
+    def find(
+        self : "PartitionedEvents",
+        offset : int = 0,
+        limit : int | None = None,
+        incident_id : str | None = None,
+        resource_id : str | None = None,
+        name : str | None = None,
+        description : str | None = None,
+        status : status_models.Status | None = None,
+        from_ : datetime.datetime | None = None,
+        to : datetime.datetime | None = None,
+        time_ : datetime.datetime | None = None,
+        modified_since : datetime.datetime | None = None,
+        after : tuple | None = None,
+        q : str | None = None,
+        ) -> list[status_models.Event]:
+        """The events matching the filters of `StatusStore.find_events`, in (occurred_at, id) order or best matches of `q` first."""
+        # the months overlapping the time filters and the cursor
+        lo = max(filter(None, [_utc(from_), _utc(time_), _utc(after[0]) if after else None]), default=None)
+        hi = min(filter(None, [_utc(to), _utc(time_) + datetime.timedelta(microseconds=1) if time_ else None]), default=None)
+        i = bisect.bisect_right(self.starts, month_start(lo)) - 1 if lo is not None else 0
+        j = bisect.bisect_left(self.starts, hi) if hi is not None else len(self.starts)
+        starts = self.starts[max(i, 0):j]
+
+        def matches():
+            # months are disjoint, so their rows come in key order
+            for start in starts:
+                p = self.partitions[start]
+                if isinstance(p, Segment) and not p.may_match(resource_id, incident_id):
+                    continue
+                columns = self._read(start)
+                rows, scores = columns.select(incident_id, resource_id, name, description, status, from_, to, time_, modified_since, after, q)
+                for row in rows:
+                    yield columns, row, scores
+
+        stop = offset + max(limit, 0) if limit is not None else None
+        if q is None:
+            page = itertools.islice(matches(), offset, stop)
+        else:
+            # the scores are fractions of the trigrams of q, so they compare across months
+            page = sorted(matches(), key=lambda m: -m[2](m[1]))[offset:stop]
+        return [columns._event(row) for columns, row, _ in page]
+
+
+    def compact(self : "PartitionedEvents", now : datetime.datetime | None = None) -> datetime.datetime | None:
+        """
+            Drop the months past the retention and compact all but the hot months into segments.
+            Return the start of the oldest retained month if the retention applies (events before it are gone), None otherwise.
+        """
+        self.compaction_due = False
+        cutoff = None
+        if self.retention is not None:
+            cutoff = month_start((now or datetime.datetime.now(datetime.timezone.utc)) - self.retention)
+            self.expired_before = max(self.expired_before or cutoff, cutoff)
+            expired = self.starts[:bisect.bisect_left(self.starts, cutoff)]
+            for start in expired:
+                p = self.partitions.pop(start)
+                if isinstance(p, Segment):
+                    p.discard()
+                self.cache.pop(start, None)
+            if expired:
+                del self.starts[:len(expired)]
+                self._touch(None)
+        for start in self.starts[:max(0, len(self.starts) - self.hot)]:
+            p = self.partitions[start]
+            if not len(p):
+                del self.partitions[start]
+                self.starts.remove(start)
+            elif isinstance(p, EventColumns):
+                self.partitions[start] = Segment(start, p, self.directory, self.mapped)
+        return cutoff
@@ -0,0 +1,66 @@
+import collections
+from fastapi import Response
+from . import models as status_models
+
+
+class SerializationCache:
+    """
+        Pre-rendered JSON of status objects, so unchanged objects are only serialized once.
+        Entries are keyed by type and id and are valid for one version of the object:
+        its `last_modified` and the `_version` the status store (or the SQLite adapter) gives it when it is stored.
+        Objects without a `_version` (from adapters that don't version them) are serialized every time,
+        as their content could change without their `last_modified`.
+        List responses are assembled by concatenating the cached fragments.
+    """
+
+    def __init__(self : "SerializationCache", max_size : int = 100_000):
+        self.max_size = max_size
+        self._cache = collections.OrderedDict()
+
+
+    def dumps(self : "SerializationCache", obj : status_models.NamedResource) -> bytes:
+        if not obj._version:
+            return obj.model_dump_json().encode()
+        key = (type(obj), obj.id)
+        version = (obj.last_modified, obj._version)
+        entry = self._cache.get(key)
+        if entry is not None and entry[0] == version:
+            self._cache.move_to_end(key)
+            return entry[1]
+        data = obj.model_dump_json().encode()
+        self._cache[key] = (version, data)
+        if len(self._cache) > self.max_size:
+            self._cache.popitem(last=False)
+        return data
+
+
+    def dumps_embedded(
+        self : "SerializationCache",
+        obj : status_models.NamedResource,
+        name : str,
+        children : list[status_models.NamedResource],
+        ) -> bytes:
+        """The JSON of `obj` with the JSON of its `children` added as the `name` attribute, from the cached fragments"""
+        return self.dumps(obj)[:-1] + f',"{name}":['.encode() + b",".join(map(self.dumps, children)) + b"]}"
+
+
+    def response(
+        self : "SerializationCache",
+        content : status_models.NamedResource | list[status_models.NamedResource],
+        response : Response | None = None,
+        embed : tuple[str, dict[str, list[status_models.NamedResource]]] | None = None,
+        ) -> Response:
+        """
+            Return a JSON response for an object or a list of objects, keeping the headers set on the endpoint's `response`.
+            `embed` is an attribute name and the objects to embed in each object as that attribute, by id.
+        """
+        dumps = self.dumps
+        if embed is not None:
+            name, children = embed
+            dumps = lambda obj: self.dumps_embedded(obj, name, children.get(obj.id, []))
+        if isinstance(content, list):
+            body = b"[" + b",".join(map(dumps, content)) + b"]"
+        else:
+            body = dumps(content)
+        headers = {k: v for k, v in response.headers.items() if k != "content-length"} if response else None
+        return Response(content=body, media_type="application/json", headers=headers)
@@ -1,5 +1,14 @@
-from fastapi import HTTPException, Request, Query, Depends
-from . import models, facility_adapter
+import asyncio
+import datetime
+import email.utils
+import functools
+import hashlib
+import inspect
+import pydantic
+from fastapi import HTTPException, Request, Response, Query, Header, Depends
+from fastapi.exceptions import RequestValidationError
+from fastapi.responses import StreamingResponse
+from . import models, facility_adapter, broadcaster as status_broadcaster, serialization
 from .. import iri_router
 from ..error_handlers import DEFAULT_RESPONSES
 
@@ -9,24 +18,143 @@ router = iri_router.IriRouter(
     tags=["status"],
 )
 
+# responses are assembled from pre-rendered JSON of each object
+serializer = serialization.SerializationCache()
+
+# a single watcher of the adapter's changes, shared by every /status/stream client
+broadcaster = status_broadcaster.StatusBroadcaster(lambda: router.adapter.watch())
+
+STREAM_KEEPALIVE_SECS = 15
+
+MAX_AVAILABILITY_BUCKETS = 10000
+
+MAX_BATCH_EVENTS = 100_000
+
+MAX_BATCH_BYTES = 64 * 1024 * 1024
+
+MAX_IDS = 1000
+
+IDS_QUERY = Query(default=None, description="Return the objects with these ids (repeated or comma-separated) in that order, skipping unknown ids; can't be combined with the other filters")
+
+
+@functools.cache
+def _accepts(method, argument : str) -> bool:
+    # whether an adapter method takes an optional argument (adapters written before it was added don't)
+    parameters = inspect.signature(method).parameters
+    return argument in parameters or any(p.kind is inspect.Parameter.VAR_KEYWORD for p in parameters.values())
+
+
+def _supported(method, argument : str, parameter : str) -> None:
+    if not _accepts(method, argument):
+        raise HTTPException(status_code=400, detail=f"`{parameter}` is not supported by this facility")
+
+
+def _page(method, cursor : str | None, q : str | None, *cursor_types) -> dict:
+    # the optional keyset cursor or search arguments of the adapter's list method
+    if cursor and q:
+        raise HTTPException(status_code=400, detail="A cursor can't be combined with a search")
+    if cursor:
+        _supported(method, "after", "cursor")
+        return {"after": iri_router.decode_cursor(cursor, *cursor_types)}
+    if q:
+        _supported(method, "q", "q")
+        return {"q": q}
+    return {}
+
+
+def _next_link(method, request : Request, response : Response, items : list, limit : int, q : str | None) -> None:
+    # pages of a search aren't in key order, and the cursor is only useful if the adapter takes it
+    if not q and _accepts(method, "after"):
+        iri_router.set_next_link(request, response, items, limit)
+
+
+def _ids(request : Request, ids : list[str] | None, *allowed : str) -> list[str] | None:
+    # the distinct ids of an ids= lookup, which replaces the filters and pagination
+    if ids is None:
+        return None
+    others = set(request.query_params) - {"ids", *allowed}
+    if others:
+        raise HTTPException(status_code=400, detail=f"ids can't be combined with {', '.join(sorted(others))}")
+    ids = list(dict.fromkeys(id for value in ids for id in value.split(",") if id))
+    if len(ids) > MAX_IDS:
+        raise HTTPException(status_code=400, detail=f"Too many ids (the maximum is {MAX_IDS})")
+    return ids
+
+
+async def _not_modified(request : Request, response : Response, *collections : str) -> Response | None:
+    """
+        Set the ETag and Last-Modified headers from the adapter's versions of the collections the response is built from
+        and return a 304 response if the client's copy is still current.
+    """
+    versions = [await router.adapter.get_version(collection) for collection in collections]
+    if not all(versions):
+        return None
+    tag = " ".join(v[0] for v in versions)
+    last_modified = max((v[1] for v in versions if v[1]), default=None)
+    # the same collection version gives different representations for different urls
+    etag = f'"{hashlib.sha1(f"{tag} {request.url.path}?{request.url.query}".encode()).hexdigest()}"'
+    headers = {"ETag": etag}
+    if last_modified:
+        last_modified = last_modified.astimezone(datetime.timezone.utc)
+        headers["Last-Modified"] = email.utils.format_datetime(last_modified, usegmt=True)
+    response.headers.update(headers)
+
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match is not None:
+        tags = [t.strip().removeprefix("W/") for t in if_none_match.split(",")]
+        if "*" in tags or etag in tags:
+            return Response(status_code=304, headers=headers)
+    elif last_modified and request.headers.get("if-modified-since"):
+        try:
+            since = email.utils.parsedate_to_datetime(request.headers["if-modified-since"])
+        except (TypeError, ValueError):
+            return None
+        if since.tzinfo is None:
+            since = since.replace(tzinfo=datetime.timezone.utc)
+        if last_modified.replace(microsecond=0) <= since:
+            return Response(status_code=304, headers=headers)
+    return None
+
 @router.get(
     "/resources",
     summary="Get all resources",
-    description="Get a list of all resources at this facility. You can optionally filter the returned list by specifying attribtes.",
+    description="Get a list of all resources at this facility. You can optionally filter the returned list by specifying attribtes. Full pages have a `Link` header with the `next` page's cursor.",
     responses=DEFAULT_RESPONSES
 )
 async def get_resources(
     request : Request,
+    response : Response,
     name : str = Query(default=None, min_length=1),
     description : str = Query(default=None, min_length=1),
     group : str  = Query(default=None, min_length=1),
     offset : int = Query(default=0, ge=0),
-    limit : int = Query(default=100, le=1000),
+    limit : int = Query(default=100, ge=0, le=1000),
     modified_since: iri_router.StrictDateTime = Query(default=None),
     resource_type: models.ResourceType = Query(default=None),
-    _forbid = Depends(iri_router.forbidExtraQueryParams("name", "description", "group", "offset", "limit", "modified_since", "resource_type")),
+    cursor : str = Query(default=None, min_length=1, description="Return the page after this cursor (from a `Link` header)"),
+    q : str = Query(default=None, min_length=3, description="Search the name and description; the best matches come first"),
+    as_of : iri_router.StrictDateTime = Query(default=None, description="Return each resource's `current_status` at this time"),
+    ids : list[str] = IDS_QUERY,
+    _forbid = Depends(iri_router.forbidExtraQueryParams("name", "description", "group", "offset", "limit", "modified_since", "resource_type", "cursor", "q", "as_of", "ids")),
     ) -> list[models.Resource]:
-    return await router.adapter.get_resources(offset, limit, name, description, group, modified_since, resource_type)
+    ids = _ids(request, ids)
+    # past statuses come from the events
+    not_modified = await _not_modified(request, response, *(["resources", "events"] if as_of else ["resources"]))
+    if not_modified:
+        return not_modified
+    if ids is not None:
+        return serializer.response(await router.adapter.get_resources_by_ids(ids), response)
+    method = type(router.adapter).get_resources
+    page = _page(method, cursor, q, str)
+    if as_of:
+        _supported(method, "as_of", "as_of")
+        page["as_of"] = as_of
+    items = await router.adapter.get_resources(offset, limit, name, description, group, modified_since, resource_type, **page)
+    _next_link(method, request, response, items, limit, q)
+    if as_of:
+        # the past statuses aren't the cached representations of the resources
+        return items
+    return serializer.response(items, response)
 
 
 @router.get(
@@ -37,22 +165,62 @@ async def get_resources(
 )
 async def get_resource(
     request : Request,
+    response : Response,
     resource_id : str,
     ) -> models.Resource:
     item = await router.adapter.get_resource(resource_id)
     if not item:
         raise HTTPException(status_code=404, detail="Item not found")
-    return item
+    # after the lookup, as `If-None-Match: *` only matches existing items
+    not_modified = await _not_modified(request, response, "resources")
+    if not_modified:
+        return not_modified
+    return serializer.response(item, response)
+
+
+@router.get(
+    "/resources/{resource_id}/availability",
+    summary="Get the availability of a resource",
+    description="Get the time (in seconds) a resource spent in each status between `from` and `to` (defaults to now), from the statuses of its events. The window is split into buckets of the given `bucket` duration (eg. `P1D` or `3600`), the last one ending at `to`.",
+    responses=DEFAULT_RESPONSES
+)
+async def get_availability(
+    resource_id : str,
+    from_ : iri_router.StrictDateTime = Query(alias="from"),
+    to : iri_router.StrictDateTime = Query(default=None),
+    bucket : datetime.timedelta = Query(default=None),
+    _forbid = Depends(iri_router.forbidExtraQueryParams("from", "to", "bucket")),
+    ) -> models.Availability:
+    to = to or datetime.datetime.now(datetime.timezone.utc)
+    if to <= from_:
+        raise HTTPException(status_code=400, detail="`to` must be after `from`")
+    if bucket is not None and bucket.total_seconds() <= 0:
+        raise HTTPException(status_code=400, detail="`bucket` must be positive")
+    boundaries = [from_]
+    if bucket:
+        if (to - from_) / bucket > MAX_AVAILABILITY_BUCKETS:
+            raise HTTPException(status_code=400, detail=f"Too many buckets (the maximum is {MAX_AVAILABILITY_BUCKETS})")
+        while boundaries[-1] + bucket < to:
+            boundaries.append(boundaries[-1] + bucket)
+    boundaries.append(to)
+
+    if not await router.adapter.get_resource(resource_id):
+        raise HTTPException(status_code=404, detail="Item not found")
+    buckets = await router.adapter.get_availability(resource_id, boundaries)
+    if buckets is None:
+        raise HTTPException(status_code=501, detail="Availability statistics are not implemented")
+    return models.Availability(resource_id=resource_id, buckets=buckets)
 
 
 @router.get(
     "/incidents",
     summary="Get all incidents without their events",
-    description="Get a list of all incidents. Each incident will be returned without its events.  You can optionally filter the returned list by specifying attributes.",
+    description="Get a list of all incidents. Each incident will be returned without its events, unless `embed=events` is given.  You can optionally filter the returned list by specifying attributes. Full pages have a `Link` header with the `next` page's cursor.",
     responses=DEFAULT_RESPONSES
 )
 async def get_incidents(
     request : Request,
+    response : Response,
     name : str = Query(default=None, min_length=1),
     description : str = Query(default=None, min_length=1),
     status : models.Status = Query(default=None),
@@ -63,37 +231,73 @@ async def get_incidents(
     modified_since : iri_router.StrictDateTime = Query(default=None),
     resource_id : str = Query(default=None, min_length=1),
     offset : int = Query(default=0, ge=0),
-    limit : int = Query(default=100, le=1000),
-    _forbid = Depends(iri_router.forbidExtraQueryParams("name", "description", "status", "type", "from", "to", "time", "modified_since", "resource_id", "offset", "limit")),
-    ) -> list[models.Incident]:
-    return await router.adapter.get_incidents(offset, limit, name, description, status, type_, from_, to, time_, modified_since, resource_id)
+    limit : int = Query(default=100, ge=0, le=1000),
+    cursor : str = Query(default=None, min_length=1, description="Return the page after this cursor (from a `Link` header)"),
+    q : str = Query(default=None, min_length=3, description="Search the name and description; the best matches come first"),
+    embed : models.IncidentEmbed = Query(default=None, description="Include each incident's events"),
+    events_limit : int = Query(default=100, ge=1, le=1000, description="The maximum number of embedded events per incident"),
+    ids : list[str] = IDS_QUERY,
+    _forbid = Depends(iri_router.forbidExtraQueryParams("name", "description", "status", "type", "from", "to", "time", "modified_since", "resource_id", "offset", "limit", "cursor", "q", "embed", "events_limit", "ids")),
+    ) -> list[models.Incident | models.IncidentWithEvents]:
+    ids = _ids(request, ids, "embed", "events_limit")
+    not_modified = await _not_modified(request, response, *(["incidents", "events"] if embed else ["incidents"]))
+    if not_modified:
+        return not_modified
+    if ids is not None:
+        return await _incidents_response(await router.adapter.get_incidents_by_ids(ids), response, embed, events_limit)
+    method = type(router.adapter).get_incidents
+    page = _page(method, cursor, q, iri_router.StrictDateTime.validate, str)
+    items = await router.adapter.get_incidents(offset, limit, name, description, status, type_, from_, to, time_, modified_since, resource_id, **page)
+    _next_link(method, request, response, items, limit, q)
+    return await _incidents_response(items, response, embed, events_limit)
+
+
+async def _incidents_response(
+    content : models.Incident | list[models.Incident],
+    response : Response,
+    embed : models.IncidentEmbed | None,
+    events_limit : int,
+    ) -> Response:
+    # the events of every incident come from a single adapter call
+    if embed is None:
+        return serializer.response(content, response)
+    incidents = content if isinstance(content, list) else [content]
+    events = await router.adapter.get_incidents_events([i.id for i in incidents], events_limit)
+    return serializer.response(content, response, embed=("events", events))
 
 
 @router.get(
     "/incidents/{incident_id}",
     summary="Get a specific incident and its events",
-    description="Get a specific incident for a given id. The incident's events will also be included.  You can optionally filter the returned list by specifying attributes.",
+    description="Get a specific incident for a given id. The incident's events will also be included with `embed=events`, oldest first.",
     responses=DEFAULT_RESPONSES
 
 )
 async def get_incident(
     request : Request,
-    incident_id : str
-    ) -> models.Incident:
+    response : Response,
+    incident_id : str,
+    embed : models.IncidentEmbed = Query(default=None, description="Include the incident's events"),
+    events_limit : int = Query(default=100, ge=1, le=1000, description="The maximum number of embedded events"),
+    ) -> models.Incident | models.IncidentWithEvents:
     item = await router.adapter.get_incident(incident_id)
     if not item:
         raise HTTPException(status_code=404, detail="Item not found")
-    return item
+    not_modified = await _not_modified(request, response, *(["incidents", "events"] if embed else ["incidents"]))
+    if not_modified:
+        return not_modified
+    return await _incidents_response(item, response, embed, events_limit)
 
 
 @router.get(
     "/incidents/{incident_id}/events",
     summary="Get all events for an incident",
-    description="Get a list of all events in this incident.  You can optionally filter the returned list by specifying attribtes.",
+    description="Get a list of all events in this incident.  You can optionally filter the returned list by specifying attribtes. Full pages have a `Link` header with the `next` page's cursor.",
     responses=DEFAULT_RESPONSES
 )
 async def get_events(
     request : Request,
+    response : Response,
     incident_id : str,
     resource_id : str = Query(default=None, min_length=1),
     name : str = Query(default=None, min_length=1),
@@ -104,10 +308,23 @@ async def get_events(
     to : iri_router.StrictDateTime = Query(default=None),
     modified_since : iri_router.StrictDateTime = Query(default=None),
     offset : int = Query(default=0, ge=0),
-    limit : int = Query(default=100, le=1000),
-    _forbid = Depends(iri_router.forbidExtraQueryParams("resource_id", "name", "description", "status", "from", "to", "time", "modified_since", "offset", "limit")),
+    limit : int = Query(default=100, ge=0, le=1000),
+    cursor : str = Query(default=None, min_length=1, description="Return the page after this cursor (from a `Link` header)"),
+    q : str = Query(default=None, min_length=3, description="Search the name and description; the best matches come first"),
+    ids : list[str] = IDS_QUERY,
+    _forbid = Depends(iri_router.forbidExtraQueryParams("resource_id", "name", "description", "status", "from", "to", "time", "modified_since", "offset", "limit", "cursor", "q", "ids")),
     ) -> list[models.Event]:
-    return await router.adapter.get_events(incident_id, offset, limit, resource_id, name, description, status, from_, to, time_, modified_since)
+    ids = _ids(request, ids)
+    not_modified = await _not_modified(request, response, "events")
+    if not_modified:
+        return not_modified
+    if ids is not None:
+        return serializer.response(await router.adapter.get_events_by_ids(incident_id, ids), response)
+    method = type(router.adapter).get_events
+    page = _page(method, cursor, q, iri_router.StrictDateTime.validate, str)
+    items = await router.adapter.get_events(incident_id, offset, limit, resource_id, name, description, status, from_, to, time_, modified_since, **page)
+    _next_link(method, request, response, items, limit, q)
+    return serializer.response(items, response)
 
 
 @router.get(
@@ -118,10 +335,139 @@ async def get_events(
 )
 async def get_event(
     request : Request,
+    response : Response,
     incident_id : str,
     event_id : str
     ) -> models.Event:
     item = await router.adapter.get_event(incident_id, event_id)
     if not item:
         raise HTTPException(status_code=404, detail="Item not found")
-    return item
+    not_modified = await _not_modified(request, response, "events")
+    if not_modified:
+        return not_modified
+    return serializer.response(item, response)
+
+
+async def _batch_lines(request : Request) -> list[bytes]:
+    # the lines of the body, split as it arrives and up to MAX_BATCH_BYTES
+    lines, buffer, size = [], bytearray(), 0
+    async for chunk in request.stream():
+        size += len(chunk)
+        if size > MAX_BATCH_BYTES:
+            raise HTTPException(status_code=413, detail=f"The batch is too large (the maximum is {MAX_BATCH_BYTES} bytes)")
+        buffer += chunk
+        end = buffer.rfind(b"\n")
+        if end >= 0:
+            lines += bytes(buffer[:end]).split(b"\n")
+            del buffer[:end + 1]
+    lines.append(bytes(buffer))
+    return lines
+
+
+def _parse_batch(lines : list[bytes]) -> tuple[list[tuple[int, models.Event]], list[dict]]:
+    # the (line number, event) pairs of the valid lines and the errors of the others
+    parsed, errors = [], []
+    for n, line in enumerate(lines, 1):
+        if not line.strip():
+            continue
+        try:
+            e = models.Event.model_validate_json(line)
+        except pydantic.ValidationError as exc:
+            errors += [{**err, "loc": ("body", n, *err["loc"]), "msg": f"line {n}: {err['msg']}"} for err in exc.errors(include_url=False)]
+            continue
+        parsed.append((n, e))
+    return parsed, errors
+
+
+@router.post(
+    "/events:batch",
+    dependencies=[Depends(router.current_user)],
+    summary="Add a batch of events",
+    description="Add or replace many events in one call. The body is newline-delimited JSON (`application/x-ndjson`): one event per line, with its `resource_id` and optional `incident_id`. The whole batch is rejected if any line is invalid. The resources' `current_status` and the incidents' events are updated once for the batch.",
+    openapi_extra={"requestBody": {"required": True, "content": {"application/x-ndjson": {"schema": {"type": "string"}}}}},
+    responses=DEFAULT_RESPONSES
+)
+async def post_events_batch(
+    request : Request,
+    ) -> models.EventBatchResult:
+    if type(router.adapter).ingest_events is facility_adapter.FacilityAdapter.ingest_events:
+        raise HTTPException(status_code=501, detail="Event ingestion is not implemented")
+
+    lines = await _batch_lines(request)
+    if sum(1 for line in lines if line.strip()) > MAX_BATCH_EVENTS:
+        raise HTTPException(status_code=413, detail=f"Too many events (the maximum is {MAX_BATCH_EVENTS})")
+    # validating up to MAX_BATCH_EVENTS events takes a while, so it doesn't run on the event loop
+    parsed, errors = await asyncio.to_thread(_parse_batch, lines)
+    events = [e for _, e in parsed]
+
+    # the events' resources and incidents must exist, they're looked up in one batch each
+    for attr, get_many in (("resource_id", router.adapter.get_resources_by_ids), ("incident_id", router.adapter.get_incidents_by_ids)):
+        ids = list({getattr(e, attr) for e in events} - {None})
+        known = {o.id for o in await get_many(ids)} if ids else set()
+        for id in ids:
+            if id not in known:
+                errors += [
+                    {"type": "value_error", "loc": ("body", n, attr), "msg": f"line {n}: unknown {attr} {id}"}
+                    for n, e in parsed if getattr(e, attr) == id
+                ]
+    if errors:
+        raise RequestValidationError(errors)
+    if not events:
+        raise RequestValidationError([{"type": "missing", "loc": ("body",), "msg": "No events"}])
+    return await router.adapter.ingest_events(events)
+
+
+@router.get(
+    "/changes",
+    summary="Get the changes since a watermark",
+    description="Get every resource, incident and event created or modified after the `since` watermark, and the watermark to pass next time. Omit `since` to start from the beginning.",
+    responses=DEFAULT_RESPONSES
+)
+async def get_changes(
+    request : Request,
+    since : str = Query(default=None, min_length=1),
+    limit : int = Query(default=1000, ge=1, le=10000),
+    _forbid = Depends(iri_router.forbidExtraQueryParams("since", "limit")),
+    ) -> models.StatusChanges:
+    changes = await router.adapter.get_changes(since, limit)
+    if changes is None:
+        raise HTTPException(status_code=501, detail="The change feed is not implemented")
+    return changes
+
+
+@router.get(
+    "/stream",
+    summary="Stream status changes",
+    description="Push resource status transitions, new events and incident updates as server-sent events (`text/event-stream`). You can optionally filter the changes by resource or group. Reconnecting clients can resume with the `Last-Event-ID` header.",
+    response_class=StreamingResponse,
+    responses=DEFAULT_RESPONSES
+)
+async def get_stream(
+    request : Request,
+    resource_id : str = Query(default=None, min_length=1),
+    group : str = Query(default=None, min_length=1),
+    last_event_id : int = Header(default=None, alias="Last-Event-ID"),
+    _forbid = Depends(iri_router.forbidExtraQueryParams("resource_id", "group")),
+    ):
+    if type(router.adapter).watch is facility_adapter.FacilityAdapter.watch:
+        raise HTTPException(status_code=501, detail="Status streaming is not implemented")
+
+    # the ids of the resources whose changes are sent, or None for all
+    resource_ids = None
+    if group:
+        resources = await router.adapter.get_resources(0, 1000, group=group)
+        resource_ids = {r.id for r in resources}
+    if resource_id:
+        resource_ids = resource_ids & {resource_id} if resource_ids is not None else {resource_id}
+
+    async def stream():
+        async for item in broadcaster.subscribe(last_event_id, STREAM_KEEPALIVE_SECS):
+            if item is None:
+                yield ": keepalive\n\n"
+                continue
+            seq, change = item
+            if resource_ids is not None and resource_ids.isdisjoint(change.resource_ids):
+                continue
+            yield f"id: {seq}\nevent: {change.type.value}\ndata: {change.model_dump_json(exclude_none=True)}\n\n"
+
+    return StreamingResponse(stream(), media_type="text/event-stream", headers={"Cache-Control": "no-cache"})
@@ -0,0 +1,1027 @@
+import array
+import bisect
+import collections
+import datetime
+import itertools
+import os
+import uuid
+import weakref
+from typing import Any, Callable, Iterable
+from . import models as status_models
+
+
+END_OF_TIME = datetime.datetime.max.replace(tzinfo=datetime.timezone.utc)
+
+
+def _utc(dt: datetime.datetime | None) -> datetime.datetime | None:
+    # Convert naive datetimes into UTC-aware versions
+    if dt is not None and dt.tzinfo is None:
+        return dt.replace(tzinfo=datetime.timezone.utc)
+    return dt
+
+
+def _normalize_key(key : tuple | None) -> tuple | None:
+    # make the datetimes of a key comparable
+    if key is None:
+        return None
+    return tuple(_utc(k) if isinstance(k, datetime.datetime) else k for k in key)
+
+
+def cursor_key(obj) -> tuple:
+    return _normalize_key(obj.cursor_key())
+
+
+class TrigramIndex:
+    """
+        Inverted index of the trigrams of a text attribute, for substring and similarity searches.
+
+        A string of 3 or more characters is only contained in texts that have all of its trigrams,
+        so intersecting their postings narrows a substring search down to a few candidate texts.
+        Postings hold distinct texts rather than objects: status texts repeat a lot (eg. "login nodes is up"),
+        and each candidate text is only checked once.
+        Trigrams are case-folded, the substring check itself is case-sensitive.
+    """
+
+    def __init__(self : "TrigramIndex"):
+        self.postings = {}
+        # text -> ids of the objects with that text, and id -> text
+        self.docs = {}
+        self.texts = {}
+
+
+    @staticmethod
+    def trigrams(text : str) -> set[str]:
+        text = text.casefold()
+        return {text[i:i + 3] for i in range(len(text) - 2)}
+
+
+    def add(self : "TrigramIndex", id : str, text : str | None) -> None:
+        self.remove(id)
+        text = text or ""
+        self.texts[id] = text
+        if text not in self.docs:
+            self.docs[text] = set()
+            for g in TrigramIndex.trigrams(text):
+                self.postings.setdefault(g, set()).add(text)
+        self.docs[text].add(id)
+
+
+    def remove(self : "TrigramIndex", id : str) -> None:
+        text = self.texts.pop(id, None)
+        if text is None:
+            return
+        ids = self.docs[text]
+        ids.discard(id)
+        if not ids:
+            del self.docs[text]
+            for g in TrigramIndex.trigrams(text):
+                texts = self.postings[g]
+                texts.discard(text)
+                if not texts:
+                    del self.postings[g]
+
+
+    def contains(self : "TrigramIndex", s : str) -> set[str] | None:
+        """The ids of the objects whose text contains `s`, or None if `s` is too short to use the index."""
+        grams = TrigramIndex.trigrams(s)
+        if not grams:
+            return None
+        postings = sorted((self.postings.get(g, ()) for g in grams), key=len)
+        texts = set(postings[0])
+        for p in postings[1:]:
+            if not texts:
+                break
+            texts.intersection_update(p)
+        return {id for text in texts if s in text for id in self.docs[text]}
+
+
+    def rank(self : "TrigramIndex", s : str) -> dict[str, float]:
+        """The fraction of the trigrams of `s` found in each object's text, for the objects having at least half of them."""
+        grams = TrigramIndex.trigrams(s)
+        counts = collections.Counter()
+        for g in grams:
+            counts.update(self.postings.get(g, ()))
+        return {
+            id: n / len(grams)
+            for text, n in counts.items() if 2 * n >= len(grams)
+            for id in self.docs[text]
+        }
+
+
+class Table:
+    """
+        An in-memory collection of status objects with hash indexes.
+
+        Every object is kept in posting lists that are sorted by the table's sort key:
+        `all` holds every object and each hash index holds one posting list per indexed value.
+        A query walks the shortest posting list matching its filters,
+        so its cost is bounded by the most selective filter rather than the size of the table.
+        The `text` attributes also get a trigram index for substring and ranked searches.
+    """
+
+    def __init__(
+        self : "Table",
+        sort_key : Callable[[Any], tuple],
+        indexes : dict[str, Callable[[Any], Iterable]],
+        text : tuple[str, ...] = (),
+        ):
+        self.sort_key = sort_key
+        self.getters = indexes
+        self.indexes = {name: {} for name in indexes}
+        self.text_indexes = {name: TrigramIndex() for name in text}
+        self.rows = {}
+        self.all = []
+        # the key and indexed values each object was inserted with,
+        # so it can be found and removed even if it has been modified in place since
+        self._entries = {}
+        self._key = lambda obj: self._entries[obj.id][0]
+        # bumped on every change, for conditional requests
+        self.version = 0
+        self.last_modified = None
+
+
+    def __len__(self : "Table") -> int:
+        return len(self.rows)
+
+
+    def add(self : "Table", obj) -> None:
+        if obj.id in self.rows:
+            self.remove(obj.id)
+        key = self.sort_key(obj)
+        values = {name: tuple(getter(obj)) for name, getter in self.getters.items()}
+        self.rows[obj.id] = obj
+        self._entries[obj.id] = (key, values)
+        self._touch(_utc(getattr(obj, "last_modified", None)))
+        self._insert(self.all, obj, key)
+        for name, vals in values.items():
+            index = self.indexes[name]
+            for v in vals:
+                self._insert(index.setdefault(v, []), obj, key)
+        for name, text_index in self.text_indexes.items():
+            text_index.add(obj.id, getattr(obj, name))
+
+
+    def remove(self : "Table", id : str) -> None:
+        obj = self.rows.pop(id, None)
+        if obj is None:
+            return
+        key, values = self._entries[id]
+        self._delete(self.all, key)
+        for name, vals in values.items():
+            index = self.indexes[name]
+            for v in vals:
+                postings = index[v]
+                self._delete(postings, key)
+                if not postings:
+                    del index[v]
+        for text_index in self.text_indexes.values():
+            text_index.remove(id)
+        del self._entries[id]
+        self._touch(datetime.datetime.now(datetime.timezone.utc))
+
+
+    def _touch(self : "Table", modified : datetime.datetime | None) -> None:
+        self.version += 1
+        if modified is not None and (self.last_modified is None or modified > self.last_modified):
+            self.last_modified = modified
+
+
+    def get(self : "Table", id : str):
+        return self.rows.get(id)
+
+
+    def lookup(self : "Table", index : str, value, limit : int | None = None) -> list:
+        """Return the (first `limit`) objects with the given indexed value, in sort key order. Don't modify the returned list."""
+        postings = self.indexes[index].get(value, [])
+        return postings if limit is None else postings[:max(limit, 0)]
+
+
+    def select(
+        self : "Table",
+        offset : int = 0,
+        limit : int | None = None,
+        predicate : Callable[[Any], bool] | None = None,
+        lo : tuple | None = None,
+        hi : tuple | None = None,
+        candidates : tuple[int, Callable[[], list]] | None = None,
+        after : tuple | None = None,
+        **filters,
+        ) -> list:
+        """
+            Return the objects matching every `filters` value (by hash index) and `predicate`, in sort key order.
+            Filters set to None are ignored.
+            `lo` and `hi` bound the sort key (`lo <= key < hi`) and are resolved by bisecting the posting lists.
+            `after` is a keyset pagination cursor: only objects whose key is greater than it are returned.
+            `candidates` is an optional (size, factory) pair producing a key-sorted superset of the result
+            from another index; it is only materialized when it is the smallest source.
+            The predicate must check whatever condition the candidates were selected by.
+        """
+        filters = {name: v for name, v in filters.items() if v is not None}
+        sources = []
+        for name, v in filters.items():
+            p = self.indexes[name].get(v)
+            if not p:
+                return []
+            i, j = self._bounds(p, lo, hi, after)
+            sources.append((j - i, name, p, i, j))
+        if not sources:
+            i, j = self._bounds(self.all, lo, hi, after)
+            sources.append((j - i, None, self.all, i, j))
+        size, driver_name, driver, i, j = min(sources, key=lambda s: s[0])
+        if size == 0:
+            return []
+        if candidates is not None and candidates[0] < size:
+            driver_name, driver = None, candidates[1]()
+            i, j = self._bounds(driver, lo, hi, after)
+
+        # the remaining filters are checked against the entries recorded at insertion time
+        checks = [(name, v) for name, v in filters.items() if name != driver_name]
+        entries = self._entries
+
+        def matches(obj) -> bool:
+            values = entries[obj.id][1]
+            if any(v not in values[name] for name, v in checks):
+                return False
+            return predicate is None or predicate(obj)
+
+        if not checks and not predicate:
+            # every object of the driver matches: the page is a plain slice
+            start = i + offset
+            stop = min(j, start + max(limit, 0)) if limit is not None else j
+            return driver[start:stop]
+        it = filter(matches, itertools.islice(driver, i, j))
+        stop = offset + max(limit, 0) if limit is not None else None
+        return list(itertools.islice(it, offset, stop))
+
+
+    def search(self : "Table", name : str, s : str) -> tuple[int, Callable[[], list]] | None:
+        """
+            Return the objects whose `name` text attribute contains `s` as `select` candidates,
+            or None if `s` is too short to use the trigram index.
+        """
+        ids = self.text_indexes[name].contains(s)
+        if ids is None:
+            return None
+        return len(ids), lambda: self.sorted(map(self.rows.get, ids))
+
+
+    def rank(self : "Table", q : str) -> dict[str, float]:
+        """Score the objects similar to `q` in any text attribute; earlier attributes (eg. the name) weigh more."""
+        scores = {}
+        for weight, text_index in enumerate(reversed(self.text_indexes.values()), 1):
+            for id, score in text_index.rank(q).items():
+                scores[id] = scores.get(id, 0) + weight * score
+        return scores
+
+
+    def sorted(self : "Table", objs : Iterable) -> list:
+        """Sort objects of this table by their sort key, eg. to build `select` candidates."""
+        return sorted(objs, key=self._key)
+
+
+    def _bounds(
+        self : "Table",
+        postings : list,
+        lo : tuple | None,
+        hi : tuple | None,
+        after : tuple | None = None,
+        ) -> tuple[int, int]:
+        i = bisect.bisect_left(postings, lo, key=self._key) if lo is not None else 0
+        if after is not None:
+            i = max(i, bisect.bisect_right(postings, after, key=self._key))
+        j = bisect.bisect_left(postings, hi, lo=i, key=self._key) if hi is not None else len(postings)
+        return i, max(i, j)
+
+
+    def _insert(self : "Table", postings : list, obj, key : tuple) -> None:
+        # objects mostly arrive in key order, so appending is the common case
+        if not postings or self._key(postings[-1]) <= key:
+            postings.append(obj)
+        else:
+            bisect.insort(postings, obj, key=self._key)
+
+
+    def _delete(self : "Table", postings : list, key : tuple) -> None:
+        i = bisect.bisect_left(postings, key, key=self._key)
+        if i < len(postings) and self._key(postings[i]) == key:
+            del postings[i]
+
+
+class _IntervalNode:
+    """A node of a centered interval tree, holding the intervals that contain its center."""
+    __slots__ = ("center", "by_start", "by_end", "left", "right")
+
+
+    @staticmethod
+    def build(intervals : list[tuple]) -> "_IntervalNode | None":
+        # intervals are (start, end, obj) tuples with start < end
+        if not intervals:
+            return None
+        node = _IntervalNode()
+        node.center = sorted(iv[0] for iv in intervals)[len(intervals) // 2]
+        left, right, here = [], [], []
+        for iv in intervals:
+            if iv[1] <= node.center:
+                left.append(iv)
+            elif iv[0] > node.center:
+                right.append(iv)
+            else:
+                here.append(iv)
+        node.by_start = sorted(here, key=lambda iv: iv[0])
+        node.by_end = sorted(here, key=lambda iv: iv[1], reverse=True)
+        node.left = _IntervalNode.build(left)
+        node.right = _IntervalNode.build(right)
+        return node
+
+
+class IntervalIndex:
+    """
+        Index of objects over their `[start, end)` time interval, where an end of None means "still ongoing".
+        Objects are kept sorted by end to answer "ended before T" with a bisection,
+        and a centered interval tree answers "active at T" in O(log n + k).
+        The objects changed since the tree was built are checked one by one,
+        and the tree is only rebuilt (on the next query) once they're more than `MIN_REBUILD` and 1/64 of the objects,
+        so the cost of the rebuilds is spread over many changes.
+    """
+
+    MIN_REBUILD = 256
+
+    def __init__(
+        self : "IntervalIndex",
+        start : Callable[[Any], datetime.datetime],
+        end : Callable[[Any], datetime.datetime | None],
+        ):
+        self.start = start
+        self.end = end
+        self.intervals = {}
+        self.by_end = Table(lambda o: (self._end(o), o.id), {})
+        self._tree = None
+        # the changes since the tree was built: the intervals added or replaced,
+        # and the ids whose intervals in the tree are out of date
+        self._added = {}
+        self._stale = set()
+
+
+    def _end(self : "IntervalIndex", obj) -> datetime.datetime:
+        end = self.end(obj)
+        return _utc(end) if end is not None else END_OF_TIME
+
+
+    def add(self : "IntervalIndex", obj) -> None:
+        self.intervals[obj.id] = self._added[obj.id] = (_utc(self.start(obj)), self._end(obj), obj)
+        self._stale.add(obj.id)
+        self.by_end.add(obj)
+
+
+    def remove(self : "IntervalIndex", id : str) -> None:
+        if self.intervals.pop(id, None):
+            self.by_end.remove(id)
+            self._added.pop(id, None)
+            self._stale.add(id)
+
+
+    def count_ended_before(self : "IntervalIndex", t : datetime.datetime) -> int:
+        return self.by_end._bounds(self.by_end.all, None, (_utc(t),))[1]
+
+
+    def ended_before(self : "IntervalIndex", t : datetime.datetime) -> list:
+        return self.by_end.all[:self.count_ended_before(t)]
+
+
+    def active_at(self : "IntervalIndex", t : datetime.datetime) -> list:
+        if self._tree is None or len(self._stale) > max(self.MIN_REBUILD, len(self.intervals) // 64):
+            # empty intervals can't contain any point
+            self._tree = _IntervalNode.build([iv for iv in self.intervals.values() if iv[0] < iv[1]])
+            self._added, self._stale = {}, set()
+        t = _utc(t)
+        result = [iv[2] for iv in self._added.values() if iv[0] <= t < iv[1]]
+        stale = self._stale
+        node = self._tree
+        while node:
+            if t < node.center:
+                for iv in node.by_start:
+                    if iv[0] > t:
+                        break
+                    if iv[2].id not in stale:
+                        result.append(iv[2])
+                node = node.left
+            else:
+                for iv in node.by_end:
+                    if iv[1] <= t:
+                        break
+                    if iv[2].id not in stale:
+                        result.append(iv[2])
+                node = node.right
+        return result
+
+
+class StatusTimeline:
+    """
+        The status transitions (events) of one resource, sorted by time, with running time-in-state totals.
+
+        The totals of the i-th event hold the seconds spent in each status between the first event and the i-th one,
+        so the time spent in each status during any window is the difference of two totals found by binary search.
+        Appending an event in time order updates the totals in constant time;
+        an event inserted in the past recomputes the totals after it.
+        Before its first event a resource is in the `unknown` status.
+        The timeline is kept in typed arrays, as it holds every event of the resource.
+    """
+
+    STATUSES = list(status_models.Status)
+    _UNKNOWN = STATUSES.index(status_models.Status.unknown)
+
+    def __init__(self : "StatusTimeline"):
+        # parallel columns sorted by (time, event id): POSIX timestamps, event ids, status indexes
+        # and the running totals, one per status for each event
+        self.times = array.array("d")
+        self.ids = []
+        self.statuses = array.array("b")
+        self.totals = array.array("d")
+        self._key = lambda i: (self.times[i], self.ids[i])
+
+
+    def __len__(self : "StatusTimeline") -> int:
+        return len(self.times)
+
+
+    def add(self : "StatusTimeline", event : status_models.Event) -> None:
+        """Add an event; replace an event by removing the old version first"""
+        key = (_utc(event.occurred_at).timestamp(), event.id)
+        i = bisect.bisect_right(range(len(self)), key, key=self._key)
+        n = len(self.STATUSES)
+        self.times.insert(i, key[0])
+        self.ids.insert(i, event.id)
+        self.statuses.insert(i, self.STATUSES.index(event.status))
+        self.totals[i * n:i * n] = array.array("d", bytes(8 * n))
+        self._update(i)
+
+
+    def remove(self : "StatusTimeline", event : status_models.Event) -> None:
+        key = (_utc(event.occurred_at).timestamp(), event.id)
+        i = bisect.bisect_left(range(len(self)), key, key=self._key)
+        if i == len(self) or self._key(i) != key:
+            return
+        n = len(self.STATUSES)
+        del self.times[i], self.ids[i], self.statuses[i], self.totals[i * n:(i + 1) * n]
+        self._update(i)
+
+
+    def truncate(self : "StatusTimeline", t : datetime.datetime) -> None:
+        """Forget the events before `t`, except the last one, so the statuses and durations from `t` on don't change"""
+        i = self._index(_utc(t).timestamp())
+        if i <= 0:
+            return
+        n = len(self.STATUSES)
+        del self.times[:i], self.ids[:i], self.statuses[:i], self.totals[:i * n]
+        self._update(0)
+
+
+    def _update(self : "StatusTimeline", start : int) -> None:
+        # recompute the running totals from position `start`
+        n = len(self.STATUSES)
+        if start == 0 and len(self):
+            self.totals[0:n] = array.array("d", bytes(8 * n))
+        for i in range(max(start, 1), len(self)):
+            self.totals[i * n:(i + 1) * n] = self.totals[(i - 1) * n:i * n]
+            self.totals[i * n + self.statuses[i - 1]] += self.times[i] - self.times[i - 1]
+
+
+    def _index(self : "StatusTimeline", t : float) -> int:
+        # the position of the last event at or before t, or -1
+        return bisect.bisect_right(self.times, t) - 1
+
+
+    def status_at(self : "StatusTimeline", t : datetime.datetime) -> status_models.Status:
+        """The status of the resource at `t`: the status of its last event at or before `t`"""
+        i = self._index(_utc(t).timestamp())
+        return self.STATUSES[self.statuses[i]] if i >= 0 else status_models.Status.unknown
+
+
+    def _total_at(self : "StatusTimeline", t : float) -> list[float]:
+        # the seconds spent in each status between the first event and t;
+        # before the first event, the (negative) time from the first event is counted as unknown
+        i = self._index(t)
+        if i < 0:
+            total = [0.0] * len(self.STATUSES)
+            total[self._UNKNOWN] = t - self.times[0] if len(self) else t
+            return total
+        n = len(self.STATUSES)
+        total = self.totals[i * n:(i + 1) * n].tolist()
+        total[self.statuses[i]] += t - self.times[i]
+        return total
+
+
+    def durations(
+        self : "StatusTimeline",
+        boundaries : list[datetime.datetime],
+        ) -> list[dict[status_models.Status, float]]:
+        """
+            The seconds spent in each status between consecutive `boundaries` (sorted times):
+            one dictionary per window, so n boundaries give n - 1 windows.
+        """
+        totals = [self._total_at(_utc(b).timestamp()) for b in boundaries]
+        return [
+            {status: b - a for status, a, b in zip(self.STATUSES, start, end)}
+            for start, end in zip(totals, totals[1:])
+        ]
+
+
+class ChangeLog:
+    """
+        The (sequence number, collection, id) entries of the changes of a `StatusStore`, in sequence order.
+        Like the timelines, the entries are kept in parallel columns rather than as tuples,
+        so an entry takes 17 bytes besides its id (which the stored object shares).
+    """
+
+    COLLECTIONS = ["resources", "incidents", "events"]
+
+    def __init__(self : "ChangeLog", entries : Iterable[tuple[int, str, str]] = ()):
+        self.seqs = array.array("q")
+        self.collections = array.array("b")
+        self.ids = []
+        for entry in entries:
+            self.append(*entry)
+
+
+    def __len__(self : "ChangeLog") -> int:
+        return len(self.ids)
+
+
+    def __iter__(self : "ChangeLog"):
+        return zip(self.seqs, map(self.COLLECTIONS.__getitem__, self.collections), self.ids)
+
+
+    def append(self : "ChangeLog", seq : int, collection : str, id : str) -> None:
+        self.seqs.append(seq)
+        self.collections.append(self.COLLECTIONS.index(collection))
+        self.ids.append(id)
+
+
+    def window(self : "ChangeLog", seq : int, limit : int) -> tuple[list[tuple[int, str, str]], bool]:
+        """The first `limit` entries after the sequence number `seq`, and whether more entries follow them"""
+        start = bisect.bisect_right(self.seqs, seq)
+        stop = min(start + limit, len(self))
+        return [(self.seqs[i], self.COLLECTIONS[self.collections[i]], self.ids[i]) for i in range(start, stop)], stop < len(self)
+
+
+class StatusStore:
+    """
+        Indexed in-memory storage for resources, incidents and events.
+        Facility adapters can keep their status data here instead of in plain lists
+        and answer the status `FacilityAdapter` queries from the indexes.
+        Adding an object with an existing id replaces it, so add it again after modifying it in place.
+        Large event histories can be kept in compact columns by passing `events=columns.EventColumns()`,
+        or in monthly partitions with a retention policy by passing `events=partitions.PartitionedEvents(...)`.
+    """
+
+    # the change log is compacted when it has this many entries more than twice the objects stored
+    MIN_LOG_COMPACTION = 1024
+
+    def __init__(self : "StatusStore", events : Any = None):
+        self.token = uuid.uuid4().hex[:12]
+        # forked workers (eg. with gunicorn's preload_app) start with the same data, so they keep the token,
+        # and their tags and watermarks stay valid in every worker, until they change their copy of the store
+        self._shared = False
+        forked = weakref.WeakMethod(self._forked)
+        os.register_at_fork(
+            after_in_parent=lambda: forked() and forked()(),
+            after_in_child=lambda: forked() and forked()(),
+        )
+        # log of (sequence number, collection, id) for every added or replaced object, in sequence order;
+        # compacted to the latest entry of each stored object (see _compact_log)
+        self.change_log = ChangeLog()
+        self.change_seq = 0
+        # watermarks before this sequence number may hold events expired since, so they reset the sync
+        self.change_head = 0
+        self._compact_log_at = self.MIN_LOG_COMPACTION
+        self.resources = Table(
+            cursor_key,
+            {
+                "name": lambda r: (r.name,),
+                "group": lambda r: (r.group,),
+                "status": lambda r: (r.current_status,),
+                "type": lambda r: (r.resource_type,),
+            },
+            text=("name", "description"),
+        )
+        self.incidents = Table(
+            cursor_key,
+            {
+                "name": lambda i: (i.name,),
+                "resource_id": lambda i: set(i.resource_ids),
+                "status": lambda i: (i.status,),
+                "type": lambda i: (i.type,),
+            },
+            text=("name", "description"),
+        )
+        self.incident_intervals = IntervalIndex(lambda i: i.start, lambda i: i.end)
+        self.events = events if events is not None else Table(
+            cursor_key,
+            {
+                "name": lambda e: (e.name,),
+                "resource_id": lambda e: (e.resource_id,),
+                "incident_id": lambda e: (e.incident_id,),
+                "status": lambda e: (e.status,),
+            },
+            text=("name", "description"),
+        )
+        # resource id -> status timeline of its events
+        self.timelines = collections.defaultdict(StatusTimeline)
+
+
+    def _forked(self : "StatusStore") -> None:
+        self._shared = True
+
+
+    def _own(self : "StatusStore") -> None:
+        # called before a change: the first one after a fork gives this copy of the store its own token
+        if self._shared:
+            self._shared = False
+            self.token = uuid.uuid4().hex[:12]
+
+
+    def get_version(self : "StatusStore", collection : str) -> tuple[str, datetime.datetime | None]:
+        """
+            Return a tag that changes whenever the collection ("resources", "incidents" or "events") changes,
+            and the latest last_modified of its objects.
+            The tag includes a per-store token, so different stores, and the copies of a store changed since a fork, never share tags.
+        """
+        table = getattr(self, collection)
+        return f"{self.token}-{table.version}", table.last_modified
+
+
+    def add_resources(self : "StatusStore", resources : Iterable[status_models.Resource]) -> None:
+        for r in resources:
+            self.resources.add(r)
+            self._log("resources", r)
+
+
+    def add_incidents(self : "StatusStore", incidents : Iterable[status_models.Incident]) -> None:
+        for i in incidents:
+            self.incidents.add(i)
+            self.incident_intervals.add(i)
+            self._log("incidents", i)
+
+
+    def _expired(self : "StatusStore", event : status_models.Event) -> bool:
+        # whether the event is before the retention of the events' storage (eg. `partitions.PartitionedEvents`)
+        expired_before = getattr(self.events, "expired_before", None)
+        return expired_before is not None and _utc(event.occurred_at) < expired_before
+
+
+    def add_events(self : "StatusStore", events : Iterable[status_models.Event]) -> None:
+        """Add events; events before the retention of the events' storage are ignored"""
+        for e in events:
+            if self._expired(e):
+                continue
+            old = self.events.get(e.id)
+            if old is not None:
+                self.timelines[old.resource_id].remove(old)
+            # logged first, so the events' columns get their version
+            self._log("events", e)
+            self.events.add(e)
+            self.timelines[e.resource_id].add(e)
+        if getattr(self.events, "compaction_due", False):
+            self.compact()
+
+
+    def compact(self : "StatusStore", now : datetime.datetime | None = None) -> None:
+        """
+            Compact the events if their storage supports it (eg. `partitions.PartitionedEvents`),
+            forget the timeline events older than its retention, and compact the change log.
+        """
+        expired = set()
+        if hasattr(self.events, "compact"):
+            cutoff = self.events.compact(now)
+            if cutoff is not None:
+                self._own()
+                t = _utc(cutoff).timestamp()
+                for timeline in self.timelines.values():
+                    expired.update(timeline.ids[:bisect.bisect_left(timeline.times, t)])
+                    timeline.truncate(cutoff)
+        self._compact_log(expired)
+
+
+    def ingest_events(
+        self : "StatusStore",
+        events : Iterable[status_models.Event],
+        ) -> tuple[list[status_models.Resource], list[status_models.Incident]]:
+        """
+            Add a batch of events and apply their effects once for the whole batch:
+            each resource's `current_status` becomes the status of its latest event (unless a later event is already stored)
+            and each incident gets the ids of its new events (and loses those of events moved to another incident).
+            Return the updated resources and incidents.
+            The events are added in key order, so the posting lists are mostly appended to.
+        """
+        now = datetime.datetime.now(datetime.timezone.utc)
+        events = sorted((e for e in events if not self._expired(e)), key=cursor_key)
+        resources = []
+        for resource_id, e in {e.resource_id: e for e in events}.items():
+            r = self.resources.get(resource_id)
+            timeline = self.timelines.get(resource_id)
+            if r is None or (timeline and timeline.times[-1] > _utc(e.occurred_at).timestamp()):
+                continue
+            resources.append(r.model_copy(update={"current_status": e.status, "last_modified": now}))
+        # the ids each incident gains, and loses to events moved to another incident (the last version of an event wins)
+        added, removed = {}, {}
+        for e in {e.id: e for e in events}.values():
+            old = self.events.get(e.id)
+            if old is not None and old.incident_id and old.incident_id != e.incident_id:
+                removed.setdefault(old.incident_id, set()).add(e.id)
+            if e.incident_id:
+                added.setdefault(e.incident_id, []).append(e.id)
+        incidents = []
+        for incident_id in dict.fromkeys([*added, *removed]):
+            i = self.incidents.get(incident_id)
+            if i is not None:
+                gone, known = removed.get(incident_id, set()), set(i.event_ids)
+                event_ids = [id for id in i.event_ids if id not in gone] + [id for id in added.get(incident_id, []) if id not in known]
+                incidents.append(i.model_copy(update={"event_ids": event_ids, "last_modified": now}))
+        self.add_events(events)
+        self.add_incidents(incidents)
+        self.add_resources(resources)
+        return resources, incidents
+
+
+    def _log(self : "StatusStore", collection : str, obj : status_models.NamedResource) -> None:
+        self._own()
+        self.change_seq += 1
+        self.change_log.append(self.change_seq, collection, obj.id)
+        obj._version = self.change_seq
+        if len(self.change_log) >= self._compact_log_at:
+            self._compact_log()
+
+
+    def _compact_log(self : "StatusStore", expired : set[str] = frozenset()) -> None:
+        """
+            Keep the latest entry of each object in the change log, dropping the entries of the `expired` events.
+            Dropping older versions of an object doesn't change what a sync gets (the latest version, whatever its watermark),
+            but syncs from before the expiry may hold expired events, so their watermarks then reset the sync.
+        """
+        seen = set()
+        log = []
+        dropped = False
+        for entry in reversed(list(self.change_log)):
+            seq, collection, id = entry
+            if (collection, id) in seen:
+                continue
+            seen.add((collection, id))
+            if collection == "events" and id in expired:
+                dropped = True
+                continue
+            log.append(entry)
+        log.reverse()
+        self.change_log = ChangeLog(log)
+        if dropped:
+            # the expiry takes a sequence number, so the watermarks from after it don't reset
+            self.change_seq += 1
+            self.change_head = self.change_seq
+        self._compact_log_at = 2 * len(log) + self.MIN_LOG_COMPACTION
+
+
+    def get_changes(self : "StatusStore", since : str | None, limit : int) -> status_models.StatusChanges:
+        """
+            Return the objects added or replaced after the `since` watermark (at most `limit` changes) and the new watermark.
+            Watermarks are "<store token>-<sequence number>";
+            a watermark of another store, or older than the removal of expired events, resets the sync.
+        """
+        seq, reset = 0, False
+        if since:
+            token, _, n = since.rpartition("-")
+            if token == self.token and n.isdigit() and self.change_head <= int(n) <= self.change_seq:
+                seq = int(n)
+            else:
+                reset = True
+        window, more = self.change_log.window(seq, limit)
+        ids = {"resources": {}, "incidents": {}, "events": {}}
+        for _, collection, id in window:
+            ids[collection][id] = None
+        objs = {
+            collection: [o for o in map(getattr(self, collection).get, keys) if o is not None]
+            for collection, keys in ids.items()
+        }
+        last = window[-1][0] if more else self.change_seq
+        return status_models.StatusChanges(
+            watermark=f"{self.token}-{last}",
+            reset=reset,
+            more=more,
+            **objs,
+        )
+
+
+    def get_resource(self : "StatusStore", id : str, allow_name : bool = False) -> status_models.Resource | None:
+        # like NamedResource.find_by_id, the id can also match the resource's name if allow_name is True
+        r = self.resources.get(id)
+        if r is None and allow_name:
+            r = next(iter(self.resources.lookup("name", id)), None)
+        return r
+
+
+    def get_many(self : "StatusStore", collection : str, ids : Iterable[str]) -> list:
+        """The objects of a collection ("resources", "incidents" or "events") with these ids, in that order, skipping unknown ids"""
+        return [o for o in map(getattr(self, collection).get, ids) if o is not None]
+
+
+    def get_incident(self : "StatusStore", id : str) -> status_models.Incident | None:
+        return self.incidents.get(id)
+
+
+    def get_event(self : "StatusStore", id : str, incident_id : str | None = None) -> status_models.Event | None:
+        # if incident_id is given, the event must belong to that incident
+        e = self.events.get(id)
+        if e is None or (incident_id is not None and e.incident_id != incident_id):
+            return None
+        return e
+
+
+    def incident_events(self : "StatusStore", incident_id : str, limit : int | None = None) -> list[status_models.Event]:
+        """The (first `limit`) events of an incident, ordered by occurred_at. Don't modify the returned list."""
+        return self.events.lookup("incident_id", incident_id, limit)
+
+
+    def incidents_events(
+        self : "StatusStore",
+        incident_ids : Iterable[str],
+        limit : int | None = None,
+        ) -> dict[str, list[status_models.Event]]:
+        """The first `limit` events of each incident, for embedding them in a page of incidents"""
+        return {id: self.incident_events(id, limit) for id in incident_ids}
+
+
+    def resource_status_at(self : "StatusStore", resource_id : str, t : datetime.datetime) -> status_models.Status:
+        """The status of the resource's last event at or before `t`, found by binary search in its timeline"""
+        timeline = self.timelines.get(resource_id)
+        return timeline.status_at(t) if timeline else status_models.Status.unknown
+
+
+    def resource_durations(
+        self : "StatusStore",
+        resource_id : str,
+        boundaries : list[datetime.datetime],
+        ) -> list[dict[status_models.Status, float]]:
+        """The seconds the resource spent in each status between consecutive `boundaries`, from its events' running totals"""
+        timeline = self.timelines.get(resource_id) or StatusTimeline()
+        return timeline.durations(boundaries)
+
+
+    @staticmethod
+    def _named_predicate(
+        description : str | None,
+        modified_since : datetime.datetime | None,
+        ) -> list[Callable]:
+        # the non-indexed filters of NamedResource.find
+        checks = []
+        if description:
+            checks.append(lambda o: description in o.description)
+        if modified_since:
+            since = _utc(modified_since)
+            checks.append(lambda o: _utc(o.last_modified) >= since)
+        return checks
+
+
+    @staticmethod
+    def _all(checks : list[Callable]) -> Callable | None:
+        if not checks:
+            return None
+        if len(checks) == 1:
+            return checks[0]
+        return lambda o: all(c(o) for c in checks)
+
+
+    def _find(
+        self : "StatusStore",
+        table : Table,
+        offset : int,
+        limit : int | None,
+        checks : list[Callable],
+        sources : list[tuple[int, Callable[[], list]]],
+        description : str | None,
+        q : str | None,
+        lo : tuple | None = None,
+        hi : tuple | None = None,
+        after : tuple | None = None,
+        **filters,
+        ) -> list:
+        # `sources` are candidate lists from other indexes, the smallest one may drive the query
+        if description:
+            found = table.search("description", description)
+            if found is not None:
+                sources.append(found)
+        if not q:
+            return table.select(
+                offset, limit, StatusStore._all(checks), lo, hi,
+                candidates=min(sources, key=lambda s: s[0]) if sources else None,
+                after=_normalize_key(after),
+                **filters,
+            )
+
+        # ranked search: every match is scored, then the best ones are paged (cursors don't apply)
+        scores = table.rank(q)
+        checks.append(lambda o: o.id in scores)
+        sources.append((len(scores), lambda: table.sorted(map(table.rows.get, scores))))
+        matches = table.select(
+            0, None, StatusStore._all(checks), lo, hi,
+            candidates=min(sources, key=lambda s: s[0]),
+            **filters,
+        )
+        # a stable sort, so equally ranked objects stay in key order
+        matches.sort(key=lambda o: -scores[o.id])
+        stop = offset + max(limit, 0) if limit is not None else None
+        return matches[offset:stop]
+
+
+    def find_resources(
+        self : "StatusStore",
+        offset : int = 0,
+        limit : int | None = None,
+        name : str | None = None,
+        description : str | None = None,
+        group : str | None = None,
+        modified_since : datetime.datetime | None = None,
+        resource_type : status_models.ResourceType | None = None,
+        after : tuple | None = None,
+        q : str | None = None,
+        as_of : datetime.datetime | None = None,
+        ) -> list[status_models.Resource]:
+        # with as_of, copies of the resources are returned with their current_status at that time
+        checks = StatusStore._named_predicate(description, modified_since)
+        resources = self._find(
+            self.resources, offset, limit, checks, [], description, q,
+            after=after,
+            name=name, group=group, type=resource_type,
+        )
+        if as_of is not None:
+            resources = [r.model_copy(update={"current_status": self.resource_status_at(r.id, as_of)}) for r in resources]
+        return resources
+
+
+    def find_events(
+        self : "StatusStore",
+        offset : int = 0,
+        limit : int | None = None,
+        incident_id : str | None = None,
+        resource_id : str | None = None,
+        name : str | None = None,
+        description : str | None = None,
+        status : status_models.Status | None = None,
+        from_ : datetime.datetime | None = None,
+        to : datetime.datetime | None = None,
+        time_ : datetime.datetime | None = None,
+        modified_since : datetime.datetime | None = None,
+        after : tuple | None = None,
+        q : str | None = None,
+        ) -> list[status_models.Event]:
+        if not isinstance(self.events, Table):
+            # compact event storage answers the queries from its columns
+            return self.events.find(offset, limit, incident_id, resource_id, name, description, status, from_, to, time_, modified_since, after, q)
+        # events are sorted by occurred_at, so the time filters are bisections
+        lo = (_utc(from_),) if from_ else None
+        hi = (_utc(to),) if to else None
+        if time_:
+            t = _utc(time_)
+            lo = max(lo, (t,)) if lo else (t,)
+            hi = min(hi, (t + datetime.timedelta(microseconds=1),)) if hi else (t + datetime.timedelta(microseconds=1),)
+        checks = StatusStore._named_predicate(description, modified_since)
+        return self._find(
+            self.events, offset, limit, checks, [], description, q, lo, hi,
+            after=after,
+            name=name, incident_id=incident_id, resource_id=resource_id, status=status,
+        )
+
+
+    def find_incidents(
+        self : "StatusStore",
+        offset : int = 0,
+        limit : int | None = None,
+        name : str | None = None,
+        description : str | None = None,
+        status : status_models.Status | None = None,
+        type_ : status_models.IncidentType | None = None,
+        from_ : datetime.datetime | None = None,
+        to : datetime.datetime | None = None,
+        time_ : datetime.datetime | None = None,
+        modified_since : datetime.datetime | None = None,
+        resource_id : str | None = None,
+        after : tuple | None = None,
+        q : str | None = None,
+        ) -> list[status_models.Incident]:
+        # incidents are sorted by start, so `from` is a bisection,
+        # while `to` (on end) and `time` (start <= time < end) come from the interval index
+        lo = (_utc(from_),) if from_ else None
+        checks = StatusStore._named_predicate(description, modified_since)
+        sources = []
+        if to:
+            checks.append(lambda i: i.end is not None and i.end < to)
+            sources.append((
+                self.incident_intervals.count_ended_before(to),
+                lambda: self.incidents.sorted(self.incident_intervals.ended_before(to)),
+            ))
+        if time_:
+            checks.append(lambda i: i.start <= time_ and (i.end is None or i.end > time_))
+            active = self.incident_intervals.active_at(time_)
+            sources.append((len(active), lambda: self.incidents.sorted(active)))
+        return self._find(
+            self.incidents, offset, limit, checks, sources, description, q, lo,
+            after=after,
+            name=name, resource_id=resource_id, status=status, type=type_,
+        )
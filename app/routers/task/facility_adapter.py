@@ -3,8 +3,8 @@ from typing import Any
 from . import models as task_models
 from ..account import models as account_models
 from ..status import models as status_models
-from ..filesystem import models as filesystem_models, facility_adapter as filesystem_adapter
-from ..iri_router import AuthenticatedAdapter, IriRouter
+from ..filesystem import models as filesystem_models
+from ..iri_router import AuthenticatedAdapter, adapter_registry
 
 
 class FacilityAdapter(AuthenticatedAdapter):
@@ -52,8 +52,8 @@ class FacilityAdapter(AuthenticatedAdapter):
         # Returns: (result, status)
         try:
             r = None
-            if cmd.router == "filesystem":
-                fs_adapter = IriRouter.create_adapter(cmd.router, filesystem_adapter.FacilityAdapter)
+            fs_adapter = adapter_registry.for_router(cmd.router) if cmd.router == "filesystem" else None
+            if fs_adapter is not None:
                 if cmd.command == "chmod":
                     request_model = filesystem_models.PutFileChmodRequest.model_validate(cmd.args["request_model"])
                     o = await fs_adapter.chmod(resource, user, request_model)
@@ -0,0 +1,684 @@
+import asyncio
+import concurrent.futures
+import datetime
+import json
+import os
+import sqlite3
+import sys
+import threading
+import uuid
+import weakref
+from typing import Any, Callable, Iterable
+from .routers.status import models as status_models, facility_adapter as status_adapter, store as status_store
+from .routers.status.columns import to_micros, from_micros
+
+SQLITE_STATUS_PATH = os.environ.get("IRI_STATUS_SQLITE_PATH", "iri_status.db")
+SQLITE_STATUS_THREADS = int(os.environ.get("IRI_STATUS_SQLITE_THREADS", "4"))
+
+# times are stored as microseconds since the epoch (UTC), and the `version` of each row is its latest change
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS resources (
+    id TEXT PRIMARY KEY,
+    name TEXT NOT NULL,
+    description TEXT NOT NULL,
+    last_modified INTEGER NOT NULL,
+    version INTEGER NOT NULL,
+    "group" TEXT,
+    current_status TEXT,
+    resource_type TEXT NOT NULL,
+    capability_ids TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS resources_name ON resources (name);
+CREATE INDEX IF NOT EXISTS resources_group ON resources ("group", id);
+CREATE INDEX IF NOT EXISTS resources_last_modified ON resources (last_modified);
+
+CREATE TABLE IF NOT EXISTS incidents (
+    id TEXT PRIMARY KEY,
+    name TEXT NOT NULL,
+    description TEXT NOT NULL,
+    last_modified INTEGER NOT NULL,
+    version INTEGER NOT NULL,
+    status TEXT NOT NULL,
+    type TEXT NOT NULL,
+    resolution TEXT NOT NULL,
+    start INTEGER NOT NULL,
+    "end" INTEGER,
+    resource_ids TEXT NOT NULL,
+    event_ids TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS incidents_start ON incidents (start, id);
+CREATE INDEX IF NOT EXISTS incidents_end ON incidents ("end");
+CREATE INDEX IF NOT EXISTS incidents_last_modified ON incidents (last_modified);
+
+CREATE TABLE IF NOT EXISTS incident_resources (
+    resource_id TEXT NOT NULL,
+    incident_id TEXT NOT NULL,
+    PRIMARY KEY (resource_id, incident_id)
+) WITHOUT ROWID;
+
+CREATE TABLE IF NOT EXISTS events (
+    id TEXT PRIMARY KEY,
+    name TEXT NOT NULL,
+    description TEXT NOT NULL,
+    last_modified INTEGER NOT NULL,
+    version INTEGER NOT NULL,
+    occurred_at INTEGER NOT NULL,
+    status TEXT NOT NULL,
+    resource_id TEXT NOT NULL,
+    incident_id TEXT
+);
+CREATE INDEX IF NOT EXISTS events_occurred_at ON events (occurred_at, id);
+CREATE INDEX IF NOT EXISTS events_resource_id ON events (resource_id, occurred_at, id);
+CREATE INDEX IF NOT EXISTS events_incident_id ON events (incident_id, occurred_at, id);
+CREATE INDEX IF NOT EXISTS events_last_modified ON events (last_modified);
+
+-- every added or replaced object, for /status/changes and the collections' versions;
+-- compacted to the latest change of each object (see _compact_changes)
+CREATE TABLE IF NOT EXISTS changes (
+    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+    collection TEXT NOT NULL,
+    id TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS changes_collection ON changes (collection, seq);
+"""
+
+
+class SqliteStatusAdapter(status_adapter.FacilityAdapter):
+    """
+        A status adapter keeping resources, incidents and events in a SQLite database,
+        as a starting point for facilities that collect their status data elsewhere.
+
+        The database is in WAL mode, so every gunicorn worker can read it while another process writes to it.
+        Queries run in a thread pool, each thread with its own connection, to keep the event loop free.
+        The database is given by `IRI_STATUS_SQLITE_PATH` (defaults to `iri_status.db`)
+        and the size of the thread pool by `IRI_STATUS_SQLITE_THREADS` (defaults to 4).
+        Fill it with `add_resources`, `add_incidents` and `add_events`,
+        eg. with the demo data: `python -m app.sqlite_status_adapter [path]`.
+        The log of changes is compacted to the latest change of each object as it grows.
+        `POST /status/events:batch` authenticates its callers, so it needs a subclass that also implements
+        the `AuthenticatedAdapter` methods of your facility.
+    """
+
+    # the changes table is compacted when it has this many entries more than twice the objects in it
+    MIN_CHANGES_COMPACTION = 1024
+
+    def __init__(self : "SqliteStatusAdapter", path : str | None = None):
+        self.path = path or SQLITE_STATUS_PATH
+        self._start_pool()
+        # the pool's threads and connections don't survive a fork (eg. with gunicorn's preload_app),
+        # and the fork hook mustn't keep the adapter alive
+        start_pool = weakref.WeakMethod(self._start_pool)
+        os.register_at_fork(after_in_child=lambda: start_pool() and start_pool()())
+        with sqlite3.connect(self.path, timeout=30) as con:
+            con.execute("PRAGMA journal_mode=WAL")
+            con.executescript(SCHEMA)
+            # a token of this database, so versions of different databases never match
+            con.execute("INSERT OR IGNORE INTO meta (key, value) VALUES ('token', ?)", (uuid.uuid4().hex[:12],))
+            self.token = con.execute("SELECT value FROM meta WHERE key = 'token'").fetchone()[0]
+        con.close()
+
+
+    def _start_pool(self : "SqliteStatusAdapter") -> None:
+        self._local = threading.local()
+        self._executor = concurrent.futures.ThreadPoolExecutor(SQLITE_STATUS_THREADS, thread_name_prefix="iri-sqlite")
+
+
+    async def shutdown(self : "SqliteStatusAdapter") -> None:
+        # called when the app stops: let the running queries finish, then stop the threads
+        await asyncio.to_thread(self._executor.shutdown)
+
+
+    def _connection(self : "SqliteStatusAdapter") -> sqlite3.Connection:
+        # one connection per thread of the pool
+        con = getattr(self._local, "connection", None)
+        if con is None:
+            con = sqlite3.connect(self.path, timeout=30)
+            con.row_factory = sqlite3.Row
+            con.execute("PRAGMA synchronous=NORMAL")
+            self._local.connection = con
+        return con
+
+
+    async def _run(self : "SqliteStatusAdapter", fn : Callable, *args) -> Any:
+        return await asyncio.get_running_loop().run_in_executor(self._executor, fn, *args)
+
+
+    async def _query(self : "SqliteStatusAdapter", sql : str, params : dict | tuple = ()) -> list[sqlite3.Row]:
+        return await self._run(lambda: self._connection().execute(sql, params).fetchall())
+
+
+    @staticmethod
+    def _where(
+        name : str | None,
+        description : str | None,
+        modified_since : datetime.datetime | None,
+        q : str | None,
+        ) -> tuple[list[str], dict, str]:
+        # the conditions of the NamedResource filters, their parameters and the ORDER BY prefix of a search
+        where, params, rank = [], {}, ""
+        if name:
+            where.append("name = :name")
+            params["name"] = name
+        if description:
+            # instr is case-sensitive, like the `in` of NamedResource.find
+            where.append("instr(description, :description) > 0")
+            params["description"] = description
+        if modified_since:
+            where.append("last_modified >= :modified_since")
+            params["modified_since"] = to_micros(modified_since)
+        if q:
+            # case-insensitive substring search, the objects matching by name first
+            where.append("(instr(lower(name), lower(:q)) > 0 OR instr(lower(description), lower(:q)) > 0)")
+            params["q"] = q
+            rank = "(instr(lower(name), lower(:q)) > 0) DESC, "
+        return where, params, rank
+
+
+    @staticmethod
+    def _sql(table : str, where : list[str], order : str, offset : int, limit : int | None, params : dict) -> str:
+        params.update(offset=offset, limit=limit if limit is not None else -1)
+        condition = f"WHERE {' AND '.join(where)}" if where else ""
+        return f"SELECT * FROM {table} {condition} ORDER BY {order} LIMIT :limit OFFSET :offset"
+
+
+    @staticmethod
+    def _resource(row : sqlite3.Row) -> status_models.Resource:
+        r = status_models.Resource(
+            id=row["id"],
+            name=row["name"],
+            description=row["description"],
+            last_modified=from_micros(row["last_modified"]),
+            group=row["group"],
+            current_status=row["current_status"],
+            resource_type=row["resource_type"],
+            capability_ids=json.loads(row["capability_ids"]),
+        )
+        r._version = row["version"]
+        return r
+
+
+    @staticmethod
+    def _incident(row : sqlite3.Row) -> status_models.Incident:
+        i = status_models.Incident(
+            id=row["id"],
+            name=row["name"],
+            description=row["description"],
+            last_modified=from_micros(row["last_modified"]),
+            status=row["status"],
+            type=row["type"],
+            resolution=row["resolution"],
+            start=from_micros(row["start"]),
+            end=from_micros(row["end"]) if row["end"] is not None else None,
+            resource_ids=json.loads(row["resource_ids"]),
+            event_ids=json.loads(row["event_ids"]),
+        )
+        i._version = row["version"]
+        return i
+
+
+    @staticmethod
+    def _event(row : sqlite3.Row) -> status_models.Event:
+        e = status_models.Event(
+            id=row["id"],
+            name=row["name"],
+            description=row["description"],
+            last_modified=from_micros(row["last_modified"]),
+            occurred_at=from_micros(row["occurred_at"]),
+            status=row["status"],
+            resource_id=row["resource_id"],
+            incident_id=row["incident_id"],
+        )
+        e._version = row["version"]
+        return e
+
+
+    async def get_resources(
+        self : "SqliteStatusAdapter",
+        offset : int,
+        limit : int,
+        name : str | None = None,
+        description : str | None = None,
+        group : str | None = None,
+        modified_since : datetime.datetime | None = None,
+        resource_type : status_models.ResourceType | None = None,
+        after : tuple | None = None,
+        q : str | None = None,
+        as_of : datetime.datetime | None = None,
+        ) -> list[status_models.Resource]:
+        where, params, rank = self._where(name, description, modified_since, q)
+        if group:
+            where.append('"group" = :group')
+            params["group"] = group
+        if resource_type:
+            where.append("resource_type = :resource_type")
+            params["resource_type"] = resource_type.value
+        if after:
+            where.append("id > :after_id")
+            params["after_id"] = after[0]
+        sql = self._sql("resources", where, f"{rank}id", offset, limit, params)
+        if as_of:
+            # the status of each resource's last event at or before as_of
+            sql = sql.replace("SELECT *", """SELECT *, (
+                SELECT e.status FROM events e WHERE e.resource_id = resources.id AND e.occurred_at <= :as_of
+                ORDER BY e.occurred_at DESC, e.id DESC LIMIT 1
+            ) AS status_as_of""", 1)
+            params["as_of"] = to_micros(as_of)
+        rows = await self._query(sql, params)
+        resources = [self._resource(row) for row in rows]
+        if as_of:
+            for r, row in zip(resources, rows):
+                r.current_status = status_models.Status(row["status_as_of"] or "unknown")
+        return resources
+
+
+    async def get_resource(
+        self : "SqliteStatusAdapter",
+        id : str
+        ) -> status_models.Resource | None:
+        rows = await self._query("SELECT * FROM resources WHERE id = ?", (id,))
+        return self._resource(rows[0]) if rows else None
+
+
+    async def get_events(
+        self : "SqliteStatusAdapter",
+        incident_id : str,
+        offset : int,
+        limit : int,
+        resource_id : str | None = None,
+        name : str | None = None,
+        description : str | None = None,
+        status : status_models.Status | None = None,
+        from_ : datetime.datetime | None = None,
+        to : datetime.datetime | None = None,
+        time_ : datetime.datetime | None = None,
+        modified_since : datetime.datetime | None = None,
+        after : tuple | None = None,
+        q : str | None = None,
+        ) -> list[status_models.Event]:
+        where, params, rank = self._where(name, description, modified_since, q)
+        for column, value in (("incident_id", incident_id), ("resource_id", resource_id), ("status", status and status.value)):
+            if value:
+                where.append(f"{column} = :{column}")
+                params[column] = value
+        for condition, value in (("occurred_at >= :from", from_), ("occurred_at < :to", to), ("occurred_at = :time", time_)):
+            if value:
+                where.append(condition)
+                params[condition.rpartition(":")[2]] = to_micros(value)
+        if after:
+            where.append("(occurred_at, id) > (:after_time, :after_id)")
+            params.update(after_time=to_micros(after[0]), after_id=after[1])
+        rows = await self._query(self._sql("events", where, f"{rank}occurred_at, id", offset, limit, params), params)
+        return [self._event(row) for row in rows]
+
+
+    async def get_event(
+        self : "SqliteStatusAdapter",
+        incident_id : str,
+        id : str
+        ) -> status_models.Event | None:
+        rows = await self._query("SELECT * FROM events WHERE id = ? AND incident_id = ?", (id, incident_id))
+        return self._event(rows[0]) if rows else None
+
+
+    async def get_incidents(
+        self : "SqliteStatusAdapter",
+        offset : int,
+        limit : int,
+        name : str | None = None,
+        description : str | None = None,
+        status : status_models.Status | None = None,
+        type_ : status_models.IncidentType | None = None,
+        from_ : datetime.datetime | None = None,
+        to : datetime.datetime | None = None,
+        time_ : datetime.datetime | None = None,
+        modified_since : datetime.datetime | None = None,
+        resource_id : str | None = None,
+        after : tuple | None = None,
+        q : str | None = None,
+        ) -> list[status_models.Incident]:
+        where, params, rank = self._where(name, description, modified_since, q)
+        for column, value in (("status", status and status.value), ("type", type_ and type_.value)):
+            if value:
+                where.append(f"{column} = :{column}")
+                params[column] = value
+        if from_:
+            where.append("start >= :from")
+            params["from"] = to_micros(from_)
+        if to:
+            where.append('"end" < :to')
+            params["to"] = to_micros(to)
+        if time_:
+            where.append('start <= :time AND ("end" IS NULL OR "end" > :time)')
+            params["time"] = to_micros(time_)
+        if resource_id:
+            where.append("id IN (SELECT incident_id FROM incident_resources WHERE resource_id = :resource_id)")
+            params["resource_id"] = resource_id
+        if after:
+            where.append("(start, id) > (:after_time, :after_id)")
+            params.update(after_time=to_micros(after[0]), after_id=after[1])
+        rows = await self._query(self._sql("incidents", where, f"{rank}start, id", offset, limit, params), params)
+        return [self._incident(row) for row in rows]
+
+
+    async def get_incident(
+        self : "SqliteStatusAdapter",
+        id : str
+        ) -> status_models.Incident | None:
+        rows = await self._query("SELECT * FROM incidents WHERE id = ?", (id,))
+        return self._incident(rows[0]) if rows else None
+
+
+    async def _by_ids(self : "SqliteStatusAdapter", table : str, ids : list[str], where : str = "", params : tuple = ()) -> list[sqlite3.Row]:
+        # one primary key lookup per id in a single query, in the order of the ids
+        if not ids:
+            return []
+        rows = await self._query(f"SELECT * FROM {table} WHERE id IN ({', '.join('?' * len(ids))}){where}", (*ids, *params))
+        rows = {row["id"]: row for row in rows}
+        return [rows[id] for id in ids if id in rows]
+
+
+    async def get_resources_by_ids(
+        self : "SqliteStatusAdapter",
+        ids : list[str],
+        ) -> list[status_models.Resource]:
+        return [self._resource(row) for row in await self._by_ids("resources", ids)]
+
+
+    async def get_incidents_by_ids(
+        self : "SqliteStatusAdapter",
+        ids : list[str],
+        ) -> list[status_models.Incident]:
+        return [self._incident(row) for row in await self._by_ids("incidents", ids)]
+
+
+    async def get_events_by_ids(
+        self : "SqliteStatusAdapter",
+        incident_id : str,
+        ids : list[str],
+        ) -> list[status_models.Event]:
+        return [self._event(row) for row in await self._by_ids("events", ids, " AND incident_id = ?", (incident_id,))]
+
+
+    async def get_incidents_events(
+        self : "SqliteStatusAdapter",
+        incident_ids : list[str],
+        limit : int,
+        ) -> dict[str, list[status_models.Event]]:
+        # one query for the whole page: each incident's first events from the (incident_id, occurred_at, id) index
+        events = {id: [] for id in incident_ids}
+        if not incident_ids:
+            return events
+        rows = await self._query(
+            "SELECT * FROM (SELECT *, row_number() OVER (PARTITION BY incident_id ORDER BY occurred_at, id) AS n "
+            f"FROM events WHERE incident_id IN ({', '.join('?' * len(incident_ids))})) WHERE n <= ? ORDER BY incident_id, n",
+            (*incident_ids, limit),
+        )
+        for row in rows:
+            events[row["incident_id"]].append(self._event(row))
+        return events
+
+
+    async def get_version(
+        self : "SqliteStatusAdapter",
+        collection : str,
+        ) -> tuple[str, datetime.datetime | None]:
+        # both are answered from the indexes; the compaction may drop the latest change of a removed object,
+        # so the version is at least the sequence number the compaction took then
+        rows = await self._query(
+            f"SELECT max(coalesce((SELECT max(seq) FROM changes WHERE collection = ?), 0), {self._HEAD}), "
+            f"(SELECT max(last_modified) FROM {collection})",
+            (collection,),
+        )
+        seq, last_modified = rows[0]
+        return f"{self.token}-{seq}", from_micros(last_modified) if last_modified is not None else None
+
+
+    async def get_changes(
+        self : "SqliteStatusAdapter",
+        since : str | None,
+        limit : int,
+        ) -> status_models.StatusChanges:
+        # watermarks are "<database token>-<change sequence number>", like those of the status store
+        return await self._run(self._changes, since, limit)
+
+
+    def _changes(self : "SqliteStatusAdapter", since : str | None, limit : int) -> status_models.StatusChanges:
+        con = self._connection()
+        with con:
+            # a read transaction, so the window and its objects are from the same snapshot
+            con.execute("BEGIN")
+            last_seq, head = con.execute(f"SELECT {self._LAST_SEQ}, {self._HEAD}").fetchone()
+            seq, reset = 0, False
+            if since:
+                token, _, n = since.rpartition("-")
+                # watermarks before the head may hold objects removed since, like those of the status store
+                if token == self.token and n.isdigit() and head <= int(n) <= last_seq:
+                    seq = int(n)
+                else:
+                    reset = True
+            window = con.execute("SELECT seq, collection, id FROM changes WHERE seq > ? ORDER BY seq LIMIT ?", (seq, limit + 1)).fetchall()
+            more = len(window) > limit
+            window = window[:limit]
+            ids = {"resources": {}, "incidents": {}, "events": {}}
+            for _, collection, id in window:
+                ids[collection][id] = None
+            objs = {}
+            for collection, make in (("resources", self._resource), ("incidents", self._incident), ("events", self._event)):
+                rows = {}
+                keys = list(ids[collection])
+                # stay under SQLite's limit of bound parameters
+                for i in range(0, len(keys), 500):
+                    chunk = keys[i:i + 500]
+                    sql = f"SELECT * FROM {collection} WHERE id IN ({', '.join('?' * len(chunk))})"
+                    rows.update((row["id"], row) for row in con.execute(sql, chunk))
+                objs[collection] = [make(rows[id]) for id in keys if id in rows]
+        last = window[-1][0] if more else last_seq
+        return status_models.StatusChanges(
+            watermark=f"{self.token}-{last}",
+            reset=reset,
+            more=more,
+            **objs,
+        )
+
+
+    # the last change sequence number given (even if its change was compacted away),
+    # and the head of the changes: the sequence number taken when the compaction dropped the changes of removed objects
+    _LAST_SEQ = "coalesce((SELECT seq FROM sqlite_sequence WHERE name = 'changes'), 0)"
+    _HEAD = "coalesce((SELECT CAST(value AS INTEGER) FROM meta WHERE key = 'change_head'), 0)"
+
+    def compact_changes(self : "SqliteStatusAdapter") -> None:
+        """Keep the latest change of each object in the changes table (also done as the table grows)"""
+        con = self._connection()
+        with con:
+            con.execute("BEGIN IMMEDIATE")
+            self._compact_changes(con)
+
+
+    def _compact_changes(self : "SqliteStatusAdapter", con : sqlite3.Connection) -> None:
+        # the changes of objects removed from their table (eg. by the facility's own tools), then the older changes of each object;
+        # dropping older changes doesn't change what a sync gets (the latest version, whatever its watermark)
+        removed = 0
+        for collection in ("resources", "incidents", "events"):
+            removed += con.execute(f"DELETE FROM changes WHERE collection = ? AND id NOT IN (SELECT id FROM {collection})", (collection,)).rowcount
+        con.execute("DELETE FROM changes WHERE seq NOT IN (SELECT max(seq) FROM changes GROUP BY collection, id)")
+        if removed:
+            # syncs from before may hold the removed objects, so their watermarks reset the sync;
+            # the removal takes a sequence number, so the watermarks from after it don't
+            con.execute("UPDATE sqlite_sequence SET seq = seq + 1 WHERE name = 'changes'")
+            con.execute(f"INSERT OR REPLACE INTO meta (key, value) VALUES ('change_head', {self._LAST_SEQ})")
+        con.execute(
+            f"INSERT OR REPLACE INTO meta (key, value) VALUES ('compact_changes_at', {self._LAST_SEQ} + (SELECT count(*) FROM changes) + ?)",
+            (self.MIN_CHANGES_COMPACTION,),
+        )
+
+
+    def _compact_changes_if_due(self : "SqliteStatusAdapter", con : sqlite3.Connection) -> None:
+        # when the changes since the last compaction outnumber the changes it kept by MIN_CHANGES_COMPACTION
+        due = con.execute(
+            f"SELECT {self._LAST_SEQ} >= coalesce((SELECT CAST(value AS INTEGER) FROM meta WHERE key = 'compact_changes_at'), ?)",
+            (self.MIN_CHANGES_COMPACTION,),
+        ).fetchone()[0]
+        if due:
+            self._compact_changes(con)
+
+
+    async def get_availability(
+        self : "SqliteStatusAdapter",
+        resource_id : str,
+        boundaries : list[datetime.datetime],
+        ) -> list[status_models.AvailabilityBucket]:
+        # the resource's timeline over the window: its last event before the window and the events in it
+        params = {"resource_id": resource_id, "start": to_micros(boundaries[0]), "end": to_micros(boundaries[-1])}
+        rows = await self._query("""
+            SELECT * FROM (
+                SELECT * FROM events WHERE resource_id = :resource_id AND occurred_at <= :start
+                ORDER BY occurred_at DESC, id DESC LIMIT 1
+            )
+            UNION ALL
+            SELECT * FROM events WHERE resource_id = :resource_id AND occurred_at > :start AND occurred_at < :end
+            """, params)
+        timeline = status_store.StatusTimeline()
+        for row in rows:
+            timeline.add(self._event(row))
+        return [
+            status_models.AvailabilityBucket(start=start, end=end, **{s.value: d[s] for s in d})
+            for start, end, d in zip(boundaries, boundaries[1:], timeline.durations(boundaries))
+        ]
+
+
+    async def ingest_events(
+        self : "SqliteStatusAdapter",
+        events : list[status_models.Event],
+        ) -> status_models.EventBatchResult:
+        return await self._run(self._ingest, events)
+
+
+    def _ingest(self : "SqliteStatusAdapter", events : list[status_models.Event]) -> status_models.EventBatchResult:
+        # the events, their resources' statuses and their incidents are read and written in a single transaction
+        now = datetime.datetime.now(datetime.timezone.utc)
+        events = sorted(events, key=lambda e: (to_micros(e.occurred_at), e.id))
+        con = self._connection()
+        with con:
+            # sqlite3 would only begin the transaction at the first write: take the write lock before the reads,
+            # so that concurrent batches (from this process's threads or another worker) don't lose each other's updates
+            con.execute("BEGIN IMMEDIATE")
+            latest = {e.resource_id: e for e in events}
+            resources = []
+            for resource_id, e in latest.items():
+                row = con.execute("""
+                    SELECT *, (SELECT max(occurred_at) FROM events WHERE resource_id = resources.id) AS latest
+                    FROM resources WHERE id = ?
+                    """, (resource_id,)).fetchone()
+                # an older event doesn't change the current status
+                if row and (row["latest"] is None or row["latest"] <= to_micros(e.occurred_at)):
+                    resources.append(self._resource(row).model_copy(update={"current_status": e.status, "last_modified": now}))
+            # the ids each incident gains, and loses to events moved to another incident (the last version of an event wins)
+            batch = {e.id: e for e in events}
+            ids = list(batch)
+            old_incidents = {}
+            for k in range(0, len(ids), 500):
+                chunk = ids[k:k + 500]
+                old_incidents.update(con.execute(
+                    f"SELECT id, incident_id FROM events WHERE id IN ({', '.join('?' * len(chunk))}) AND incident_id IS NOT NULL", chunk,
+                ).fetchall())
+            added, removed = {}, {}
+            for e in batch.values():
+                old = old_incidents.get(e.id)
+                if old and old != e.incident_id:
+                    removed.setdefault(old, set()).add(e.id)
+                if e.incident_id:
+                    added.setdefault(e.incident_id, []).append(e.id)
+            incidents = []
+            for incident_id in dict.fromkeys([*added, *removed]):
+                row = con.execute("SELECT * FROM incidents WHERE id = ?", (incident_id,)).fetchone()
+                if row:
+                    i = self._incident(row)
+                    gone, known = removed.get(incident_id, set()), set(i.event_ids)
+                    event_ids = [id for id in i.event_ids if id not in gone] + [id for id in added.get(incident_id, []) if id not in known]
+                    incidents.append(i.model_copy(update={"event_ids": event_ids, "last_modified": now}))
+            self._write_all(con, "events", events, self._write_event)
+            self._write_all(con, "incidents", incidents, self._write_incident)
+            self._write_all(con, "resources", resources, self._write_resource)
+            self._compact_changes_if_due(con)
+        return status_models.EventBatchResult(events=len(events), resources=len(resources), incidents=len(incidents))
+
+
+    def _write(self : "SqliteStatusAdapter", collection : str, objs : Iterable, write : Callable[[sqlite3.Connection, Any, int], None]) -> None:
+        con = self._connection()
+        with con:
+            self._write_all(con, collection, objs, write)
+            self._compact_changes_if_due(con)
+
+
+    @staticmethod
+    def _write_all(con : sqlite3.Connection, collection : str, objs : Iterable, write : Callable[[sqlite3.Connection, Any, int], None]) -> None:
+        # each object gets a new change sequence number as its version
+        for obj in objs:
+            seq = con.execute("INSERT INTO changes (collection, id) VALUES (?, ?)", (collection, obj.id)).lastrowid
+            write(con, obj, seq)
+
+
+    @staticmethod
+    def _write_resource(con : sqlite3.Connection, r : status_models.Resource, seq : int) -> None:
+        con.execute(
+            "INSERT OR REPLACE INTO resources VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (
+                r.id, r.name, r.description, to_micros(r.last_modified), seq, r.group,
+                r.current_status.value if r.current_status else None, r.resource_type.value, json.dumps(r.capability_ids),
+            ),
+        )
+
+
+    @staticmethod
+    def _write_incident(con : sqlite3.Connection, i : status_models.Incident, seq : int) -> None:
+        con.execute(
+            "INSERT OR REPLACE INTO incidents VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (
+                i.id, i.name, i.description, to_micros(i.last_modified), seq, i.status.value, i.type.value, i.resolution.value,
+                to_micros(i.start), to_micros(i.end) if i.end else None, json.dumps(i.resource_ids), json.dumps(i.event_ids),
+            ),
+        )
+        con.execute("DELETE FROM incident_resources WHERE incident_id = ?", (i.id,))
+        con.executemany("INSERT OR IGNORE INTO incident_resources VALUES (?, ?)", [(r, i.id) for r in i.resource_ids])
+
+
+    @staticmethod
+    def _write_event(con : sqlite3.Connection, e : status_models.Event, seq : int) -> None:
+        con.execute(
+            "INSERT OR REPLACE INTO events VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (
+                e.id, e.name, e.description, to_micros(e.last_modified), seq,
+                to_micros(e.occurred_at), e.status.value, e.resource_id, e.incident_id,
+            ),
+        )
+
+
+    def add_resources(self : "SqliteStatusAdapter", resources : Iterable[status_models.Resource]) -> None:
+        """Add or replace resources"""
+        self._write("resources", resources, self._write_resource)
+
+
+    def add_incidents(self : "SqliteStatusAdapter", incidents : Iterable[status_models.Incident]) -> None:
+        """Add or replace incidents"""
+        self._write("incidents", incidents, self._write_incident)
+
+
+    def add_events(self : "SqliteStatusAdapter", events : Iterable[status_models.Event]) -> None:
+        """Add or replace events"""
+        self._write("events", events, self._write_event)
+
+
+if __name__ == "__main__":
+    # fill a database with the demo adapter's data
+    from .demo_adapter import DemoAdapter
+    store = DemoAdapter().status_store
+    adapter = SqliteStatusAdapter(sys.argv[1] if len(sys.argv) > 1 else None)
+    adapter.add_resources(store.resources.all)
+    adapter.add_incidents(store.incidents.all)
+    adapter.add_events(store.find_events())
+    print(f"Added {len(store.resources)} resources, {len(store.incidents)} incidents and {len(store.events)} events to {adapter.path}")
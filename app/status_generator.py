@@ -0,0 +1,255 @@
+import argparse
+import datetime
+import itertools
+import os
+import random
+import time
+import uuid
+from typing import Any
+from .routers.status import models as status_models, store as status_store, columns as status_columns, partitions as status_partitions, serialization
+
+GEN_SEED = int(os.environ.get("IRI_STATUS_GEN_SEED", "0"))
+GEN_RESOURCES = int(os.environ.get("IRI_STATUS_GEN_RESOURCES", "100"))
+GEN_INCIDENTS = int(os.environ.get("IRI_STATUS_GEN_INCIDENTS", "1000"))
+GEN_EVENTS = int(os.environ.get("IRI_STATUS_GEN_EVENTS", "100000"))
+GEN_DAYS = float(os.environ.get("IRI_STATUS_GEN_DAYS", "365"))
+
+# (group, type, name) of the resources of each generated system
+RESOURCE_KINDS = [
+    ("compute", status_models.ResourceType.compute, "compute nodes"),
+    ("compute", status_models.ResourceType.system, "login nodes"),
+    ("storage", status_models.ResourceType.storage, "file system"),
+    ("storage", status_models.ResourceType.storage, "tape archive"),
+    ("services", status_models.ResourceType.service, "api"),
+    ("services", status_models.ResourceType.website, "web portal"),
+    ("network", status_models.ResourceType.network, "network"),
+]
+
+
+class StatusGenerator:
+    """
+        Deterministic synthetic status data, to benchmark the status queries at scale.
+
+        The same seed and sizes always give the same resources, incidents and events (ids included).
+        Events arrive as a Poisson process over `days`, spread over the resources with a skewed (Zipf-like) rate,
+        so a few resources are much noisier than the others.
+        Each resource alternates between being up and outages: an event of an up resource starts an outage
+        (degraded or down, and a new incident) with the probability giving about `incidents` incidents,
+        and outages last a geometric number of events (4 on average) before the resource is up again.
+        Some incidents also impact other resources of the same group.
+        The defaults come from the `IRI_STATUS_GEN_*` environment variables.
+    """
+
+    MEAN_OUTAGE_EVENTS = 4
+
+    def __init__(
+        self : "StatusGenerator",
+        seed : int = GEN_SEED,
+        resources : int = GEN_RESOURCES,
+        incidents : int = GEN_INCIDENTS,
+        events : int = GEN_EVENTS,
+        days : float = GEN_DAYS,
+        start : datetime.datetime = datetime.datetime(2025, 1, 1, tzinfo=datetime.timezone.utc),
+        capability_ids : list[str] | None = None,
+        ):
+        self.rng = random.Random(seed)
+        self.resource_count = resources
+        self.incident_count = incidents
+        self.event_count = events
+        self.days = days
+        self.start = start
+        self.capability_ids = list(capability_ids or [])
+
+
+    def _id(self : "StatusGenerator") -> str:
+        # uuid4-like ids from the seeded generator
+        return str(uuid.UUID(int=self.rng.getrandbits(128), version=4))
+
+
+    def resources(self : "StatusGenerator") -> list[status_models.Resource]:
+        resources = []
+        for k in range(self.resource_count):
+            group, resource_type, name = RESOURCE_KINDS[k % len(RESOURCE_KINDS)]
+            system = k // len(RESOURCE_KINDS)
+            resources.append(status_models.Resource(
+                id=self._id(),
+                group=f"{group}-{system}",
+                name=f"{name} {system}",
+                description=f"the {name} of system {system}",
+                capability_ids=self.rng.sample(self.capability_ids, min(len(self.capability_ids), self.rng.randint(0, 2))),
+                current_status=status_models.Status.up,
+                last_modified=self.start,
+                resource_type=resource_type,
+            ))
+        return resources
+
+
+    def generate(self : "StatusGenerator", target : Any, batch_size : int = 10_000) -> None:
+        """
+            Stream the data into `target`, anything with `add_resources`, `add_incidents` and `add_events`
+            (eg. a `StatusStore` or the SQLite status adapter), `batch_size` events at a time.
+            Incidents are added once they're over (or at the end if they're still ongoing),
+            and the resources are added again at the end with their final status.
+        """
+        rng = self.rng
+        resources = self.resources()
+        target.add_resources(resources)
+        if not resources:
+            return
+        weights = [1 / (i + 1) ** 0.8 for i in range(len(resources))]
+        rng.shuffle(weights)
+        cum_weights = list(itertools.accumulate(weights))
+        groups = {}
+        for r in resources:
+            groups.setdefault(r.group, []).append(r.id)
+        rate = self.event_count / (self.days * 86400)
+        # the events of outages don't start incidents
+        p_incident = min(1.0, self.incident_count / max(1, self.event_count - self.incident_count * self.MEAN_OUTAGE_EVENTS))
+
+        statuses = {r.id: status_models.Status.up for r in resources}
+        ongoing = {}
+        events, incidents = [], []
+        t = self.start
+        for _ in range(self.event_count):
+            t += datetime.timedelta(seconds=rng.expovariate(rate))
+            r = rng.choices(resources, cum_weights=cum_weights)[0]
+            incident = ongoing.get(r.id)
+            if incident is None:
+                status = status_models.Status.up
+                if rng.random() < p_incident:
+                    status = status_models.Status.down if rng.random() < 0.3 else status_models.Status.degraded
+                    incident = self._incident(r, status, t, groups[r.group])
+                    ongoing[r.id] = incident
+            elif rng.random() < 1 / self.MEAN_OUTAGE_EVENTS:
+                status = status_models.Status.up
+                incident.end = t
+                incident.resolution = status_models.Resolution.extended if rng.random() < 0.1 else status_models.Resolution.completed
+                incident.last_modified = t
+                incidents.append(ongoing.pop(r.id))
+            else:
+                status = statuses[r.id]
+                if rng.random() < 0.2:
+                    status = status_models.Status.down if status == status_models.Status.degraded else status_models.Status.degraded
+                incident.status = status
+                incident.last_modified = t
+            statuses[r.id] = status
+
+            # the values are valid by construction, so the models are built without validation
+            event = status_models.Event.model_construct(
+                id=self._id(),
+                name=f"{r.name} is {status.value}",
+                description=f"{r.name} is {status.value}",
+                occurred_at=t,
+                status=status,
+                resource_id=r.id,
+                incident_id=incident.id if incident else None,
+                last_modified=t,
+            )
+            if incident:
+                incident.event_ids.append(event.id)
+            events.append(event)
+            if len(events) >= batch_size:
+                target.add_events(events)
+                target.add_incidents(incidents)
+                events, incidents = [], []
+
+        target.add_events(events)
+        target.add_incidents(incidents + list(ongoing.values()))
+        target.add_resources([r.model_copy(update={"current_status": statuses[r.id], "last_modified": t}) for r in resources])
+
+
+    def _incident(
+        self : "StatusGenerator",
+        r : status_models.Resource,
+        status : status_models.Status,
+        t : datetime.datetime,
+        group : list[str],
+        ) -> status_models.Incident:
+        resource_ids = [r.id]
+        others = [id for id in group if id != r.id]
+        if others and self.rng.random() < 0.3:
+            resource_ids += self.rng.sample(others, self.rng.randint(1, min(2, len(others))))
+        dstr = t.strftime("%Y-%m-%d %H:%M:%S.%f%z")
+        return status_models.Incident(
+            id=self._id(),
+            name=f"{r.name} incident at {dstr}",
+            description=f"{r.name} incident at {dstr}",
+            status=status,
+            event_ids=[],
+            resource_ids=resource_ids,
+            start=t,
+            end=None,
+            type=status_models.IncidentType.planned if self.rng.random() < 0.15 else status_models.IncidentType.unplanned,
+            resolution=status_models.Resolution.unresolved,
+            last_modified=t,
+        )
+
+
+def benchmark(store : status_store.StatusStore, repeat : int = 20) -> dict[str, float]:
+    """Time some typical queries of the status endpoints on a filled store, in milliseconds per call"""
+    rng = random.Random(0)
+    resource = rng.choice(store.resources.all)
+    events = store.find_events(0, None, resource_id=resource.id)
+    middle = events[len(events) // 2].occurred_at if events else None
+    serializer = serialization.SerializationCache()
+    cases = {
+        "first page of events": lambda: store.find_events(0, 100),
+        "events of a resource in a day": lambda: store.find_events(0, 100, resource_id=resource.id, from_=middle, to=middle + datetime.timedelta(days=1)),
+        "events by description": lambda: store.find_events(0, 100, description=f"{resource.name} is down"),
+        "events by status, deep offset": lambda: store.find_events(10_000, 100, status=status_models.Status.down),
+        "incidents active at a time": lambda: store.find_incidents(0, 100, time_=middle),
+        "incidents of a resource": lambda: store.find_incidents(0, 100, resource_id=resource.id),
+        "serialize a page of events": lambda: serializer.response(store.find_events(0, 100, resource_id=resource.id)),
+    }
+    timings = {}
+    for name, case in cases.items():
+        if middle is None and "time" in name:
+            continue
+        t0 = time.perf_counter()
+        for _ in range(repeat):
+            case()
+        timings[name] = (time.perf_counter() - t0) / repeat * 1000
+    return timings
+
+
+def main(argv : list[str] | None = None) -> None:
+    parser = argparse.ArgumentParser(description="Generate synthetic status data, into memory or a SQLite database")
+    parser.add_argument("--seed", type=int, default=GEN_SEED)
+    parser.add_argument("--resources", type=int, default=GEN_RESOURCES)
+    parser.add_argument("--incidents", type=int, default=GEN_INCIDENTS)
+    parser.add_argument("--events", type=int, default=GEN_EVENTS)
+    parser.add_argument("--days", type=float, default=GEN_DAYS)
+    parser.add_argument("--sqlite", metavar="PATH", help="fill this SQLite database (see app.sqlite_status_adapter) rather than a status store")
+    parser.add_argument("--columnar", action="store_true", help="keep the events of the status store in columns")
+    parser.add_argument("--partitioned", action="store_true", help="keep the events of the status store in monthly partitions")
+    parser.add_argument("--benchmark", action="store_true", help="time some queries on the status store")
+    args = parser.parse_args(argv)
+    if args.sqlite:
+        # these only apply to a status store
+        for flag in ("columnar", "partitioned", "benchmark"):
+            if getattr(args, flag):
+                parser.error(f"--{flag} can't be combined with --sqlite")
+    if args.columnar and args.partitioned:
+        parser.error("--columnar can't be combined with --partitioned")
+
+    generator = StatusGenerator(args.seed, args.resources, args.incidents, args.events, args.days)
+    if args.sqlite:
+        from .sqlite_status_adapter import SqliteStatusAdapter
+        target = SqliteStatusAdapter(args.sqlite)
+    else:
+        events = None
+        if args.partitioned:
+            events = status_partitions.PartitionedEvents()
+        elif args.columnar:
+            events = status_columns.EventColumns()
+        target = status_store.StatusStore(events)
+    t0 = time.perf_counter()
+    generator.generate(target)
+    print(f"Generated {args.resources} resources, {args.events} events and about {args.incidents} incidents in {time.perf_counter() - t0:.1f}s")
+    if args.benchmark:
+        for name, ms in benchmark(target).items():
+            print(f"{name:40} {ms:10.3f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,4 +1,6 @@
+import gc
 import logging
+import os
 
 logging.basicConfig()
 logging.getLogger().setLevel(logging.INFO)
@@ -7,3 +9,22 @@ workers = 8
 worker_class = "uvicorn.workers.UvicornWorker" 
 bind = "0.0.0.0:8000"
 timeout = 60
+
+# Load the app (and build the adapters' state) once in the master rather than in every worker.
+# The workers then share the master's memory copy-on-write: the garbage collector is off while loading,
+# so no holes are left in the pages, and the loaded objects are frozen before forking,
+# so the workers' collections never write to them.
+preload_app = os.environ.get("IRI_PRELOAD_APP") in ["true", "1", "on", "yes"]
+
+if preload_app:
+    gc.disable()
+
+
+def pre_fork(server, worker):
+    if preload_app:
+        gc.freeze()
+
+
+def post_fork(server, worker):
+    if preload_app:
+        gc.enable()